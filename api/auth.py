@@ -0,0 +1,193 @@
+import os
+import hmac
+import time
+import hashlib
+from collections import OrderedDict
+
+# typing_extensions
+from typing_extensions import Dict, Optional, Tuple
+
+# fastapi
+from fastapi import HTTPException, status
+from starlette.requests import HTTPConnection
+
+# jwt
+from jwt import decode
+from jwt.exceptions import InvalidTokenError, ExpiredSignatureError
+
+# redis ops
+from api import redis_ops
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+SECRET_KEY = os.environ.get('JWT_SECRET_KEY')
+ALGORITHM = os.environ.get('ALGORITHM')
+AUTH_COOKIE_NAME = "auth_token"
+VERIFIED_TOKEN_CACHE_SIZE = int(os.environ.get("VERIFIED_TOKEN_CACHE_SIZE", 10_000))
+# how long a token found not revoked is trusted without asking Redis again; a token
+# revoked on another worker is still accepted here for at most this long
+REVOCATION_CHECK_TTL = float(os.environ.get("REVOCATION_CHECK_TTL", 5))
+# bearer token of the metrics scraper; without one, /metrics only answers local clients
+METRICS_TOKEN = os.environ.get("METRICS_TOKEN", "")
+LOOPBACK_HOSTS = ("127.0.0.1", "::1")
+
+
+def token_digest(token: str) -> str:
+    return hashlib.sha256(token.encode()).hexdigest()
+
+
+class VerifiedTokenCache:
+    """
+    Bounded LRU of verified JWT claims, keyed by a digest of the token.
+
+    An entry expires at the token's own `exp`, so a cached token is never
+    accepted for longer than the signature check would have accepted it.
+    It also remembers until when the token is known not to be revoked, so
+    the revocation list in Redis is asked at most every `revocation_ttl`.
+    """
+
+    def __init__(self, max_size: int = VERIFIED_TOKEN_CACHE_SIZE, revocation_ttl: float = REVOCATION_CHECK_TTL):
+        self.max_size = max_size
+        self.revocation_ttl = revocation_ttl
+        self._entries: "OrderedDict[str, Tuple[dict, float]]" = OrderedDict()
+        self._not_revoked_until: Dict[str, float] = {}
+        self.hits = 0
+        self.misses = 0
+        self.revocation_lookups = 0
+        self.revocation_fail_open = 0
+
+    def get(self, digest: str) -> Optional[dict]:
+        entry = self._entries.get(digest)
+        if entry is None:
+            self.misses += 1
+            return None
+        claims, expires_at = entry
+        if expires_at <= time.time():
+            self.discard(digest)
+            self.misses += 1
+            return None
+        self._entries.move_to_end(digest)
+        self.hits += 1
+        return claims
+
+    def put(self, digest: str, claims: dict, expires_at: float):
+        self._entries[digest] = (claims, expires_at)
+        self._entries.move_to_end(digest)
+        while len(self._entries) > self.max_size:
+            evicted, _ = self._entries.popitem(last=False)
+            self._not_revoked_until.pop(evicted, None)
+
+    def discard(self, digest: str):
+        self._entries.pop(digest, None)
+        self._not_revoked_until.pop(digest, None)
+
+    def known_not_revoked(self, digest: str) -> bool:
+        return self._not_revoked_until.get(digest, 0.0) > time.time()
+
+    def mark_not_revoked(self, digest: str):
+        if digest in self._entries:
+            self._not_revoked_until[digest] = time.time() + self.revocation_ttl
+
+    def metrics(self) -> dict:
+        return {
+            "size": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "revocation_lookups": self.revocation_lookups,
+            "revocation_fail_open": self.revocation_fail_open,
+        }
+
+
+verified_tokens = VerifiedTokenCache()
+
+
+def verify_token(token: str) -> Tuple[dict, float]:
+    """Check the signature and expiry of a token; return its claims and expiry time."""
+    try:
+        payload = decode(token, SECRET_KEY, algorithms=[ALGORITHM], options={"require": ["exp"]})
+    except ExpiredSignatureError:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Token has expired")
+    except InvalidTokenError as e:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail=f"Invalid token: {str(e)}")
+
+    claims = {
+        "user_id": payload.get("user_id"),
+        "email": payload.get("email"),
+    }
+    return claims, float(payload["exp"])
+
+
+async def is_revoked(digest: str) -> Optional[bool]:
+    """Whether the token is on the revocation list; None if Redis could not be asked."""
+    verified_tokens.revocation_lookups += 1
+    try:
+        return await redis_ops.is_token_revoked(digest)
+    except Exception as e:
+        # Redis being unavailable should not log every user out, so the token is let through
+        verified_tokens.revocation_fail_open += 1
+        print(f"Error checking token revocation, accepting the token: {str(e)}")
+        return None
+
+
+async def get_authenticated_user(connection: HTTPConnection) -> dict:
+    """
+    Auth dependency shared by HTTP and WebSocket routes.
+
+    A token seen before is served from the verified-token cache and skips the
+    signature check. The revocation list is asked at most every
+    REVOCATION_CHECK_TTL seconds per token, and always after a failed lookup.
+    """
+    token = connection.cookies.get(AUTH_COOKIE_NAME)
+    if not token:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Not authenticated")
+
+    digest = token_digest(token)
+    claims = verified_tokens.get(digest)
+    if claims is None:
+        claims, expires_at = verify_token(token)
+        verified_tokens.put(digest, claims, expires_at)
+
+    if not verified_tokens.known_not_revoked(digest):
+        revoked = await is_revoked(digest)
+        if revoked:
+            verified_tokens.discard(digest)
+            raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Token has been revoked")
+        if revoked is not None:
+            # a fail-open answer is not cached, so the next request asks Redis again
+            verified_tokens.mark_not_revoked(digest)
+
+    return claims
+
+
+def require_metrics_access(connection: HTTPConnection):
+    """
+    Auth dependency of the operational endpoints, which are for scrapers, not users.
+
+    With METRICS_TOKEN set the request needs it as a bearer token. Otherwise
+    only direct loopback clients get in; a proxied request is refused even
+    when the proxy runs on this host.
+    """
+    if METRICS_TOKEN:
+        scheme, _, token = connection.headers.get("Authorization", "").partition(" ")
+        if scheme.lower() != "bearer" or not hmac.compare_digest(token.encode(), METRICS_TOKEN.encode()):
+            raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Not authenticated")
+        return
+
+    proxied = "x-forwarded-for" in connection.headers or "forwarded" in connection.headers
+    if proxied or connection.client is None or connection.client.host not in LOOPBACK_HOSTS:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Metrics are only served to local clients")
+
+
+async def revoke_token(token: str):
+    """Revoke a token until it would have expired anyway."""
+    digest = token_digest(token)
+    verified_tokens.discard(digest)
+    try:
+        payload = decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+    except InvalidTokenError:
+        return  # expired or invalid tokens are rejected anyway
+
+    ttl = int(payload["exp"] - time.time()) + 1 if "exp" in payload else None
+    await redis_ops.revoke_token(digest, ttl=ttl)
@@ -0,0 +1,130 @@
+"""
+Compare the legacy JSON conversation records with the v1 msgpack codec.
+
+    python -m api.bench_redis_codec                 # encoding only, no server needed
+    python -m api.bench_redis_codec --redis         # also write to REDIS_URL
+
+Reports bytes per conversation and ops/s for both encodings. With --redis it
+also writes conversations the old way (one round trip per key, JSON) and the
+new way (one MULTI per conversation, msgpack) under a throwaway key prefix,
+and reports the server-side MEMORY USAGE per conversation.
+
+The codec is there for its size: a v1 record is about 72 bytes against
+130 for JSON. Encode and decode rates of the two are close, and which one
+is ahead changes from run to run, so they are not a reason for the switch.
+"""
+import sys
+import json
+import time
+import uuid
+import asyncio
+import argparse
+from datetime import datetime, timedelta
+
+from api.conversation_codec import encode_conversation, decode_conversation
+
+
+TOPICS = ["Breakup Support", "Exam Stress", "Career Advice", "Just Vibing", "New conversation"]
+
+
+def sample_conversations(count: int) -> list:
+    start = datetime.now() - timedelta(days=365)
+    conversations = []
+    for i in range(count):
+        conversation_id = str(uuid.uuid4())
+        conversations.append((conversation_id, {
+            "name": f"Conversation {conversation_id}",
+            "timestamp": (start + timedelta(minutes=i)).isoformat(),
+            "topic": TOPICS[i % len(TOPICS)],
+        }))
+    return conversations
+
+
+def rate(count: int, seconds: float) -> str:
+    return f"{count / seconds:,.0f} ops/s" if seconds else "n/a"
+
+
+def bench_encoding(conversations: list):
+    legacy = [json.dumps(data).encode() for _, data in conversations]
+    current = [encode_conversation(data) for _, data in conversations]
+    count = len(conversations)
+
+    print(f"{count} conversations")
+    print(f"  bytes/conversation   json: {sum(map(len, legacy)) / count:.1f}   msgpack v1: {sum(map(len, current)) / count:.1f}")
+
+    start = time.perf_counter()
+    for _, data in conversations:
+        json.dumps(data)
+    json_encode = time.perf_counter() - start
+    start = time.perf_counter()
+    for _, data in conversations:
+        encode_conversation(data)
+    v1_encode = time.perf_counter() - start
+    print(f"  encode               json: {rate(count, json_encode)}   msgpack v1: {rate(count, v1_encode)}")
+
+    start = time.perf_counter()
+    for raw in legacy:
+        decode_conversation(raw)
+    json_decode = time.perf_counter() - start
+    start = time.perf_counter()
+    for raw in current:
+        decode_conversation(raw)
+    v1_decode = time.perf_counter() - start
+    print(f"  decode               json: {rate(count, json_decode)}   msgpack v1: {rate(count, v1_decode)}")
+
+
+async def bench_redis(conversations: list):
+    from api import redis_ops
+
+    await redis_ops.initialize_redis()
+    client = redis_ops.redis_binary_client
+    prefix = f"bench:{uuid.uuid4().hex[:8]}"
+    count = len(conversations)
+    try:
+        # before: user hash and conversation hash written in separate round trips, JSON values
+        user_key = f"{prefix}:legacy"
+        start = time.perf_counter()
+        for conversation_id, data in conversations:
+            await client.hset(user_key, mapping={"user_email": "bench@example.com"})
+            await client.hset(f"{user_key}:conversations", conversation_id, json.dumps(data))
+        legacy_seconds = time.perf_counter() - start
+        legacy_bytes = await client.memory_usage(f"{user_key}:conversations")
+
+        # after: one MULTI per conversation, msgpack values and the activity index
+        user_key = f"{prefix}:current"
+        start = time.perf_counter()
+        for conversation_id, data in conversations:
+            async with client.pipeline(transaction=True) as pipe:
+                pipe.hset(user_key, mapping={"user_email": "bench@example.com"})
+                pipe.hset(f"{user_key}:conversations", conversation_id, encode_conversation(data))
+                pipe.zadd(f"{user_key}:conversations:by_activity", {conversation_id: redis_ops.conversation_score(data)})
+                await pipe.execute()
+        current_seconds = time.perf_counter() - start
+        current_bytes = await client.memory_usage(f"{user_key}:conversations")
+        index_bytes = await client.memory_usage(f"{user_key}:conversations:by_activity")
+
+        print(f"redis {redis_ops.REDIS_URL}")
+        print(f"  writes               before: {rate(count, legacy_seconds)}   after: {rate(count, current_seconds)}")
+        print(f"  hash bytes/conv.     before: {legacy_bytes / count:.1f}   after: {current_bytes / count:.1f}"
+              f"   (+ index {index_bytes / count:.1f})")
+    finally:
+        keys = [key async for key in client.scan_iter(match=f"{prefix}:*")]
+        if keys:
+            await client.delete(*keys)
+        await redis_ops.close_redis_connection()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--count", type=int, default=10_000)
+    parser.add_argument("--redis", action="store_true", help="also benchmark writes against REDIS_URL")
+    args = parser.parse_args(argv)
+
+    conversations = sample_conversations(args.count)
+    bench_encoding(conversations)
+    if args.redis:
+        asyncio.run(bench_redis(conversations))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
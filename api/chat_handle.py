@@ -2,12 +2,12 @@
 from .llm_chains import *
 
 import os 
-import aiohttp
 import random
+import asyncio
 from urllib.parse import urlencode
 
 # typing_extensions
-from typing_extensions import Union, Optional, TypedDict, Annotated, List
+from typing_extensions import Union, Optional, TypedDict, Annotated, List, Sequence
 
 # checkpointer and store
 from langgraph.prebuilt import InjectedStore, InjectedState
@@ -19,6 +19,7 @@ from langgraph.prebuilt.chat_agent_executor import AgentState
 
 # langgraph
 from langgraph.prebuilt import create_react_agent
+from langgraph.config import get_stream_writer
 
 
 # langchain
@@ -27,45 +28,84 @@ from langchain_core.runnables import RunnableConfig
 from langchain_core.tools import StructuredTool
 from langchain_core.tools import InjectedToolArg
 from langchain_core.tools import tool
-from langchain_core.messages import HumanMessage, AIMessage, ToolMessage, trim_messages
+from langchain_core.messages import BaseMessage, HumanMessage, AIMessage, ToolMessage, trim_messages
 
 
 # dotenv
 from dotenv import load_dotenv
 load_dotenv()
 
-# groq
-from langchain_groq import ChatGroq
-
 # pydantic
 from pydantic import BaseModel, Field
 
 # pydantic models
 from .pydm import *
 
-# realtime stt
-from RealtimeSTT import AudioToTextRecorder
-
 # token_counter
 from .token_counter import tiktoken_counter
 
-llm = ChatGroq(model='llama-3.3-70b-versatile', temperature=0.6)
-# llm = ChatGroq(model='llama-3.2-90b-vision-preview', temperature=0.2)
+# context window
+from .context_window import add_messages_with_window, select_context_window
+
+# meme template catalog
+from .meme_catalog import meme_catalog, TemplateRecord, IMGFLIP_API_URL
+
+# http client
+from .http_client import imgflip_client
+
+# topic labeling
+from .label_batcher import TopicLabelBatcher
+
+# conversation memories
+from .memory_store import prompt_contexts
+
+_llm = None
+
+
+def get_llm():
+    """Return the process-wide chat model, built on first use."""
+    global _llm
+    if _llm is None:
+        # imported here: the Groq client is not needed to import the app
+        from langchain_groq import ChatGroq
+
+        _llm = ChatGroq(model='llama-3.3-70b-versatile', temperature=0.6)
+        # _llm = ChatGroq(model='llama-3.2-90b-vision-preview', temperature=0.2)
+    return _llm
 
 
 # Environment variables for credentials
 IMGFLIP_USERNAME = os.getenv("IMGFLIP_USERNAME")
 IMGFLIP_PASSWORD = os.getenv("IMGFLIP_PASSWORD")
 
+# meme fan-out
+MEME_MAX_PER_CALL = int(os.getenv("MEME_MAX_PER_CALL", 4))
+MEME_FANOUT_CONCURRENCY = int(os.getenv("MEME_FANOUT_CONCURRENCY", 4))
+MEME_RENDER_TIMEOUT = float(os.getenv("MEME_RENDER_TIMEOUT", 20))
+
 
 # store = InMemoryStore()
 # memory = MemorySaver()
 
 
 
-assign_chat_topic_chain = assign_chat_topic(llm=llm)
+_topic_label_batcher = None
+
+
+def get_topic_label_batcher() -> TopicLabelBatcher:
+    """Return the topic labeler, building its chains on first use."""
+    global _topic_label_batcher
+    if _topic_label_batcher is None:
+        _topic_label_batcher = TopicLabelBatcher(
+            single_chain=assign_chat_topic(llm=get_llm()),
+            batch_chain=assign_chat_topics(llm=get_llm()),
+        )
+    return _topic_label_batcher
 
 class State(AgentState):
+    # every message carries its token prefix sum and trim cursor, kept current by
+    # the reducer as messages are appended (see api/context_window.py)
+    messages: Annotated[Sequence[BaseMessage], add_messages_with_window]
     docs: List[str]
 
 # LLM PRE_GEN
@@ -77,11 +117,8 @@ async def save_memory(memory: str, *, config: RunnableConfig, store: Annotated[B
         if not user_id or not conversation_id:
             return "Error: User ID or Conversation ID not found in config."
         
-        # Include conversation_id in the namespace
-        namespace = ("user", user_id, "conversation", conversation_id, "memories")
-        memories = await store.asearch(namespace)
-        memory_id = f"memory_{len(memories)}"
-        await store.aput(namespace, memory_id, {"data": memory})
+        # Memories are kept per conversation
+        await prompt_contexts.save_memory(store, user_id, conversation_id, memory)
         
         return f"Saved memory: {memory}"
     except Exception as e:
@@ -96,14 +133,15 @@ async def prepare_model_inputs(state, config: RunnableConfig, store: BaseStore):
         if not user_id or not conversation_id:
             return [{"role": "system", "content": "Error: User ID or Conversation ID not found in config."}] + state["messages"]
         
-        data_namespace = ("user", user_id, "data")
-        age = await store.aget(data_namespace, key='age')
-        full_name = await store.aget(data_namespace, key='full_name')
-        
-        # Include conversation_id in the namespace for memories
-        memories_namespace = ("user", user_id, "conversation", conversation_id, "memories")
-        memories = [m.value["data"] for m in await store.asearch(memories_namespace)]
-        memories_msg = ', '.join(memories) if memories else "No memories yet."
+        # Profile and memories, read in one batched store call and cached for the session
+        prompt_context = await prompt_contexts.get(store, user_id, conversation_id)
+        profile = prompt_context.profile or {}
+        full_name = profile.get("full_name", "unknown")
+        age = profile.get("age", "unknown")
+        # Only the memories relevant to what the user just said, within the memory token budget
+        latest_user_msg = next((msg for msg in reversed(state["messages"]) if isinstance(msg, HumanMessage)), None)
+        query = latest_user_msg.content if latest_user_msg and isinstance(latest_user_msg.content, str) else ""
+        memories_msg = await prompt_contexts.memory_block(prompt_context, query)
         
         system_msg = (f"""
             Act as MoodMender: Gen Z’s hybrid best friend/therapist. Keep it 💯—empathetic, stigma-free, and relentlessly relatable. Prioritize vibes over formalities.
@@ -131,14 +169,7 @@ async def prepare_model_inputs(state, config: RunnableConfig, store: BaseStore):
             
         )
 
-        trimmed_msgs = trim_messages(
-            messages=state['messages'],
-            max_tokens=5984,
-            strategy="last",
-            token_counter=tiktoken_counter,
-            include_system=True,
-            allow_partial=False,
-        )
+        trimmed_msgs = select_context_window(state['messages'])
 
         return [{"role": "system", "content": system_msg}] + trimmed_msgs
 
@@ -147,25 +178,7 @@ async def prepare_model_inputs(state, config: RunnableConfig, store: BaseStore):
         return [{"role": "system", "content": f"Error preparing model inputs: {str(e)}"}] + (trimmed_msgs if trimmed_msgs else state["messages"])
 
 # MEME FUNCTIONALITY
-async def fetch_meme_templates() -> List[MemeTemplate]:
-    """Fetch available meme templates from Imgflip API"""
-    try:
-        async with aiohttp.ClientSession() as session:
-            async with session.get("https://api.imgflip.com/get_memes") as resp:
-                resp.raise_for_status()
-                data = await resp.json()
-                return [
-                    MemeTemplate(
-                        id=template["id"],
-                        name=template["name"],
-                        box_count=template["box_count"]
-                    ) for template in data.get("data", {}).get("memes", [])
-                ]
-    except Exception as e:
-        print(f"Error fetching templates: {str(e)}")
-        return []
-
-async def create_meme(template: MemeTemplate, captions: List[str]) -> GeneratedMeme:
+async def create_meme(template: TemplateRecord, captions: List[str]) -> GeneratedMeme:
     """Generate meme image and return structured result"""
     try:
         # Prepare form data
@@ -176,21 +189,21 @@ async def create_meme(template: MemeTemplate, captions: List[str]) -> GeneratedM
             **{f"boxes[{i}][text]": text for i, text in enumerate(captions)}
         }
 
-        async with aiohttp.ClientSession() as session:
-            async with session.post(
-                "https://api.imgflip.com/caption_image",
-                data=data
-            ) as resp:
-                result = await resp.json()
-                if result.get("success"):
-                    return GeneratedMeme(
-                        url=result["data"]["url"],
-                        template_name=template.name
-                    )
-                return GeneratedMeme(
-                    url=f"Error: {result.get('error_message', 'Unknown error')}",
-                    template_name=template.name
-                )
+        result = await imgflip_client.request_json(
+            "POST",
+            f"{IMGFLIP_API_URL}/caption_image",
+            data=data,
+            retries=0,  # a retried timeout could caption the same meme twice
+        )
+        if result.get("success"):
+            return GeneratedMeme(
+                url=result["data"]["url"],
+                template_name=template.name
+            )
+        return GeneratedMeme(
+            url=f"Error: {result.get('error_message', 'Unknown error')}",
+            template_name=template.name
+        )
     except Exception as e:
         return GeneratedMeme(
             url=f"API Error: {str(e)}",
@@ -216,19 +229,47 @@ async def generate_captions(llm, meme_name: str, box_count: int, context: str) -
     response = await llm.ainvoke(prompt)
     return [line.strip() for line in response.content.split("\n") if line.strip()][:box_count]
 
+async def render_meme(template: TemplateRecord, context, semaphore: asyncio.Semaphore) -> GeneratedMeme:
+    """Caption and render one meme, bounded by the fan-out semaphore and its own timeout."""
+    async def caption_and_create():
+        captions = await generate_captions(
+            get_llm(),
+            meme_name=template.name,
+            box_count=template.box_count,
+            context=context
+        )
+        return await create_meme(template, captions)
+
+    async with semaphore:
+        try:
+            return await asyncio.wait_for(caption_and_create(), timeout=MEME_RENDER_TIMEOUT)
+        except asyncio.TimeoutError:
+            return GeneratedMeme(url="Error: Meme generation timed out", template_name=template.name)
+        except Exception as e:
+            return GeneratedMeme(url=f"Error: {str(e)}", template_name=template.name)
+
+def meme_stream_writer():
+    """Writer for the graph's "custom" stream, or a no-op outside a graph run."""
+    try:
+        return get_stream_writer()
+    except Exception:
+        return lambda chunk: None
+
 @tool
 async def generate_contextual_meme(
     state: Annotated[dict, InjectedState],
     num_memes: int = 2
 ) -> List[GeneratedMeme]:
     """Generate memes based on conversation context and random templates."""
-    templates = await fetch_meme_templates()
+    if imgflip_client.breaker.is_open:
+        # Imgflip is degraded; don't spend LLM calls on captions we can't render
+        return [GeneratedMeme(url="Error: Meme service is temporarily unavailable", template_name="")]
+
+    templates = await meme_catalog.get_templates()
     if not templates:
         return [GeneratedMeme(url="Error: No templates available", template_name="")]
     
-    selected_templates = random.sample(templates, min(1, num_memes))
-    
-    results = []
+    selected_templates = random.sample(templates, max(1, min(num_memes, MEME_MAX_PER_CALL, len(templates))))
 
     class ConversationContext(TypedDict):
         conversation_context: str
@@ -239,29 +280,27 @@ async def generate_contextual_meme(
 
     Examples of how the conversation_context might look like: 'data scientist fallen in love', 'toxic realtionship', 'leg day vs. other days', 'being always perectly wrong', etc.
     '''
-    structured_output_llm = llm.with_structured_output(ConversationContext)
+    structured_output_llm = get_llm().with_structured_output(ConversationContext)
 
-    trimmed_recent_msgs = trim_messages(
-        messages=state['messages'][-9:],
-        max_tokens=5984,
-        strategy="last",
-        token_counter=tiktoken_counter,
-        include_system=True,
-        allow_partial=False,
-    )
+    trimmed_recent_msgs = select_context_window(state['messages'], max_messages=9)
 
     humour_plot = await structured_output_llm.ainvoke((f'''{context_gen_prompt}\n{trimmed_recent_msgs}'''))
 
-    for template in selected_templates:
-        captions = await generate_captions(
-            llm,
-            meme_name=template.name,
-            box_count=template.box_count,
-            context=humour_plot
-        )
-        
-        meme_result = await create_meme(template, captions)
-        results.append(meme_result)
+    # caption and render every meme concurrently; push each one to the client as soon as it is ready
+    writer = meme_stream_writer()
+    semaphore = asyncio.Semaphore(MEME_FANOUT_CONCURRENCY)
+    tasks = [asyncio.create_task(render_meme(template, humour_plot, semaphore)) for template in selected_templates]
+
+    results = []
+    try:
+        for finished in asyncio.as_completed(tasks):
+            meme_result = await finished
+            results.append(meme_result)
+            if meme_result.url.startswith("http"):
+                writer({"type": "meme", "url": meme_result.url, "template_name": meme_result.template_name})
+    finally:
+        for task in tasks:
+            task.cancel()
     
     return results
 
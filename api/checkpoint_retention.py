@@ -0,0 +1,288 @@
+"""
+Checkpoint retention: keep the latest K checkpoints of every thread, drop the rest
+once they are older than a time horizon.
+
+    python -m api.checkpoint_retention            # one compaction pass, prints the report
+"""
+import os
+import sys
+import time
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+# typing_extensions
+from typing_extensions import Dict, List, Optional, Tuple
+
+# postgres
+from psycopg import errors
+from psycopg_pool import AsyncConnectionPool
+
+# redis ops
+from api import redis_ops
+
+
+# checkpoints always kept per thread (and namespace); the latest one is what every read uses
+CHECKPOINT_KEEP_LAST = max(1, int(os.environ.get("CHECKPOINT_KEEP_LAST", 5)))
+# older checkpoints are kept until they are this many seconds old
+CHECKPOINT_RETENTION_HORIZON = int(os.environ.get("CHECKPOINT_RETENTION_HORIZON", 24 * 60 * 60))
+# threads that wrote a checkpoint this recently are skipped, and compacted on a later pass
+CHECKPOINT_COMPACTION_IDLE = int(os.environ.get("CHECKPOINT_COMPACTION_IDLE", 5 * 60))
+# seconds between compaction passes in the app; 0 disables the background job
+CHECKPOINT_COMPACTION_INTERVAL = float(os.environ.get("CHECKPOINT_COMPACTION_INTERVAL", 60 * 60))
+CHECKPOINT_COMPACTION_BATCH = int(os.environ.get("CHECKPOINT_COMPACTION_BATCH", 500))
+CHECKPOINT_COMPACTION_LOCK_TIMEOUT_MS = int(os.environ.get("CHECKPOINT_COMPACTION_LOCK_TIMEOUT_MS", 200))
+
+CHECKPOINT_COMPACTION_LOCK_KEY = "checkpoints:compaction_lock"
+CHECKPOINT_COMPACTION_LOCK_TTL = 60 * 60
+CHECKPOINT_TABLES = ("checkpoints", "checkpoint_writes", "checkpoint_blobs")
+
+
+# threads of one page with more checkpoints than we keep, and idle for long enough
+CANDIDATES_SQL = """
+SELECT thread_id, checkpoint_ns
+FROM checkpoints
+WHERE thread_id IN (
+    SELECT DISTINCT thread_id FROM checkpoints WHERE thread_id > %(after)s ORDER BY thread_id LIMIT %(page)s
+)
+GROUP BY thread_id, checkpoint_ns
+HAVING count(*) > %(keep)s AND max((checkpoint->>'ts')::timestamptz) < %(idle_before)s
+"""
+
+LAST_THREAD_SQL = """
+SELECT max(thread_id) AS thread_id FROM (
+    SELECT DISTINCT thread_id FROM checkpoints WHERE thread_id > %(after)s ORDER BY thread_id LIMIT %(page)s
+) page
+"""
+
+# checkpoint ids are time-ordered (uuid6), so the id order is the write order
+EXPIRED_SQL = """
+SELECT checkpoint_id FROM (
+    SELECT checkpoint_id, checkpoint->>'ts' AS ts,
+           row_number() OVER (ORDER BY checkpoint_id DESC) AS position
+    FROM checkpoints
+    WHERE thread_id = %(thread_id)s AND checkpoint_ns = %(checkpoint_ns)s
+) ranked
+WHERE position > %(keep)s AND ts::timestamptz < %(horizon)s
+LIMIT %(batch)s
+"""
+
+DELETE_WRITES_SQL = """
+WITH deleted AS (
+    DELETE FROM checkpoint_writes
+    WHERE thread_id = %(thread_id)s AND checkpoint_ns = %(checkpoint_ns)s AND checkpoint_id = ANY(%(ids)s)
+    RETURNING pg_column_size(checkpoint_writes.*) AS size
+)
+SELECT count(*) AS rows, coalesce(sum(size), 0) AS bytes FROM deleted
+"""
+
+DELETE_CHECKPOINTS_SQL = """
+WITH deleted AS (
+    DELETE FROM checkpoints
+    WHERE thread_id = %(thread_id)s AND checkpoint_ns = %(checkpoint_ns)s AND checkpoint_id = ANY(%(ids)s)
+    RETURNING pg_column_size(checkpoints.*) AS size
+)
+SELECT count(*) AS rows, coalesce(sum(size), 0) AS bytes FROM deleted
+"""
+
+# only blobs an expired checkpoint pointed at are candidates, so blobs a running turn has
+# written ahead of its checkpoint row are never touched; a candidate is dropped unless a
+# checkpoint that stays still points at the same version
+DELETE_BLOBS_SQL = """
+WITH expired_versions AS (
+    SELECT DISTINCT v.key AS channel, v.value AS version
+    FROM checkpoints c, jsonb_each_text(c.checkpoint->'channel_versions') v
+    WHERE c.thread_id = %(thread_id)s AND c.checkpoint_ns = %(checkpoint_ns)s AND c.checkpoint_id = ANY(%(ids)s)
+), deleted AS (
+    DELETE FROM checkpoint_blobs b
+    USING expired_versions e
+    WHERE b.thread_id = %(thread_id)s AND b.checkpoint_ns = %(checkpoint_ns)s
+      AND b.channel = e.channel AND b.version = e.version
+      AND NOT EXISTS (
+        SELECT 1 FROM checkpoints c
+        WHERE c.thread_id = b.thread_id AND c.checkpoint_ns = b.checkpoint_ns
+          AND c.checkpoint_id <> ALL(%(ids)s)
+          AND c.checkpoint->'channel_versions'->>b.channel = b.version
+      )
+    RETURNING pg_column_size(b.*) AS size
+)
+SELECT count(*) AS rows, coalesce(sum(size), 0) AS bytes FROM deleted
+"""
+
+TABLE_SIZE_SQL = "SELECT pg_total_relation_size(%s::regclass) AS size"
+
+
+class CheckpointCompactor:
+    """
+    Enforces the checkpoint retention policy online.
+
+    Each thread is compacted in its own short transaction with a lock timeout;
+    a thread whose rows are locked, or that wrote a checkpoint in the last
+    `idle` seconds, is skipped and picked up by a later pass. Only one worker
+    compacts at a time.
+
+    Reclaimed bytes are the size of the deleted rows; Postgres reuses that
+    space after autovacuum, so table sizes stay proportional to the retained
+    checkpoints rather than shrinking on disk.
+    """
+
+    def __init__(
+        self,
+        pool: AsyncConnectionPool,
+        keep_last: int = CHECKPOINT_KEEP_LAST,
+        horizon: int = CHECKPOINT_RETENTION_HORIZON,
+        idle: int = CHECKPOINT_COMPACTION_IDLE,
+        batch: int = CHECKPOINT_COMPACTION_BATCH,
+        interval: float = CHECKPOINT_COMPACTION_INTERVAL,
+    ):
+        self.pool = pool
+        self.keep_last = max(1, keep_last)
+        self.horizon = horizon
+        self.idle = idle
+        self.batch = batch
+        self.interval = interval
+        self._task: Optional[asyncio.Task] = None
+        self.passes = 0
+        self.last_report: Dict = {}
+
+    def start(self):
+        if self._task is None and self.interval:
+            self._task = asyncio.create_task(self._run())
+
+    async def close(self):
+        if self._task and not self._task.done():
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        self._task = None
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.run_once()
+            except Exception as e:
+                print(f"Error compacting checkpoints: {str(e)}")
+
+    async def run_once(self) -> Dict:
+        """Run one compaction pass over every thread. Returns the report, or {} if another worker is compacting."""
+        lock_token = await redis_ops.acquire_lock(CHECKPOINT_COMPACTION_LOCK_KEY, ttl=CHECKPOINT_COMPACTION_LOCK_TTL)
+        if not lock_token:
+            return {}
+        try:
+            started = time.perf_counter()
+            now = datetime.now(timezone.utc)
+            report = {
+                "threads_compacted": 0,
+                "threads_skipped_locked": 0,
+                "reclaimed_rows": {table: 0 for table in CHECKPOINT_TABLES},
+                "reclaimed_bytes": {table: 0 for table in CHECKPOINT_TABLES},
+                "table_bytes_before": await self._table_sizes(),
+            }
+            async for thread_id, checkpoint_ns in self._candidates(now - timedelta(seconds=self.idle)):
+                try:
+                    reclaimed = await self.compact_thread(thread_id, checkpoint_ns, now - timedelta(seconds=self.horizon))
+                except errors.LockNotAvailable:
+                    report["threads_skipped_locked"] += 1
+                    continue
+                report["threads_compacted"] += 1
+                for table, (rows, size) in reclaimed.items():
+                    report["reclaimed_rows"][table] += rows
+                    report["reclaimed_bytes"][table] += size
+            report["table_bytes_after"] = await self._table_sizes()
+            report["seconds"] = round(time.perf_counter() - started, 3)
+            self.passes += 1
+            self.last_report = report
+            return report
+        finally:
+            await redis_ops.release_lock(CHECKPOINT_COMPACTION_LOCK_KEY, lock_token)
+
+    async def _candidates(self, idle_before: datetime):
+        # keyset pagination over thread ids keeps every query bounded
+        after = ""
+        while True:
+            params = {"after": after, "page": self.batch, "keep": self.keep_last, "idle_before": idle_before}
+            async with self.pool.connection() as conn:
+                candidates = await (await conn.execute(CANDIDATES_SQL, params)).fetchall()
+                last = await (await conn.execute(LAST_THREAD_SQL, params)).fetchone()
+            for row in candidates:
+                yield row["thread_id"], row["checkpoint_ns"]
+            if not last or last["thread_id"] is None:
+                return
+            after = last["thread_id"]
+
+    async def compact_thread(self, thread_id: str, checkpoint_ns: str, horizon: datetime) -> Dict[str, Tuple[int, int]]:
+        """Drop the expired checkpoints of one thread, their writes, and the blobs only they referenced."""
+        reclaimed = {table: (0, 0) for table in CHECKPOINT_TABLES}
+        params = {
+            "thread_id": thread_id,
+            "checkpoint_ns": checkpoint_ns,
+            "keep": self.keep_last,
+            "horizon": horizon,
+            "batch": self.batch,
+        }
+        while True:
+            async with self.pool.connection() as conn:
+                async with conn.transaction():
+                    # never queue behind a turn that is writing this thread
+                    await conn.execute(f"SET LOCAL lock_timeout = {CHECKPOINT_COMPACTION_LOCK_TIMEOUT_MS}")
+                    expired: List[str] = [
+                        row["checkpoint_id"] for row in await (await conn.execute(EXPIRED_SQL, params)).fetchall()
+                    ]
+                    if not expired:
+                        return reclaimed
+                    batch = {**params, "ids": expired}
+                    # blobs first: their candidates are read from the checkpoints about to go
+                    for table, query in (
+                        ("checkpoint_blobs", DELETE_BLOBS_SQL),
+                        ("checkpoint_writes", DELETE_WRITES_SQL),
+                        ("checkpoints", DELETE_CHECKPOINTS_SQL),
+                    ):
+                        row = await (await conn.execute(query, batch)).fetchone()
+                        rows, size = reclaimed[table]
+                        reclaimed[table] = (rows + row["rows"], size + row["bytes"])
+            if len(expired) < self.batch:
+                return reclaimed
+
+    async def _table_sizes(self) -> Dict[str, int]:
+        sizes = {}
+        async with self.pool.connection() as conn:
+            for table in CHECKPOINT_TABLES:
+                row = await (await conn.execute(TABLE_SIZE_SQL, (table,))).fetchone()
+                sizes[table] = row["size"]
+        return sizes
+
+    def metrics(self) -> dict:
+        return {
+            "keep_last": self.keep_last,
+            "horizon_seconds": self.horizon,
+            "passes": self.passes,
+            "last_report": self.last_report,
+        }
+
+
+async def main():
+    from api.db_pools import LANGGRAPH_CONNECTION_KWARGS
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    await redis_ops.initialize_redis()
+    pool = AsyncConnectionPool(
+        conninfo=os.environ.get("POSTGRES_CHECKPOINTER"),
+        min_size=1,
+        max_size=1,
+        kwargs=LANGGRAPH_CONNECTION_KWARGS,
+        open=False,
+    )
+    await pool.open(wait=True)
+    try:
+        report = await CheckpointCompactor(pool).run_once()
+        print(report or "Another worker is compacting; nothing done.")
+    finally:
+        await pool.close()
+        await redis_ops.close_redis_connection()
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
@@ -0,0 +1,148 @@
+import os
+from datetime import datetime, timezone
+
+from typing_extensions import List, Optional
+
+from langchain_core.messages import BaseMessage, SystemMessage, trim_messages
+from langgraph.graph.message import add_messages
+
+from .token_counter import tiktoken_counter, message_token_counts, TOKENS_PER_CONVERSATION
+
+
+# token budget of the history window sent to the model
+CONTEXT_WINDOW_MAX_TOKENS = int(os.environ.get("CONTEXT_WINDOW_MAX_TOKENS", 5984))
+
+# key under message.response_metadata holding the running bookkeeping of the thread
+CONTEXT_WINDOW_METADATA_KEY = "context_window"
+
+# key under message.response_metadata holding when the message was added to the thread (ISO, UTC)
+MESSAGE_CREATED_AT_METADATA_KEY = "created_at"
+
+
+def _bookkeeping(msg: BaseMessage, index: int, budget: int) -> Optional[dict]:
+    """Return the stored bookkeeping of a message, if it is still valid at `index`."""
+    entry = msg.response_metadata.get(CONTEXT_WINDOW_METADATA_KEY)
+    if isinstance(entry, dict) and entry.get("index") == index and entry.get("budget") == budget:
+        return entry
+    return None
+
+
+def _prefix_before(messages: List[BaseMessage], index: int) -> int:
+    if index == 0:
+        return 0
+    return messages[index - 1].response_metadata[CONTEXT_WINDOW_METADATA_KEY]["prefix"]
+
+
+def _update_window(messages: List[BaseMessage], start: int, budget: int):
+    """
+    Recompute the token prefix sums and trim cursors of `messages[start:]`.
+
+    For the message at index i, `prefix` is the token count of messages[:i + 1]
+    and `cursor` is the index of the first message of the longest suffix of
+    messages[:i + 1] that fits in `budget`, i.e. what
+    `trim_messages(strategy="last")` keeps. The cursor never moves backwards
+    while messages are only appended, so it is advanced from the previous one.
+    """
+    if start > 0:
+        previous = messages[start - 1].response_metadata[CONTEXT_WINDOW_METADATA_KEY]
+        prefix, cursor = previous["prefix"], previous["cursor"]
+    else:
+        prefix, cursor = 0, 0
+
+    # a leading system message is always kept by trim_messages(include_system=True)
+    pinned = 1 if messages and isinstance(messages[0], SystemMessage) else 0
+    counts = message_token_counts(messages[start:])
+    for i, count in enumerate(counts, start=start):
+        prefix += count
+        entry = {"index": i, "budget": budget, "prefix": prefix, "cursor": cursor}
+        messages[i].response_metadata[CONTEXT_WINDOW_METADATA_KEY] = entry
+
+        cursor = max(cursor, pinned)
+        # trim_messages counts the system message on its own, i.e. tiktoken_counter([messages[0]]),
+        # so with one the conversation overhead is paid twice
+        pinned_tokens = TOKENS_PER_CONVERSATION + _prefix_before(messages, pinned) if pinned else 0
+        while cursor <= i and TOKENS_PER_CONVERSATION + pinned_tokens + prefix - _prefix_before(messages, cursor) > budget:
+            cursor += 1
+        entry["cursor"] = cursor
+
+
+def _stamp_created_at(messages: List[BaseMessage], previous: Optional[dict] = None):
+    """Stamp messages that have no creation time; a replaced message keeps the time of the one it replaces."""
+    created_at = datetime.now(timezone.utc).isoformat()
+    previous = previous or {}
+    for msg in messages:
+        if MESSAGE_CREATED_AT_METADATA_KEY not in msg.response_metadata:
+            msg.response_metadata[MESSAGE_CREATED_AT_METADATA_KEY] = previous.get(msg.id, created_at)
+
+
+def add_messages_with_window(left, right):
+    """
+    `add_messages` reducer that also keeps the context window bookkeeping current
+    for `CONTEXT_WINDOW_MAX_TOKENS`. LangGraph only accepts `(left, right)` reducers.
+    """
+    return merge_messages_with_window(left, right, CONTEXT_WINDOW_MAX_TOKENS)
+
+
+def merge_messages_with_window(left, right, budget: int):
+    """
+    `add_messages` that also keeps the context window bookkeeping for `budget`
+    current, and stamps new messages with the time they were added.
+
+    Appends only touch the new messages. Replacements or removals, which shift
+    or change earlier messages, rebuild the bookkeeping of the whole thread.
+    """
+    merged = add_messages(left, right)
+    appended = len(right) if isinstance(right, list) else 1
+    if len(merged) != len(left) + appended:
+        previous = {
+            msg.id: msg.response_metadata.get(MESSAGE_CREATED_AT_METADATA_KEY)
+            for msg in (left if isinstance(left, list) else [])
+        }
+        # messages written before timestamps existed stay unstamped rather than getting "now"
+        _stamp_created_at([msg for msg in merged if previous.get(msg.id, "") is not None], previous)
+        start = 0
+    else:
+        _stamp_created_at(merged[len(left):])
+        start = len(merged)
+        while start > 0 and _bookkeeping(merged[start - 1], start - 1, budget) is None:
+            start -= 1
+    _update_window(merged, start, budget)
+    return merged
+
+
+def select_context_window(
+    messages: List[BaseMessage],
+    max_tokens: int = CONTEXT_WINDOW_MAX_TOKENS,
+    max_messages: Optional[int] = None,
+) -> List[BaseMessage]:
+    """
+    Return the most recent messages that fit in `max_tokens`, like
+    `trim_messages(strategy="last", include_system=True, allow_partial=False)`.
+
+    Uses the trim cursor stored by `add_messages_with_window` when it matches the
+    requested budget and the whole thread is considered, and falls back to
+    `trim_messages` otherwise.
+    `max_messages` additionally caps the window to the last N messages.
+    """
+    if not messages:
+        return []
+
+    recent = messages[-max_messages:] if max_messages else messages
+    last = len(messages) - 1
+    entry = _bookkeeping(messages[last], last, max_tokens)
+    # the stored cursor is computed for the whole thread, including its system message;
+    # a window cut to the last N messages has to be trimmed on its own
+    if entry is None or len(recent) < len(messages):
+        return trim_messages(
+            messages=recent,
+            max_tokens=max_tokens,
+            strategy="last",
+            token_counter=tiktoken_counter,
+            include_system=True,
+            allow_partial=False,
+        )
+
+    start = entry["cursor"]
+    if isinstance(messages[0], SystemMessage):
+        return messages[:1] + messages[max(start, 1):]
+    return messages[start:]
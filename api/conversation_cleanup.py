@@ -0,0 +1,301 @@
+"""
+Purge the Postgres data of deleted conversations.
+
+    python -m api.conversation_cleanup            # drain the purge queue once
+    python -m api.conversation_cleanup --sweep    # also queue orphaned threads first
+"""
+import os
+import sys
+import time
+import asyncio
+import argparse
+
+# typing_extensions
+from typing_extensions import Dict, List, Optional, Tuple
+
+# postgres
+from psycopg_pool import AsyncConnectionPool
+
+# redis ops
+from api import redis_ops
+
+
+# deleted conversations are purged after this delay, so a turn still running cannot write behind the purge
+CLEANUP_PURGE_DELAY = float(os.environ.get("CLEANUP_PURGE_DELAY", 60))
+CLEANUP_POLL_INTERVAL = float(os.environ.get("CLEANUP_POLL_INTERVAL", 10))
+# rows removed per DELETE statement, and conversations claimed per poll
+CLEANUP_BATCH_ROWS = int(os.environ.get("CLEANUP_BATCH_ROWS", 500))
+CLEANUP_BATCH_CONVERSATIONS = int(os.environ.get("CLEANUP_BATCH_CONVERSATIONS", 20))
+CLEANUP_RETRY_BASE = float(os.environ.get("CLEANUP_RETRY_BASE", 30))
+CLEANUP_RETRY_MAX = float(os.environ.get("CLEANUP_RETRY_MAX", 3600))
+# seconds between orphan sweeps in the worker; 0, the default, leaves sweeps to `--sweep`
+CLEANUP_SWEEP_INTERVAL = float(os.environ.get("CLEANUP_SWEEP_INTERVAL", 0))
+# a sweep stops if more than this share of a page is orphaned, which means Redis lost
+# conversations (flush, failover, eviction) rather than users deleting them
+CLEANUP_SWEEP_MAX_ORPHAN_RATIO = float(os.environ.get("CLEANUP_SWEEP_MAX_ORPHAN_RATIO", 0.2))
+CLEANUP_SWEEP_MIN_PAGE = 20  # smaller pages are too few to judge the ratio
+
+CLEANUP_LOCK_TTL = 300
+CLEANUP_SWEEP_LOCK_KEY = "cleanup:conversations:sweep_lock"
+
+# children first, so an interrupted purge never leaves writes or blobs without their checkpoint
+CHECKPOINT_TABLES = ("checkpoint_writes", "checkpoint_blobs", "checkpoints")
+STORE_TABLE = "store"
+
+
+class SweepAborted(Exception):
+    """The sweep saw too many orphans to trust Redis as the list of live conversations."""
+
+
+def conversation_store_prefix(user_id: str, conversation_id: str) -> str:
+    # AsyncPostgresStore keeps a namespace tuple as its labels joined with "."
+    return f"user.{user_id}.conversation.{conversation_id}"
+
+
+def escape_like(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+async def delete_in_batches(pool: AsyncConnectionPool, table: str, condition: str, params: tuple, batch_size: int) -> int:
+    """
+    Delete matching rows `batch_size` at a time, each batch in its own short
+    transaction, so locks are never held across the whole purge.
+    """
+    deleted = 0
+    query = (
+        f"DELETE FROM {table} WHERE ctid = ANY(ARRAY("
+        f"SELECT ctid FROM {table} WHERE {condition} LIMIT %s))"
+    )
+    while True:
+        async with pool.connection() as conn:
+            cursor = await conn.execute(query, (*params, batch_size))
+            rowcount = cursor.rowcount
+        deleted += rowcount
+        if rowcount < batch_size:
+            return deleted
+        await asyncio.sleep(0)  # let live traffic in between batches
+
+
+class ConversationCleanupWorker:
+    """
+    Background purge of deleted conversations.
+
+    `redis_ops.delete_conversation` hides a conversation at once and queues it.
+    This worker then removes the thread's checkpoints, checkpoint writes and
+    blobs, and the store namespaces under ("user", id, "conversation", cid),
+    in bounded batches. A failed purge is retried with exponential backoff;
+    purges are idempotent, so a retry just continues where the last one stopped.
+
+    The sweep finds threads and namespaces whose conversation has no Redis
+    entry any more and queues them too. Since that treats Redis as the list of
+    live conversations, it stops without queueing anything more if Redis holds
+    no conversation index or a page is mostly orphans.
+    """
+
+    def __init__(
+        self,
+        checkpointer_pool: AsyncConnectionPool,
+        store_pool: AsyncConnectionPool,
+        batch_rows: int = CLEANUP_BATCH_ROWS,
+        poll_interval: float = CLEANUP_POLL_INTERVAL,
+        sweep_interval: float = CLEANUP_SWEEP_INTERVAL,
+    ):
+        self.checkpointer_pool = checkpointer_pool
+        self.store_pool = store_pool
+        self.batch_rows = batch_rows
+        self.poll_interval = poll_interval
+        self.sweep_interval = sweep_interval
+        self._task: Optional[asyncio.Task] = None
+        self._last_sweep = time.time()
+        self.purged = 0
+        self.failures = 0
+        self.rows_deleted: Dict[str, int] = {table: 0 for table in (*CHECKPOINT_TABLES, STORE_TABLE)}
+        self.in_progress: Optional[str] = None
+        self.last_error: Optional[str] = None
+        self.last_sweep: Dict[str, int] = {}
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def close(self):
+        if self._task and not self._task.done():
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        self._task = None
+
+    async def _run(self):
+        while True:
+            try:
+                await self.drain()
+                if self.sweep_interval and time.time() - self._last_sweep >= self.sweep_interval:
+                    self._last_sweep = time.time()
+                    await self.sweep()
+            except Exception as e:
+                print(f"Error in conversation cleanup: {str(e)}")
+            await asyncio.sleep(self.poll_interval)
+
+    async def drain(self, limit: int = CLEANUP_BATCH_CONVERSATIONS) -> int:
+        """Purge the queued conversations that are due. Returns how many were purged."""
+        purged = 0
+        for member in await redis_ops.fetch_due_cleanups(limit):
+            lock_key = f"{redis_ops.CLEANUP_QUEUE_KEY}:lock:{member}"
+            lock_token = await redis_ops.acquire_lock(lock_key, ttl=CLEANUP_LOCK_TTL)
+            if not lock_token:
+                continue  # another worker has it
+            try:
+                self.in_progress = member
+                await self.purge(*redis_ops.parse_cleanup_member(member))
+                await redis_ops.finish_cleanup(member)
+                self.purged += 1
+                purged += 1
+            except Exception as e:
+                self.failures += 1
+                self.last_error = f"{member}: {str(e)}"
+                attempts = await redis_ops.cleanup_attempts(member)
+                delay = min(CLEANUP_RETRY_MAX, CLEANUP_RETRY_BASE * 2 ** attempts)
+                await redis_ops.retry_cleanup(member, delay)
+                print(f"Error purging conversation {member} (attempt {attempts + 1}, retry in {delay:.0f}s): {str(e)}")
+            finally:
+                self.in_progress = None
+                await redis_ops.release_lock(lock_key, lock_token)
+        return purged
+
+    async def purge(self, user_id: str, conversation_id: str) -> Dict[str, int]:
+        """Delete everything Postgres holds for one conversation."""
+        deleted = {}
+        for table in CHECKPOINT_TABLES:
+            deleted[table] = await delete_in_batches(
+                self.checkpointer_pool, table, "thread_id = %s", (conversation_id,), self.batch_rows
+            )
+            self.rows_deleted[table] += deleted[table]
+
+        prefix = conversation_store_prefix(user_id, conversation_id)
+        deleted[STORE_TABLE] = await delete_in_batches(
+            self.store_pool, STORE_TABLE, "prefix LIKE %s", (escape_like(prefix) + ".%",), self.batch_rows
+        )
+        self.rows_deleted[STORE_TABLE] += deleted[STORE_TABLE]
+        return deleted
+
+    async def sweep(self, page_size: int = CLEANUP_BATCH_ROWS) -> Dict:
+        """Queue the purge of threads and store namespaces that have no Redis entry."""
+        lock_token = await redis_ops.acquire_lock(CLEANUP_SWEEP_LOCK_KEY, ttl=CLEANUP_LOCK_TTL)
+        if not lock_token:
+            return {}
+        result = {"threads_seen": 0, "threads_unattributed": 0, "namespaces_seen": 0, "orphans_queued": 0}
+        try:
+            if not await redis_ops.has_indexed_conversations():
+                raise SweepAborted("Redis holds no conversation index")
+            async for page, unattributed in self._checkpoint_threads(page_size):
+                result["threads_seen"] += len(page) + unattributed
+                result["threads_unattributed"] += unattributed
+                result["orphans_queued"] += await self._queue_orphans(page)
+            async for page in self._store_conversations(page_size):
+                result["namespaces_seen"] += len(page)
+                result["orphans_queued"] += await self._queue_orphans(page)
+        except SweepAborted as e:
+            result["aborted"] = str(e)
+            print(f"Orphan sweep aborted: {str(e)}")
+        finally:
+            await redis_ops.release_lock(CLEANUP_SWEEP_LOCK_KEY, lock_token)
+        self.last_sweep = result
+        return result
+
+    async def _queue_orphans(self, conversations: List[Tuple[str, str]]) -> int:
+        orphans = await redis_ops.find_missing_conversations(conversations)
+        if len(conversations) >= CLEANUP_SWEEP_MIN_PAGE and len(orphans) > CLEANUP_SWEEP_MAX_ORPHAN_RATIO * len(conversations):
+            raise SweepAborted(f"{len(orphans)} of {len(conversations)} conversations in a page have no Redis entry")
+        await redis_ops.queue_cleanups(orphans, purge_delay=CLEANUP_PURGE_DELAY)
+        return len(orphans)
+
+    async def _checkpoint_threads(self, page_size: int):
+        # keyset pagination over thread ids; the owner is in the metadata copied from the run config
+        last_thread_id = ""
+        while True:
+            async with self.checkpointer_pool.connection() as conn:
+                cursor = await conn.execute(
+                    "SELECT DISTINCT ON (thread_id) thread_id, metadata->>'user_id' AS user_id "
+                    "FROM checkpoints WHERE checkpoint_ns = '' AND thread_id > %s "
+                    "ORDER BY thread_id LIMIT %s",
+                    (last_thread_id, page_size),
+                )
+                rows = await cursor.fetchall()
+            if not rows:
+                return
+            last_thread_id = rows[-1]["thread_id"]
+            page = [(row["user_id"], row["thread_id"]) for row in rows if row["user_id"]]
+            yield page, len(rows) - len(page)
+            if len(rows) < page_size:
+                return
+
+    async def _store_conversations(self, page_size: int):
+        last_prefix = ""
+        while True:
+            async with self.store_pool.connection() as conn:
+                cursor = await conn.execute(
+                    "SELECT DISTINCT prefix FROM store "
+                    "WHERE prefix LIKE 'user.%%.conversation.%%' AND prefix > %s "
+                    "ORDER BY prefix LIMIT %s",
+                    (last_prefix, page_size),
+                )
+                rows = await cursor.fetchall()
+            if not rows:
+                return
+            last_prefix = rows[-1]["prefix"]
+            page = set()
+            for row in rows:
+                labels = row["prefix"].split(".")
+                if len(labels) >= 4 and labels[0] == "user" and labels[2] == "conversation":
+                    page.add((labels[1], labels[3]))
+            yield sorted(page)
+            if len(rows) < page_size:
+                return
+
+    def metrics(self) -> dict:
+        return {
+            "purged": self.purged,
+            "failures": self.failures,
+            "rows_deleted": dict(self.rows_deleted),
+            "in_progress": self.in_progress,
+            "last_error": self.last_error,
+            "last_sweep": self.last_sweep,
+        }
+
+
+async def main(argv=None):
+    from api.db_pools import LANGGRAPH_CONNECTION_KWARGS
+    from dotenv import load_dotenv
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sweep", action="store_true", help="queue orphaned threads before draining")
+    args = parser.parse_args(argv)
+
+    load_dotenv()
+    checkpointer_dsn = os.environ.get("POSTGRES_CHECKPOINTER")
+    store_dsn = os.environ.get("POSTGRES_STORE")
+
+    await redis_ops.initialize_redis()
+    pools = {}
+    for dsn in {checkpointer_dsn, store_dsn}:
+        pools[dsn] = AsyncConnectionPool(conninfo=dsn, min_size=1, max_size=2, kwargs=LANGGRAPH_CONNECTION_KWARGS, open=False)
+        await pools[dsn].open(wait=True)
+    try:
+        worker = ConversationCleanupWorker(pools[checkpointer_dsn], pools[store_dsn])
+        if args.sweep:
+            print(f"Sweep: {await worker.sweep()}")
+        # purges still inside CLEANUP_PURGE_DELAY are left for the next run
+        while await worker.drain():
+            pass
+        print(f"Cleanup: {worker.metrics()}")
+        print(f"Still queued: {await redis_ops.cleanup_queue_size()}")
+    finally:
+        for pool in pools.values():
+            await pool.close()
+        await redis_ops.close_redis_connection()
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
@@ -0,0 +1,75 @@
+import json
+from datetime import datetime
+
+# typing_extensions
+from typing_extensions import Dict, Union
+
+import msgpack
+
+
+# first byte of every encoded value; legacy JSON values start with "{"
+CODEC_V1 = 0x01
+
+# field order of a v1 record: [name, topic, created (epoch seconds), description]
+V1_FIELDS = ("name", "topic", "timestamp", "description")
+
+
+def encode_conversation(conversation_data: Dict) -> bytes:
+    """
+    Encode conversation metadata as a versioned msgpack record.
+
+    `timestamp` may be an ISO string (the in-memory form) or epoch seconds;
+    it is stored as an int.
+    """
+    timestamp = conversation_data["timestamp"]
+    if isinstance(timestamp, str):
+        timestamp = datetime.fromisoformat(timestamp).timestamp()
+    record = [
+        conversation_data.get("name"),
+        conversation_data.get("topic"),
+        int(timestamp),
+        conversation_data.get("description"),
+    ]
+    # trailing empty fields are not stored
+    while record and record[-1] is None:
+        record.pop()
+    return bytes([CODEC_V1]) + msgpack.packb(record, use_bin_type=True)
+
+
+def decode_conversation(raw: Union[bytes, str]) -> Dict:
+    """
+    Decode a stored conversation, v1 msgpack or legacy JSON, into the
+    in-memory form with an ISO `timestamp`. Raises ValueError if unreadable.
+    """
+    if isinstance(raw, str):
+        raw = raw.encode()
+    if not raw:
+        raise ValueError("Empty conversation record")
+
+    if raw[0] == CODEC_V1:
+        try:
+            record = msgpack.unpackb(raw[1:], raw=False)
+        except (msgpack.ExtraData, msgpack.FormatError, msgpack.StackError, ValueError) as e:
+            raise ValueError(f"Invalid conversation record: {str(e)}")
+        # a corrupted record can still unpack, into something that is not a v1 record
+        if not isinstance(record, list) or not 3 <= len(record) <= len(V1_FIELDS):
+            raise ValueError("Invalid conversation record: not a v1 record")
+        conversation_data = dict(zip(V1_FIELDS, record))
+        timestamp = conversation_data["timestamp"]
+        if not isinstance(timestamp, int) or isinstance(timestamp, bool):
+            raise ValueError("Invalid conversation record: timestamp is not an integer")
+        if not all(conversation_data.get(field) is None or isinstance(conversation_data[field], str)
+                   for field in ("name", "topic", "description")):
+            raise ValueError("Invalid conversation record: text field is not a string")
+        try:
+            conversation_data["timestamp"] = datetime.fromtimestamp(timestamp).isoformat()
+        except (OverflowError, OSError) as e:
+            raise ValueError(f"Invalid conversation record: {str(e)}")
+        return {field: value for field, value in conversation_data.items() if value is not None}
+
+    # legacy: json.dumps of the dict, written before the codec existed
+    # (json.JSONDecodeError is a ValueError)
+    conversation_data = json.loads(raw)
+    if not isinstance(conversation_data, dict):
+        raise ValueError("Invalid conversation record: not a JSON object")
+    return conversation_data
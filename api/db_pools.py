@@ -0,0 +1,182 @@
+import os
+import time
+
+# typing_extensions
+from typing_extensions import Dict, Optional
+
+# postgres
+from psycopg.rows import dict_row
+from psycopg_pool import AsyncConnectionPool
+
+# sql alchemy
+from sqlalchemy.ext.asyncio import create_async_engine, AsyncEngine
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+
+
+# connections one worker process may open across all subsystems
+PG_CONNECTION_BUDGET = int(os.environ.get("PG_CONNECTION_BUDGET", 30))
+# connections are recycled after this many seconds, and checked before reuse
+PG_POOL_RECYCLE = int(os.environ.get("PG_POOL_RECYCLE", 1800))
+PG_POOL_MAX_IDLE = int(os.environ.get("PG_POOL_MAX_IDLE", 300))
+PG_POOL_TIMEOUT = float(os.environ.get("PG_POOL_TIMEOUT", 30))
+
+SQL_POOL_MIN = int(os.environ.get("SQL_POOL_MIN", 2))
+SQL_POOL_MAX = int(os.environ.get("SQL_POOL_MAX", 10))
+CHECKPOINTER_POOL_MIN = int(os.environ.get("CHECKPOINTER_POOL_MIN", 2))
+CHECKPOINTER_POOL_MAX = int(os.environ.get("CHECKPOINTER_POOL_MAX", 10))
+STORE_POOL_MIN = int(os.environ.get("STORE_POOL_MIN", 2))
+STORE_POOL_MAX = int(os.environ.get("STORE_POOL_MAX", 10))
+
+# what AsyncPostgresSaver and AsyncPostgresStore expect from their connections
+LANGGRAPH_CONNECTION_KWARGS = {"autocommit": True, "prepare_threshold": 0, "row_factory": dict_row}
+
+
+class CheckoutStats:
+    """Waiters and checkout latency of the SQLAlchemy pool."""
+
+    def __init__(self):
+        self.waiting = 0
+        self.checkouts = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+
+    def observe(self, elapsed_ms: float):
+        self.checkouts += 1
+        self.total_ms += elapsed_ms
+        self.max_ms = max(self.max_ms, elapsed_ms)
+
+    def as_dict(self) -> dict:
+        return {
+            "requests_waiting": self.waiting,
+            "checkouts": self.checkouts,
+            "checkout_avg_ms": self.total_ms / self.checkouts if self.checkouts else 0.0,
+            "checkout_max_ms": self.max_ms,
+        }
+
+
+class InstrumentedAsyncQueuePool(AsyncAdaptedQueuePool):
+    """AsyncAdaptedQueuePool that records how many callers wait for a connection, and for how long."""
+
+    stats: CheckoutStats
+
+    def _do_get(self):
+        self.stats.waiting += 1
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            self.stats.waiting -= 1
+            self.stats.observe((time.perf_counter() - start) * 1000)
+
+
+def allocate_budget(requested: Dict[str, int], budget: int) -> Dict[str, int]:
+    """Scale the requested pool maxima down proportionally if they exceed the budget."""
+    total = sum(requested.values())
+    if total <= budget:
+        return dict(requested)
+    allocated = {name: max(1, size * budget // total) for name, size in requested.items()}
+    print(f"Postgres pools request {total} connections, over the budget of {budget}; using {allocated}")
+    return allocated
+
+
+class PostgresPools:
+    """
+    Owns every Postgres connection of the process: the SQLAlchemy engine used by
+    sql_ops, and the psycopg pools behind the LangGraph checkpointer and store.
+
+    Each subsystem has its own DSN and sizing. The maxima are fitted into one
+    per-process budget, and subsystems pointing at the same DSN share a pool.
+    """
+
+    def __init__(self, sql_dsn: str, checkpointer_dsn: str, store_dsn: str, budget: int = PG_CONNECTION_BUDGET):
+        self.sql_dsn = sql_dsn
+        self.checkpointer_dsn = checkpointer_dsn
+        self.store_dsn = store_dsn
+        self.budget = budget
+        self.engine: Optional[AsyncEngine] = None
+        self.checkpointer_pool: Optional[AsyncConnectionPool] = None
+        self.store_pool: Optional[AsyncConnectionPool] = None
+        self._psycopg_pools: Dict[str, AsyncConnectionPool] = {}
+        self._sql_stats = CheckoutStats()
+
+    async def open(self):
+        sizes = allocate_budget(
+            {"sql": SQL_POOL_MAX, "checkpointer": CHECKPOINTER_POOL_MAX, "store": STORE_POOL_MAX},
+            self.budget,
+        )
+
+        sql_min = min(SQL_POOL_MIN, sizes["sql"])
+        pool_class = type("SqlPool", (InstrumentedAsyncQueuePool,), {"stats": self._sql_stats})
+        self.engine = create_async_engine(
+            self.sql_dsn,
+            echo=False,
+            poolclass=pool_class,
+            pool_size=sql_min,
+            max_overflow=sizes["sql"] - sql_min,
+            pool_timeout=PG_POOL_TIMEOUT,
+            pool_pre_ping=True,
+            pool_recycle=PG_POOL_RECYCLE,
+        )
+
+        # the checkpointer and the store share one pool when they use the same database
+        requested = {}
+        for dsn, min_size, max_size in (
+            (self.checkpointer_dsn, CHECKPOINTER_POOL_MIN, sizes["checkpointer"]),
+            (self.store_dsn, STORE_POOL_MIN, sizes["store"]),
+        ):
+            current_min, current_max = requested.get(dsn, (0, 0))
+            requested[dsn] = (current_min + min(min_size, max_size), current_max + max_size)
+
+        for index, (dsn, (min_size, max_size)) in enumerate(requested.items()):
+            pool = AsyncConnectionPool(
+                conninfo=dsn,
+                min_size=min_size,
+                max_size=max_size,
+                kwargs=LANGGRAPH_CONNECTION_KWARGS,
+                check=AsyncConnectionPool.check_connection,
+                max_lifetime=PG_POOL_RECYCLE,
+                max_idle=PG_POOL_MAX_IDLE,
+                timeout=PG_POOL_TIMEOUT,
+                name=f"langgraph-{index}",
+                open=False,
+            )
+            await pool.open(wait=True)
+            self._psycopg_pools[dsn] = pool
+
+        self.checkpointer_pool = self._psycopg_pools[self.checkpointer_dsn]
+        self.store_pool = self._psycopg_pools[self.store_dsn]
+
+    async def close(self):
+        for pool in self._psycopg_pools.values():
+            await pool.close()
+        self._psycopg_pools = {}
+        self.checkpointer_pool = None
+        self.store_pool = None
+        if self.engine is not None:
+            await self.engine.dispose()
+            self.engine = None
+
+    def metrics(self) -> dict:
+        metrics = {"budget": self.budget}
+        if self.engine is not None:
+            pool = self.engine.sync_engine.pool
+            metrics["sql"] = {
+                "pool_size": pool.size(),
+                "checked_out": pool.checkedout(),
+                "overflow": pool.overflow(),
+                **self._sql_stats.as_dict(),
+            }
+        for name, pool in (("checkpointer", self.checkpointer_pool), ("store", self.store_pool)):
+            if pool is None:
+                continue
+            stats = pool.get_stats()
+            requests = stats.get("requests_num", 0)
+            metrics[name] = {
+                "pool": pool.name,
+                "pool_size": stats.get("pool_size", 0),
+                "pool_available": stats.get("pool_available", 0),
+                "requests_waiting": stats.get("requests_waiting", 0),
+                "requests": requests,
+                "checkout_avg_ms": stats.get("requests_wait_ms", 0) / requests if requests else 0.0,
+            }
+        return metrics
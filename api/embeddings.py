@@ -0,0 +1,78 @@
+import os
+import re
+import hashlib
+import importlib
+
+# typing_extensions
+from typing_extensions import List, Optional
+
+import numpy as np
+
+
+# "package.module:attribute" of a LangChain-style embeddings class or factory; empty for the built-in one
+MEMORY_EMBEDDER = os.environ.get("MEMORY_EMBEDDER", "")
+HASHING_EMBEDDER_DIMS = int(os.environ.get("HASHING_EMBEDDER_DIMS", 256))
+
+_TOKEN_PATTERN = re.compile(r"\w+")
+
+
+class HashingEmbedder:
+    """
+    Deterministic, offline text embedder: hashed bag of words and character
+    trigrams, L2-normalized. Needs no model download and gives the same vector
+    for the same text on every machine, which also makes it usable in tests.
+
+    Follows the `embed_documents` / `embed_query` interface of LangChain
+    embeddings, so any local LangChain embeddings model can replace it.
+    """
+
+    def __init__(self, dims: int = HASHING_EMBEDDER_DIMS):
+        self.dims = dims
+        self.name = f"hashing-{dims}"
+
+    def _features(self, text: str) -> List[str]:
+        words = _TOKEN_PATTERN.findall(text.lower())
+        trigrams = [f"#{word[i:i + 3]}" for word in words for i in range(max(1, len(word) - 2))]
+        return words + trigrams
+
+    def _embed(self, text: str) -> List[float]:
+        vector = np.zeros(self.dims, dtype=np.float32)
+        for feature in self._features(text):
+            digest = int.from_bytes(hashlib.blake2b(feature.encode(), digest_size=8).digest(), "little")
+            # the low bits pick the dimension, the next bit the sign, so collisions tend to cancel out
+            vector[digest % self.dims] += 1.0 if (digest >> 32) & 1 else -1.0
+        norm = np.linalg.norm(vector)
+        return (vector / norm if norm else vector).tolist()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._embed(text)
+
+
+_embedder = None
+
+
+def get_embedder():
+    """Return the process-wide memory embedder, built on first use."""
+    global _embedder
+    if _embedder is None:
+        if MEMORY_EMBEDDER:
+            module_name, _, attribute = MEMORY_EMBEDDER.partition(":")
+            _embedder = getattr(importlib.import_module(module_name), attribute)()
+            if not hasattr(_embedder, "name"):
+                _embedder.name = MEMORY_EMBEDDER
+        else:
+            _embedder = HashingEmbedder()
+    return _embedder
+
+
+def as_matrix(vectors: List[List[float]], dims: Optional[int] = None) -> np.ndarray:
+    """Stack vectors into a row-normalized float32 matrix, so a dot product is a cosine similarity."""
+    if not vectors:
+        return np.zeros((0, dims or 0), dtype=np.float32)
+    matrix = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
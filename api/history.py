@@ -0,0 +1,97 @@
+import os
+import hashlib
+
+# typing_extensions
+from typing_extensions import Dict, List, Optional, Tuple
+
+# postgres
+from psycopg_pool import AsyncConnectionPool
+
+# langchain
+from langchain_core.messages import BaseMessage, HumanMessage, AIMessage, ToolMessage
+
+from api.context_window import MESSAGE_CREATED_AT_METADATA_KEY
+from api.streaming import MEME_TOOL_NAME, extract_meme_urls
+
+
+HISTORY_PAGE_SIZE = int(os.environ.get("HISTORY_PAGE_SIZE", 50))
+HISTORY_PAGE_MAX = 200
+
+LATEST_CHECKPOINT_SQL = """
+SELECT checkpoint_id FROM checkpoints
+WHERE thread_id = %s AND checkpoint_ns = ''
+ORDER BY checkpoint_id DESC LIMIT 1
+"""
+
+
+async def latest_checkpoint_id(pool: AsyncConnectionPool, thread_id: str) -> Optional[str]:
+    """Id of the newest checkpoint of a thread, read from the index without loading the checkpoint."""
+    async with pool.connection() as conn:
+        row = await (await conn.execute(LATEST_CHECKPOINT_SQL, (thread_id,))).fetchone()
+    return row["checkpoint_id"] if row else None
+
+
+def history_etag(checkpoint_id: Optional[str], conversation: Optional[dict]) -> str:
+    # the topic is served alongside the messages and changes once the conversation is labeled
+    topic = (conversation or {}).get("topic") or ""
+    topic_digest = hashlib.blake2b(topic.encode(), digest_size=4).hexdigest()
+    return f'"{checkpoint_id or "empty"}.{topic_digest}"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    candidates = [tag.strip() for tag in if_none_match.split(",")]
+    # weak comparison, as If-None-Match requires
+    return "*" in candidates or any(tag.removeprefix("W/") == etag for tag in candidates)
+
+
+def render_message(msg: BaseMessage) -> Optional[Dict]:
+    """Client form of a stored message, or None for messages the chat does not show."""
+    rendered = {
+        "id": msg.id,
+        "timestamp": msg.response_metadata.get(MESSAGE_CREATED_AT_METADATA_KEY),
+    }
+    if isinstance(msg, HumanMessage):
+        return {**rendered, "type": "HumanMessage", "content": msg.content}
+    if isinstance(msg, AIMessage):
+        if not msg.content:
+            return None  # a tool call without any text
+        return {**rendered, "type": "AIMessage", "content": msg.content}
+    if isinstance(msg, ToolMessage) and msg.name == MEME_TOOL_NAME:
+        meme_urls = extract_meme_urls(msg.content)
+        if not meme_urls:
+            return None
+        return {**rendered, "type": "ToolMessage", "name": msg.name, "content": meme_urls}
+    return None
+
+
+def render_history_page(
+    messages: List[BaseMessage], before: Optional[str] = None, limit: int = HISTORY_PAGE_SIZE
+) -> Tuple[List[Dict], Optional[str]]:
+    """
+    Render the `limit` shown messages that precede the message with id `before`
+    (the newest ones without `before`), oldest first.
+
+    Returns the page and the `before` cursor of the next older page, or None
+    when the page reaches the start of the conversation. Raises ValueError if
+    `before` is not a message of the conversation.
+    """
+    end = len(messages)
+    if before is not None:
+        end = next((i for i, msg in enumerate(messages) if msg.id == before), None)
+        if end is None:
+            raise ValueError(f"Message {before} is not part of this conversation.")
+
+    page = []
+    index = end - 1
+    while index >= 0 and len(page) < limit:
+        rendered = render_message(messages[index])
+        if rendered is not None:
+            page.append(rendered)
+        index -= 1
+    page.reverse()
+
+    has_older = any(render_message(messages[i]) is not None for i in range(index, -1, -1))
+    next_before = page[0]["id"] if page and has_older else None
+    return page, next_before
@@ -0,0 +1,119 @@
+import os
+import json
+
+# typing_extensions
+from typing_extensions import Dict, List, Optional, Tuple
+
+# redis ops
+from api import redis_ops
+
+from api.history import HISTORY_PAGE_SIZE, render_history_page
+
+
+# total size of all cached pages across threads; least recently used pages are evicted beyond it
+HISTORY_CACHE_MAX_BYTES = int(os.environ.get("HISTORY_CACHE_MAX_BYTES", 64 * 1024 * 1024))
+# how long a thread remembers its latest written-through checkpoint
+HISTORY_CACHE_POINTER_TTL = int(os.environ.get("HISTORY_CACHE_POINTER_TTL", 7 * 24 * 60 * 60))
+
+
+def page_key(thread_id: str, checkpoint_id: str, before: Optional[str], limit: int) -> str:
+    return f"{thread_id}:{checkpoint_id}:{before or ''}:{limit}"
+
+
+class HistoryCache:
+    """
+    Rendered `GET /chat/{id}` pages in Redis, keyed by (thread_id, checkpoint_id, page).
+
+    A page for a checkpoint never changes, so entries are never invalidated;
+    pages of superseded checkpoints simply stop being read and are evicted
+    least recently used first once the cache exceeds `max_bytes`.
+
+    Each thread also has a pointer to its latest checkpoint. A chat turn clears
+    it when it starts and writes the first page and the pointer through when it
+    ends, so re-opening the conversation needs neither the checkpoint nor the
+    checkpoint index. A turn that ends after a newer one started leaves the
+    pointer cleared for the newer one to set.
+    """
+
+    def __init__(self, max_bytes: int = HISTORY_CACHE_MAX_BYTES, pointer_ttl: int = HISTORY_CACHE_POINTER_TTL):
+        self.max_bytes = max_bytes
+        self.pointer_ttl = pointer_ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.write_throughs = 0
+
+    async def latest_checkpoint_id(self, thread_id: str) -> Optional[str]:
+        try:
+            return await redis_ops.fetch_history_pointer(thread_id)
+        except Exception as e:
+            print(f"Error reading history cache: {str(e)}")
+            return None
+
+    async def get(self, thread_id: str, checkpoint_id: str, before: Optional[str], limit: int) -> Optional[Tuple[List[Dict], Optional[str]]]:
+        try:
+            payload = await redis_ops.fetch_history_page(page_key(thread_id, checkpoint_id, before, limit))
+        except Exception as e:
+            print(f"Error reading history cache: {str(e)}")
+            payload = None
+        if payload is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        page = json.loads(payload)
+        return page["messages"], page["next_before"]
+
+    async def put(self, thread_id: str, checkpoint_id: str, before: Optional[str], limit: int, messages: List[Dict], next_before: Optional[str]):
+        payload = json.dumps({"messages": messages, "next_before": next_before}, separators=(",", ":"))
+        try:
+            self.evictions += await redis_ops.store_history_page(
+                page_key(thread_id, checkpoint_id, before, limit), payload, self.max_bytes
+            )
+        except Exception as e:
+            print(f"Error writing history cache: {str(e)}")
+
+    async def turn_started(self, thread_id: str) -> Optional[int]:
+        """Clear the thread's pointer; returns the turn number to pass to `write_through`."""
+        # checkpoints written by the turn are newer than the pointer; read them from Postgres meanwhile
+        try:
+            return await redis_ops.start_history_turn(thread_id, self.pointer_ttl)
+        except Exception as e:
+            print(f"Error clearing history pointer: {str(e)}")
+            return None
+
+    async def write_through(self, thread_id: str, checkpointer, turn: Optional[int] = None):
+        """Render the first page of the thread's latest checkpoint and point the thread at it."""
+        checkpoint_tuple = await checkpointer.aget_tuple({"configurable": {"thread_id": thread_id, "checkpoint_ns": ""}})
+        if checkpoint_tuple is None:
+            return
+        checkpoint_id = checkpoint_tuple.config["configurable"]["checkpoint_id"]
+        messages = checkpoint_tuple.checkpoint["channel_values"].get("messages", [])
+        page, next_before = render_history_page(messages, limit=HISTORY_PAGE_SIZE)
+        await self.put(thread_id, checkpoint_id, None, HISTORY_PAGE_SIZE, page, next_before)
+        try:
+            if not await redis_ops.advance_history_pointer(thread_id, checkpoint_id, self.pointer_ttl, turn):
+                return  # superseded by a newer checkpoint or turn
+        except Exception as e:
+            print(f"Error writing history pointer: {str(e)}")
+            return
+        self.write_throughs += 1
+
+    async def metrics(self) -> dict:
+        try:
+            pages, size = await redis_ops.history_pages_size()
+        except Exception:
+            pages, size = None, None
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "write_throughs": self.write_throughs,
+            "pages": pages,
+            "bytes": size,
+            "max_bytes": self.max_bytes,
+        }
+
+
+history_cache = HistoryCache()
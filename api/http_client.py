@@ -0,0 +1,179 @@
+import os
+import time
+import random
+import asyncio
+import aiohttp
+
+# typing_extensions
+from typing_extensions import Optional
+
+
+IMGFLIP_HTTP_POOL_SIZE = int(os.getenv("IMGFLIP_HTTP_POOL_SIZE", 100))
+IMGFLIP_HTTP_POOL_PER_HOST = int(os.getenv("IMGFLIP_HTTP_POOL_PER_HOST", 20))
+IMGFLIP_HTTP_KEEPALIVE = float(os.getenv("IMGFLIP_HTTP_KEEPALIVE", 30))
+IMGFLIP_HTTP_TIMEOUT = float(os.getenv("IMGFLIP_HTTP_TIMEOUT", 10))
+IMGFLIP_HTTP_CONNECT_TIMEOUT = float(os.getenv("IMGFLIP_HTTP_CONNECT_TIMEOUT", 3))
+IMGFLIP_HTTP_RETRIES = int(os.getenv("IMGFLIP_HTTP_RETRIES", 2))
+IMGFLIP_BREAKER_THRESHOLD = int(os.getenv("IMGFLIP_BREAKER_THRESHOLD", 5))
+IMGFLIP_BREAKER_RESET = float(os.getenv("IMGFLIP_BREAKER_RESET", 30))
+
+# responses worth retrying; anything else is returned to the caller as is
+RETRYABLE_STATUSES = {429, 500, 502, 503, 504}
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of making a request while the circuit breaker is open."""
+
+
+class UpstreamError(Exception):
+    """Raised when an upstream keeps answering with a retryable status."""
+
+    def __init__(self, status: int, url: str):
+        super().__init__(f"Upstream returned {status} for {url}")
+        self.status = status
+
+
+class CircuitBreaker:
+    """
+    Consecutive-failure circuit breaker.
+
+    After `failure_threshold` failures in a row the circuit opens and requests
+    fail fast for `reset_timeout` seconds. Then a single trial request is let
+    through (half-open): success closes the circuit, failure re-opens it.
+    """
+
+    def __init__(self, failure_threshold: int = IMGFLIP_BREAKER_THRESHOLD, reset_timeout: float = IMGFLIP_BREAKER_RESET):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self._trial_in_flight = False
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return "half_open"
+        return "open"
+
+    @property
+    def is_open(self) -> bool:
+        state = self.state
+        return state == "open" or (state == "half_open" and self._trial_in_flight)
+
+    def before_request(self) -> bool:
+        """Admit a request, or raise CircuitOpenError. Returns whether it is the half-open trial."""
+        state = self.state
+        if state == "open" or (state == "half_open" and self._trial_in_flight):
+            raise CircuitOpenError("Circuit open: upstream is degraded, failing fast.")
+        if state == "half_open":
+            self._trial_in_flight = True
+            return True
+        return False
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+        self._trial_in_flight = False
+
+    def release_trial(self):
+        # a half-open trial that ended without a verdict (cancelled, or an error
+        # already recorded) frees the slot so the next request can try again
+        self._trial_in_flight = False
+
+    def record_failure(self):
+        self.failures += 1
+        self._trial_in_flight = False
+        if self.opened_at is not None or self.failures >= self.failure_threshold:
+            self.opened_at = time.monotonic()
+
+
+class ResilientHttpClient:
+    """
+    App-scoped aiohttp client: one pooled keep-alive session with per-host
+    connection limits, per-request timeouts, retries with jittered exponential
+    backoff and a circuit breaker shared by every caller.
+    """
+
+    def __init__(
+        self,
+        limit: int = IMGFLIP_HTTP_POOL_SIZE,
+        limit_per_host: int = IMGFLIP_HTTP_POOL_PER_HOST,
+        keepalive_timeout: float = IMGFLIP_HTTP_KEEPALIVE,
+        timeout: float = IMGFLIP_HTTP_TIMEOUT,
+        connect_timeout: float = IMGFLIP_HTTP_CONNECT_TIMEOUT,
+        retries: int = IMGFLIP_HTTP_RETRIES,
+        backoff_base: float = 0.2,
+        backoff_max: float = 2.0,
+        breaker: Optional[CircuitBreaker] = None,
+    ):
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self.keepalive_timeout = keepalive_timeout
+        self.timeout = aiohttp.ClientTimeout(total=timeout, sock_connect=connect_timeout)
+        self.retries = retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.breaker = breaker or CircuitBreaker()
+        self._session: Optional[aiohttp.ClientSession] = None
+
+    async def start(self):
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=self.limit,
+                limit_per_host=self.limit_per_host,
+                keepalive_timeout=self.keepalive_timeout,
+                ttl_dns_cache=300,
+            )
+            self._session = aiohttp.ClientSession(connector=connector, timeout=self.timeout)
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    def _backoff(self, attempt: int) -> float:
+        # "full jitter": uniform in [0, min(max, base * 2^attempt)]
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+
+    async def request_json(self, method: str, url: str, retries: Optional[int] = None, **kwargs) -> dict:
+        """
+        Send a request and return the decoded JSON body.
+
+        Connection errors, timeouts and retryable statuses are retried and
+        count against the circuit breaker; so does a body that cannot be read
+        or decoded, without a retry. Pass `retries=0` for requests that are not
+        idempotent. Raises CircuitOpenError without touching the network while
+        the circuit is open.
+        """
+        await self.start()
+        retries = self.retries if retries is None else retries
+        for attempt in range(retries + 1):
+            trial = self.breaker.before_request()
+            try:
+                async with self._session.request(method, url, **kwargs) as resp:
+                    if resp.status in RETRYABLE_STATUSES:
+                        raise UpstreamError(resp.status, url)
+                    data = None if resp.status >= 400 else await resp.json(content_type=None)
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError, UpstreamError):
+                self.breaker.record_failure()
+                if attempt < retries and not self.breaker.is_open:
+                    await asyncio.sleep(self._backoff(attempt))
+                    continue
+                raise
+            except (aiohttp.ClientError, ValueError):
+                # a truncated or undecodable body; retrying would not help
+                self.breaker.record_failure()
+                raise
+            finally:
+                # also on cancellation, e.g. by a caller's wait_for
+                if trial:
+                    self.breaker.release_trial()
+            # the upstream answered; client errors are not its fault
+            self.breaker.record_success()
+            resp.raise_for_status()
+            return data
+
+
+imgflip_client = ResilientHttpClient()
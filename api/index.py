@@ -2,6 +2,10 @@ import os
 import re
 import json
 import ast
+import asyncio
+
+# startup profile; imported first so the app's own imports are timed
+from api.startup_profile import startup_profiler
 
 # typing_extensions
 from typing_extensions import Union, Optional, List
@@ -14,10 +18,9 @@ from fastapi.security import OAuth2PasswordBearer
 from fastapi.responses import JSONResponse
 
 # postgres
-from psycopg_pool import AsyncConnectionPool
 from langgraph.checkpoint.postgres.aio import AsyncPostgresSaver
 from langgraph.store.postgres import AsyncPostgresStore
-from langgraph.store.postgres.aio import PoolConfig
+from api.db_pools import PostgresPools
 
 # pydantic models
 from api.pydm import *
@@ -28,10 +31,8 @@ from api.sql_ops import *
 # sql alchemy
 from sqlalchemy.exc import SQLAlchemyError
 
-# jwt
-import jwt
-from jwt.exceptions import InvalidTokenError, ExpiredSignatureError, DecodeError
-from jwt import decode
+# auth
+from api.auth import get_authenticated_user, require_metrics_access, revoke_token, verified_tokens, AUTH_COOKIE_NAME
 
 # starlette
 from starlette.middleware.base import BaseHTTPMiddleware
@@ -39,9 +40,6 @@ from starlette.middleware.base import BaseHTTPMiddleware
 # datetime
 from datetime import datetime, timedelta
 
-# supabase
-from supabase import create_client, Client
-
 # lifespan
 from contextlib import asynccontextmanager
 
@@ -54,78 +52,183 @@ from api.chat_handle import *
 # redis ops
 from api.redis_ops import *
 
+# meme template catalog
+from api.meme_catalog import meme_catalog
+
+# http client
+from api.http_client import imgflip_client
+
+# password hashing
+from api.password_hasher import password_hasher
+
+# user cache
+from api.user_cache import user_cache
+
+# conversation memories
+from api.memory_store import prompt_contexts, build_profile, save_profile
+
+# deleted conversation purge
+from api.conversation_cleanup import ConversationCleanupWorker, CLEANUP_PURGE_DELAY
+
+# checkpoint retention
+from api.checkpoint_retention import CheckpointCompactor
+
 # langchain
 from langchain_core.messages import SystemMessage, HumanMessage, AIMessage, ToolMessage
 
+# token streaming
+from api.streaming import TurnEventRouter
+
+# message history
+from api.history import (
+    HISTORY_PAGE_SIZE, HISTORY_PAGE_MAX, latest_checkpoint_id, history_etag, etag_matches, render_history_page
+)
+from api.history_cache import history_cache
 
-# realtime stt
-from RealtimeSTT import AudioToTextRecorder
+# speech to text
+from api.speech import (
+    speech_pool, TranscriptionError, SpeechPoolBusy, STT_ENABLED, STT_DEFAULT_SAMPLE_RATE, STT_MAX_UTTERANCE_SECONDS
+)
 
 load_dotenv()
 
 # environment variables
 DB_URI_CHECKPOINTER = os.environ.get('POSTGRES_CHECKPOINTER')
 DB_URI_STORE = os.environ.get('POSTGRES_STORE')
-SECRET_KEY = os.environ.get('JWT_SECRET_KEY')
-ALGORITHM = os.environ.get('ALGORITHM')
-# url: str = os.environ.get("SUPABASE_URL")
-# key: str = os.environ.get("SUPABASE_KEY")
-# supabase: Client = create_client(url, key)
 
+startup_profiler.mark("imports")
 
-# required variables
-connection_kwargs = {"autocommit": True, "prepare_threshold": 0}
-store_pool_config = PoolConfig(min_size=5,max_size=20)
 
 # OAuth2 scheme for token authentication
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="login")
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
+    startup_profiler.skip()
+
+    # Open every Postgres connection pool of this process
+    postgres_pools = PostgresPools(
+        sql_dsn=DATABASE_URL,
+        checkpointer_dsn=DB_URI_CHECKPOINTER,
+        store_dsn=DB_URI_STORE,
+    )
+    await postgres_pools.open()
+    configure_engine(postgres_pools.engine)
+    app.state.postgres_pools = postgres_pools
+    print('\nOpened Postgres pools\n')
+    startup_profiler.mark("postgres_pools")
+
     await init_db()
     print('\nStarted SQL db\n')
+    startup_profiler.mark("sql_db")
+
+    password_hasher.start()
+    print('\nStarted password hashing pool\n')
+    startup_profiler.mark("password_hasher")
 
     await initialize_redis()
     print('\nStarted Redis db\n')
+    startup_profiler.mark("redis")
 
-    # Initialize Postgres Checkpointer
-    async with AsyncConnectionPool(conninfo=DB_URI_CHECKPOINTER, max_size=20, kwargs=connection_kwargs) as pool:
-        checkpointer = AsyncPostgresSaver(pool)
-        await checkpointer.setup()
-        app.state.checkpointer = checkpointer
-        print('\nInitialized Postgres Checkpointer\n')
-
-        # Initialize Postgres Store
-        async with AsyncPostgresStore.from_conn_string(conn_string=DB_URI_STORE, pool_config=store_pool_config) as store:
-            await store.setup()
-            app.state.store = store
-            print('\nInitialized Postgres Store\n')
-
-            # Initialize the graph
-            app.state.graph = create_react_agent(
-                llm, 
-                [generate_contextual_meme, save_memory], 
-                prompt=prepare_model_inputs, 
-                store=store, 
-                checkpointer=checkpointer,
-                state_schema=State
-            )
-            print('\nInitialized Graph\n')
+    indexed = await backfill_conversation_index()
+    if indexed:
+        print(f'\nIndexed {indexed} existing conversations\n')
+    startup_profiler.mark("conversation_index")
 
-            # Yield control to the app
-            yield
+    await imgflip_client.start()
+    app.state.imgflip_client = imgflip_client
+    print('\nStarted Imgflip HTTP client\n')
+    startup_profiler.mark("imgflip_client")
 
-            # Cleanup Postgres Store
-            del app.state.store
-            print('\nCleaned up Postgres Store\n')
+    await meme_catalog.start()
+    print('\nLoaded meme template catalog\n')
+    startup_profiler.mark("meme_catalog")
 
-        # Cleanup Postgres Checkpointer
-        del app.state.checkpointer
-        print('\nCleaned up Postgres Checkpointer\n')
+    # warm workers load their models once, in the background so startup does not wait for them;
+    # voice turns arriving meanwhile queue for the first ready worker
+    if STT_ENABLED:
+        await speech_pool.start(wait=False)
+        print('\nStarted speech to text pool\n')
+    startup_profiler.mark("speech_pool")
 
-        # Cleanup Graph
-        del app.state.graph
-        print('\nCleaned up Graph\n')
+    # Initialize Postgres Checkpointer
+    checkpointer = AsyncPostgresSaver(postgres_pools.checkpointer_pool)
+    await checkpointer.setup()
+    app.state.checkpointer = checkpointer
+    print('\nInitialized Postgres Checkpointer\n')
+    startup_profiler.mark("checkpointer")
+
+    # Initialize Postgres Store
+    store = AsyncPostgresStore(conn=postgres_pools.store_pool)
+    await store.setup()
+    app.state.store = store
+    print('\nInitialized Postgres Store\n')
+    startup_profiler.mark("store")
+
+    # Initialize the graph
+    app.state.graph = create_react_agent(
+        get_llm(), 
+        [generate_contextual_meme, save_memory], 
+        prompt=prepare_model_inputs, 
+        store=store, 
+        checkpointer=checkpointer,
+        state_schema=State
+    )
+    print('\nInitialized Graph\n')
+    startup_profiler.mark("graph")
+
+    cleanup_worker = ConversationCleanupWorker(postgres_pools.checkpointer_pool, postgres_pools.store_pool)
+    cleanup_worker.start()
+    app.state.cleanup_worker = cleanup_worker
+    print('\nStarted conversation cleanup worker\n')
+    startup_profiler.mark("cleanup_worker")
+
+    checkpoint_compactor = CheckpointCompactor(postgres_pools.checkpointer_pool)
+    checkpoint_compactor.start()
+    app.state.checkpoint_compactor = checkpoint_compactor
+    print('\nStarted checkpoint compaction job\n')
+    startup_profiler.mark("checkpoint_compactor")
+    print(f'\nStartup profile: {json.dumps(startup_profiler.report())}\n')
+
+    # Yield control to the app
+    yield
+
+    await checkpoint_compactor.close()
+    del app.state.checkpoint_compactor
+    print('\nStopped checkpoint compaction job\n')
+
+    await cleanup_worker.close()
+    del app.state.cleanup_worker
+    print('\nStopped conversation cleanup worker\n')
+
+    # Cleanup Postgres Store
+    del app.state.store
+    print('\nCleaned up Postgres Store\n')
+
+    # Cleanup Postgres Checkpointer
+    del app.state.checkpointer
+    print('\nCleaned up Postgres Checkpointer\n')
+
+    # Cleanup Graph
+    del app.state.graph
+    print('\nCleaned up Graph\n')
+
+    await speech_pool.close()
+    print('\nStopped speech to text pool\n')
+
+    await meme_catalog.close()
+    print('\nStopped meme template catalog\n')
+
+    await imgflip_client.close()
+    del app.state.imgflip_client
+    print('\nClosed Imgflip HTTP client\n')
+
+    await password_hasher.close()
+    print('\nStopped password hashing pool\n')
+
+    await postgres_pools.close()
+    del app.state.postgres_pools
+    print('\nClosed Postgres pools\n')
 
 
 app = FastAPI(docs_url="/docs", openapi_url="/openapi.json", debug=True, lifespan=lifespan)
@@ -145,33 +248,6 @@ async def get_psql_checkpointer():
 async def get_psql_store():
     return app.state.store
 
-def get_authenticated_user(request: Request):
-    token = request.cookies.get("auth_token")
-    if not token:
-        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Not authenticated")
-
-    try:
-        payload = decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        exp = payload.get("exp")
-        
-        if exp and datetime.utcfromtimestamp(exp) < datetime.utcnow():
-            raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Token has expired")
-
-        return {
-            "user_id": payload.get("user_id"),
-            "email": payload.get("email"),
-        }
-
-    except ExpiredSignatureError:
-        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Token expired")
-    except InvalidTokenError:
-        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid token")
-    except DecodeError:
-        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Malformed token")
-    except Exception as e:
-        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"Unexpected error: {str(e)}")
-
-
 @app.post("/signup", status_code=status.HTTP_201_CREATED)
 async def signup(user: UserCreate, store=Depends(get_psql_store)):
     # Check if user already exists
@@ -205,10 +281,11 @@ async def signup(user: UserCreate, store=Depends(get_psql_store)):
         signed_up_user_email = new_user.email
 
 
-        await store.aput(
-            namespace=('users'),
-            key=signed_up_user_id,
-            value={'name': signed_up_user_name, 'email': signed_up_user_email}
+        # the profile every prompt of this user reads
+        await save_profile(
+            store,
+            signed_up_user_id,
+            build_profile(new_user.firstName, new_user.lastName, new_user.age, signed_up_user_email),
         )
 
         return JSONResponse(
@@ -226,8 +303,8 @@ async def signup(user: UserCreate, store=Depends(get_psql_store)):
 @app.post("/login", status_code=200)
 async def login(user: UserLogin, response: Response):
     try:
-        db_user = await get_user_by_email(user.email.strip().lower())
-        if db_user is None or not verify_password(user.password, db_user.password):
+        db_user = await get_user_credentials(user.email.strip().lower())
+        if db_user is None or not await verify_password(user.password, db_user.password, user_id=db_user.user_id):
             raise HTTPException(status_code=401, detail="Invalid email or password.")
 
         token = generate_jwt_token(user_id=db_user.user_id, email=db_user.email)
@@ -258,8 +335,12 @@ async def login(user: UserLogin, response: Response):
 
 
 @app.post("/logout")
-async def logout(response: Response):
+async def logout(request: Request, response: Response):
     try:
+        token = request.cookies.get(AUTH_COOKIE_NAME)
+        if token:
+            await revoke_token(token)
+
         response.set_cookie(
             key="auth_token",
             value="", 
@@ -275,6 +356,25 @@ async def logout(response: Response):
         raise HTTPException(status_code=500, detail=f"An error occurred during logout: {str(e)}")
 
 
+@app.get('/metrics', dependencies=[Depends(require_metrics_access)])
+async def get_metrics():
+    return {
+        "password_hasher": password_hasher.metrics(),
+        "verified_tokens": verified_tokens.metrics(),
+        "user_cache": user_cache.metrics(),
+        "postgres_pools": app.state.postgres_pools.metrics(),
+        "conversation_cleanup": {
+            **app.state.cleanup_worker.metrics(),
+            "queued": await cleanup_queue_size(),
+        },
+        "checkpoint_compaction": app.state.checkpoint_compactor.metrics(),
+        "history_cache": await history_cache.metrics(),
+        "prompt_contexts": prompt_contexts.metrics(),
+        "speech_pool": speech_pool.metrics(),
+        "startup": startup_profiler.report(),
+    }
+
+
 @app.get('/get_auth_user')
 async def get_active_user(current_user: dict = Depends(get_authenticated_user)):
     return {'user': current_user}
@@ -286,7 +386,7 @@ async def label_new_chat(request: LabelChatRequest, current_user: dict = Depends
         user_id = current_user.get("user_id")
         
         # Get the label from LLM chain
-        label = assign_chat_topic_chain.invoke(request.message)
+        label = await get_topic_label_batcher().label(request.message)
        
         # Create and store the conversation
         result = await label_conversation(
@@ -306,7 +406,14 @@ async def label_new_chat(request: LabelChatRequest, current_user: dict = Depends
 
 
 @app.get('/chat/{conversation_id}')
-async def get_conversation_messages(conversation_id: str, current_user: dict = Depends(get_authenticated_user)):
+async def get_conversation_messages(
+    conversation_id: str,
+    request: Request,
+    response: Response,
+    before: Optional[str] = Query(None),
+    limit: int = Query(HISTORY_PAGE_SIZE, ge=1, le=HISTORY_PAGE_MAX),
+    current_user: dict = Depends(get_authenticated_user),
+):
     user_id = current_user.get("user_id")
 
     # Handle the case where conversation_id is "new"
@@ -314,6 +421,7 @@ async def get_conversation_messages(conversation_id: str, current_user: dict = D
         return {
             "conversation_id": "new",
             "messages": [],  # No messages for a new conversation
+            "next_before": None,
             "fetched_conversation": None  # No conversation to fetch
         }
 
@@ -323,151 +431,140 @@ async def get_conversation_messages(conversation_id: str, current_user: dict = D
     except ValueError as e:
         raise HTTPException(status_code=404, detail=str(e))
 
-    # Get the state of the conversation graph asynchronously
-    config = {"configurable": {"user_id": current_user.get("user_id"), "thread_id": conversation_id}}
+    # an unchanged conversation is answered from the checkpoint id alone;
+    # the id written through by the last turn saves the checkpoint index lookup
+    checkpoint_id = await history_cache.latest_checkpoint_id(conversation_id)
+    if checkpoint_id is None:
+        checkpoint_id = await latest_checkpoint_id(app.state.postgres_pools.checkpointer_pool, conversation_id)
+    etag = history_etag(checkpoint_id, fetched_conversation)
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag})
+
+    # clients may keep the page, but must revalidate it with If-None-Match
+    response.headers["Cache-Control"] = "private, no-cache"
+
+    cached = await history_cache.get(conversation_id, checkpoint_id, before, limit) if checkpoint_id else None
+    if cached is not None:
+        page, next_before = cached
+        response.headers["ETag"] = etag
+        return {
+            "conversation_id": conversation_id,
+            "messages": page,
+            "next_before": next_before,
+            'fetched_conversation': fetched_conversation
+        }
+
+    messages = []
+    if checkpoint_id is not None:
+        config = {"configurable": {"thread_id": conversation_id, "checkpoint_ns": ""}}
+        try:
+            checkpoint_tuple = await app.state.checkpointer.aget_tuple(config)
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"Error fetching conversation state: {str(e)}")
+        if checkpoint_tuple is not None:
+            messages = checkpoint_tuple.checkpoint["channel_values"].get("messages", [])
+            # a turn may have finished since the id was read; tag and cache what is actually served
+            checkpoint_id = checkpoint_tuple.config["configurable"]["checkpoint_id"]
+            etag = history_etag(checkpoint_id, fetched_conversation)
+
     try:
-        the_graph = await app.state.graph.aget_state(config=config, subgraphs=True)
-        all_messages = the_graph.values.get('messages', [])
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error fetching conversation state: {str(e)}")
-
-    # Process messages into a structured format
-    processed_messages = []
-    for msg in all_messages:
-        if isinstance(msg, HumanMessage):
-            processed_messages.append({
-                "id": str(uuid.uuid4()),  # Generate a unique ID for the frontend
-                "type": "HumanMessage",
-                "content": msg.content,
-                "timestamp": datetime.now().isoformat()
-            })
-        elif isinstance(msg, AIMessage):
-            processed_messages.append({
-                "id": str(uuid.uuid4()),
-                "type": "AIMessage",
-                "content": msg.content if msg.content is not None else '',
-                "timestamp": datetime.now().isoformat()
-            })
-        elif isinstance(msg, ToolMessage):
-            # Parse ToolMessage content (meme URLs)
-            try:
-                # Convert ToolMessage content to a structured format
-                content = eval(msg.content)  # Convert string representation to actual objects
-                meme_urls = []
-                if isinstance(content, list):
-                    meme_urls = [item.url for item in content if hasattr(item, 'url')]
-                elif hasattr(content, 'url'):
-                    meme_urls = [content.url]
-
-                processed_messages.append({
-                    "id": str(uuid.uuid4()),
-                    "type": "ToolMessage",
-                    "content": meme_urls,  # List of meme URLs
-                    "name": msg.name,  # Tool name (e.g., 'generate_contextual_meme')
-                    "timestamp": datetime.now().isoformat()
-                })
-            except Exception as e:
-                print(f"Error parsing ToolMessage: {e}")
-                continue  # Skip invalid ToolMessages
+        page, next_before = render_history_page(messages, before=before, limit=limit)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    if checkpoint_id is not None:
+        await history_cache.put(conversation_id, checkpoint_id, before, limit, page, next_before)
 
+    response.headers["ETag"] = etag
     return {
         "conversation_id": conversation_id,
-        "messages": processed_messages,
+        "messages": page,
+        "next_before": next_before,
         'fetched_conversation': fetched_conversation
     }
 
 
+@app.delete('/chat/{conversation_id}')
+async def delete_chat(conversation_id: str, current_user: dict = Depends(get_authenticated_user)):
+    user_id = current_user.get("user_id")
+
+    if not await conversation_exists(user_id, conversation_id):
+        raise HTTPException(status_code=404, detail=f"Conversation with ID {conversation_id} not found.")
+
+    # gone for the user right away; checkpoints and memories are purged in the background
+    return await delete_conversation(user_id, conversation_id, purge_delay=CLEANUP_PURGE_DELAY)
+
 
 @app.get('/fetch_conversations')
-async def fetch_conversations(current_user: dict = Depends(get_authenticated_user)):
+async def fetch_conversations(
+    cursor: Optional[str] = Query(None),
+    limit: int = Query(CONVERSATION_PAGE_SIZE, ge=1, le=CONVERSATION_PAGE_MAX),
+    current_user: dict = Depends(get_authenticated_user),
+):
     user_id = current_user.get("user_id")
     user_email = current_user.get("email")
 
     if not user_id or not user_email:
         raise HTTPException(status_code=400, detail="Invalid user details.")
 
-    conversations = await fetch_user_conversations(user_id)
-
-    if not conversations:
-        return {"message": "No conversations found.", "conversations": []}
-
-    return {"conversations": conversations}
-
-
-async def get_authenticated_user_websocket(websocket: WebSocket):
-    token = websocket.cookies.get("auth_token")
-
-    if not token:
-        raise HTTPException(status_code=401, detail="Authorization token missing")
-
     try:
-        payload = decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-
-        exp = payload.get("exp")
-        if exp and datetime.utcfromtimestamp(exp) < datetime.utcnow():
-            raise HTTPException(status_code=401, detail="Token has expired")
+        conversations, next_cursor = await fetch_user_conversations(user_id, cursor=cursor, limit=limit)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor.")
 
-        return {
-            "user_id": payload.get("user_id"),
-            "email": payload.get("email"),
-        }
+    if not conversations:
+        return {"message": "No conversations found.", "conversations": [], "next_cursor": None}
 
-    except ExpiredSignatureError:
-        raise HTTPException(status_code=401, detail="Token has expired")
-    except InvalidTokenError as e:
-        raise HTTPException(status_code=401, detail=f"Invalid token: {str(e)}")
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Unexpected error: {str(e)}")
+    return {"conversations": conversations, "next_cursor": next_cursor}
 
 
 @app.websocket("/llm_chat/{conversation_id}")
 async def websocket_llm_chat(
     conversation_id: str,
     websocket: WebSocket,
-    current_user: dict = Depends(get_authenticated_user_websocket),
+    current_user: dict = Depends(get_authenticated_user),
     checkpointer=Depends(get_psql_checkpointer),
     store: AsyncPostgresStore = Depends(get_psql_store)
 ):  
     graph = app.state.graph
     await websocket.accept()
     current_conversation_id = conversation_id
+    session_conversation_id = None  # conversation whose prompt context this socket keeps cached
     config = None
-    recorder = None  # Initialize recorder as None
-    recorded_text = None  # Store transcribed text
+    # token streaming is on unless the client connects with ?stream=0
+    stream_tokens = websocket.query_params.get("stream", "1") != "0"
 
     try:
         if current_conversation_id == "new":
-            # Wait for the first message, which could be text or audio
-            data = await websocket.receive_text()
-            message = json.loads(data)
-
-            if message["type"] == "audio":
-                # Initialize a new recorder
-                recorder = AudioToTextRecorder()
-                recorder.start()
-                await websocket.send_json({"type": "audio_started", "message": "Recording started."})
-
-                # Wait for stop_audio message
-                stop_data = await websocket.receive_text()
-                stop_message = json.loads(stop_data)
-                if stop_message["type"] == "stop_audio":
-                    recorder.stop()
-                    recorded_text = recorder.text()
-                    recorder.shutdown()
-                    await websocket.send_json({
-                        "type": "audio_transcription",
-                        "content": recorded_text
-                    })
-
-            # Now, create a new conversation with the recorded text or initial text
-            user_query = recorded_text if recorded_text else message.get("content", "")
-            label = assign_chat_topic_chain.invoke(user_query)
+            # Wait for the first message, which could be text or audio;
+            # a voice turn that could not be transcribed does not start a conversation
+            user_query = None
+            while user_query is None:
+                message = await receive_frame(websocket)
+                if isinstance(message, bytes) or message["type"] == "stop_audio":
+                    continue  # audio of a turn that already failed
+                if message["type"] == "audio":
+                    user_query = await transcribe_voice_turn(websocket, message) or None
+                else:
+                    user_query = message.get("content", "")
+
+            # Now, create a new conversation with the recorded text or initial text;
+            # it is labeled in the background while the first reply is generated
             result = await label_conversation(
                 user_id=current_user.get("user_id"),
-                llm_response_label=label,
+                llm_response_label=PENDING_CONVERSATION_TOPIC,
             )
             current_conversation_id = result["conversation_id"]
+            run_in_background(label_conversation_in_background(
+                user_id=current_user.get("user_id"),
+                conversation_id=current_conversation_id,
+                user_query=user_query,
+                websocket=websocket,
+            ))
             config = {"configurable": {"user_id": current_user["user_id"], "thread_id": current_conversation_id}}
+            # keep the prompt context of this conversation cached while the socket is open
+            prompt_contexts.open_session(current_conversation_id)
+            session_conversation_id = current_conversation_id
             
             await websocket.send_json({
                 "type": "new_conversation",
@@ -475,108 +572,137 @@ async def websocket_llm_chat(
                 "message": "New conversation started."
             })
             
-            await process_message(graph, user_query, config, websocket)
+            await process_message(graph, user_query, config, websocket, stream_tokens)
         else:
+            # a deleted conversation must not get new checkpoints behind the purge
+            if not await conversation_exists(current_user["user_id"], current_conversation_id):
+                await websocket.close(code=4404, reason="Conversation not found")
+                return
             config = {"configurable": {"user_id": current_user["user_id"], "thread_id": current_conversation_id}}
+            prompt_contexts.open_session(current_conversation_id)
+            session_conversation_id = current_conversation_id
             await websocket.send_json({"type": "connection_ready", "message": "Connected!"})
 
         while True:
-            data = await websocket.receive_text()
-            message = json.loads(data)
+            message = await receive_frame(websocket)
             
-            if message["type"] == "audio":
-                # Initialize a new recorder for each recording session
-                recorder = AudioToTextRecorder()
-                recorder.start()
-                await websocket.send_json({"type": "audio_started", "message": "Recording started."})
-            elif message["type"] == "stop_audio":
-                if recorder:  # Ensure the recorder exists
-                    recorder.stop()
-                    recorded_text = recorder.text()
-                    await websocket.send_json({
-                        "type": "audio_transcription",
-                        "content": recorded_text
-                    })
-                    recorder.shutdown()
-                    recorder = None  # Reset the recorder
-
+            if isinstance(message, bytes) or message["type"] == "stop_audio":
+                continue  # audio of a turn that already failed
+            elif message["type"] == "audio":
+                # audio follows as binary frames until stop_audio
+                recorded_text = await transcribe_voice_turn(websocket, message)
+                if recorded_text:
                     # Pass the transcribed text to the LLM
-                    await process_message(graph, recorded_text, config, websocket)
+                    await process_message(graph, recorded_text, config, websocket, stream_tokens)
             else:
-                await process_message(graph, message["content"], config, websocket)
+                await process_message(graph, message["content"], config, websocket, stream_tokens)
 
     except WebSocketDisconnect:
         print("WebSocket disconnected.")
     except Exception as e:
         print(f"Unexpected error: {e}")
         await websocket.close(code=1011, reason="Server error")
+    finally:
+        if session_conversation_id is not None:
+            prompt_contexts.close_session(session_conversation_id)
 
 
-async def process_message(graph, query_text: str, config: dict, websocket: WebSocket):
-    query = {"messages": [HumanMessage(content=query_text)]}
+async def receive_frame(websocket: WebSocket) -> Union[bytes, dict]:
+    """Next client frame: PCM audio of a voice turn as bytes, or a JSON message."""
+    frame = await websocket.receive()
+    if frame["type"] == "websocket.disconnect":
+        raise WebSocketDisconnect(frame.get("code", 1000))
+    if frame.get("bytes") is not None:
+        return frame["bytes"]
+    return json.loads(frame["text"])
 
-    async for event in graph.astream(query, stream_mode="values", config=config):
-        if "messages" not in event:
-            continue
-        
-        latest_msg = event["messages"][-1]
-        
-        if isinstance(latest_msg, AIMessage):
-            if not latest_msg.content:
-                continue
-
-            # Check if the AIMessage has tool_calls
-            if hasattr(latest_msg, "tool_calls") and latest_msg.tool_calls:
-                # Handle tool_calls
-                for tool_call in latest_msg.tool_calls:
-                    tool_name = tool_call["name"]
-                    tool_args = tool_call["args"]
-
-                    # Invoke the tool (e.g., generate_contextual_meme)
-                    if tool_name == "generate_contextual_meme":
-                        # Simulate tool invocation (replace with actual tool logic)
-                        meme_urls = generate_memes(tool_args["conversation_context"], tool_args["num_memes"])
-
-                        # Create a ToolMessage with the results
-                        tool_message = ToolMessage(
-                            content=" ".join(meme_urls),  # Join URLs with a space
-                            tool_call_id=tool_call["id"],  # Match the tool_call_id
-                            additional_kwargs={"urls": meme_urls}  # Include the meme URLs as a list
-                        )
-
-                        # Send the ToolMessage back to the graph
-                        await graph.astream(
-                            {"messages": [tool_message]},
-                            stream_mode="values",
-                            config=config
-                        )
-
-                        # Send the meme URLs to the frontend
-                        await websocket.send_json({
-                            "type": "tool_message",
-                            "content": " ".join(meme_urls),
-                            "urls": meme_urls
-                        })
-            else:
-                # If no tool_calls, send the AI response to the frontend
-                await websocket.send_json({
-                    "type": "ai_message",
-                    "content": latest_msg.content
-                })
-        
-        elif isinstance(latest_msg, ToolMessage):
-            try:
-                # Extract URLs and clean them
-                meme_urls = re.findall(r"https?://\S+", latest_msg.content)
-                cleaned_meme_urls = [url.rstrip("',") for url in meme_urls]  # Remove trailing commas and quotes
-
-                # Send the meme URLs to the frontend
-                await websocket.send_json({
-                    "type": "tool_message",
-                    "content": " ".join(cleaned_meme_urls),
-                    "urls": cleaned_meme_urls
-                })
-            except (ValueError, SyntaxError, KeyError) as e:
-                print(f"Error parsing ToolMessage content: {e}")
-                await websocket.send_json({"type": "error", "message": "Failed to parse ToolMessage content."})
 
+async def transcribe_voice_turn(websocket: WebSocket, start_message: dict) -> Optional[str]:
+    """
+    Stream one utterance from the client into a speech worker.
+
+    After an `audio` message the client sends 16-bit mono PCM as binary frames
+    (at `sample_rate`, 16 kHz unless it says otherwise) and ends with
+    `stop_audio`. While all workers are busy the client is sent its position
+    in the queue. Partial transcripts are pushed as they arrive; the final one
+    is returned, or None if the turn could not be transcribed.
+    """
+    sample_rate = int(start_message.get("sample_rate") or STT_DEFAULT_SAMPLE_RATE)
+
+    async def send_partial(text: str):
+        await websocket.send_json({"type": "audio_partial", "content": text})
+
+    async def send_queue_position(position: int):
+        # the client keeps recording; its frames are buffered until a worker is free
+        await websocket.send_json({"type": "audio_queued", "position": position})
+
+    try:
+        async with speech_pool.session(send_partial, sample_rate=sample_rate, on_queued=send_queue_position) as session:
+            await websocket.send_json({"type": "audio_started", "message": "Recording started."})
+            deadline = asyncio.get_running_loop().time() + STT_MAX_UTTERANCE_SECONDS
+            while True:
+                try:
+                    frame = await asyncio.wait_for(receive_frame(websocket), deadline - asyncio.get_running_loop().time())
+                except asyncio.TimeoutError:
+                    break  # transcribe what was said so far and free the worker
+                if isinstance(frame, bytes):
+                    await session.feed(frame)
+                elif frame.get("type") == "stop_audio":
+                    break
+            recorded_text = await session.finish()
+    except SpeechPoolBusy as e:
+        print(f"Speech pool busy: {e}")
+        await websocket.send_json({"type": "error", "message": "Too many people are talking right now, please try again or type instead."})
+        return None
+    except TranscriptionError as e:
+        print(f"Error transcribing audio: {e}")
+        await websocket.send_json({"type": "error", "message": "Voice is unavailable right now, please type instead."})
+        return None
+
+    await websocket.send_json({"type": "audio_transcription", "content": recorded_text})
+    return recorded_text
+
+
+# strong references to fire-and-forget tasks so they are not garbage collected mid-flight
+background_tasks = set()
+
+def run_in_background(coro) -> asyncio.Task:
+    task = asyncio.create_task(coro)
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+    return task
+
+
+async def label_conversation_in_background(user_id: str, conversation_id: str, user_query: str, websocket: WebSocket):
+    """Label a new conversation off the first-reply path, then store and push the topic."""
+    try:
+        label = await get_topic_label_batcher().label(user_query)
+        if not await update_conversation_topic(user_id=user_id, conversation_id=conversation_id, topic=label):
+            return  # deleted in the meantime
+    except Exception as e:
+        print(f"Error labeling conversation {conversation_id}: {e}")
+        return
+
+    try:
+        await websocket.send_json({
+            "type": "conversation_labeled",
+            "conversation_id": conversation_id,
+            "label": label
+        })
+    except Exception:
+        pass  # the client left; the label is stored anyway
+
+
+async def process_message(graph, query_text: str, config: dict, websocket: WebSocket, stream_tokens: bool = True):
+    thread_id = config["configurable"]["thread_id"]
+    query = {"messages": [HumanMessage(content=query_text)]}
+    turn = await history_cache.turn_started(thread_id)
+    try:
+        await TurnEventRouter(websocket, stream_tokens=stream_tokens).run(graph, query, config)
+    finally:
+        # the next GET /chat of this conversation is served from the cache
+        try:
+            await history_cache.write_through(thread_id, graph.checkpointer, turn)
+        except Exception as e:
+            print(f"Error writing history through for {thread_id}: {e}")
+    await touch_conversation(config["configurable"]["user_id"], thread_id)
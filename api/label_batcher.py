@@ -0,0 +1,97 @@
+import os
+import json
+import asyncio
+
+# typing_extensions
+from typing_extensions import List, Optional, Tuple
+
+
+LABEL_BATCH_MAX_SIZE = int(os.getenv("LABEL_BATCH_MAX_SIZE", 16))
+LABEL_BATCH_MAX_WAIT_MS = int(os.getenv("LABEL_BATCH_MAX_WAIT_MS", 30))
+
+
+class TopicLabelBatcher:
+    """
+    Micro-batches conversation topic labeling.
+
+    Callers await `label(message)`. Requests arriving within `max_wait_ms` of
+    each other (up to `max_batch_size`) are labeled with one structured-output
+    call that returns a label per index, and each caller's future is resolved
+    with its own label. A batch of one uses the single-message chain. If the
+    batch call fails, or leaves some items without a label, only those items
+    are retried one by one, so one bad item cannot fail the others.
+    """
+
+    def __init__(
+        self,
+        single_chain,
+        batch_chain,
+        max_batch_size: int = LABEL_BATCH_MAX_SIZE,
+        max_wait_ms: int = LABEL_BATCH_MAX_WAIT_MS,
+    ):
+        self.single_chain = single_chain
+        self.batch_chain = batch_chain
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self._pending: List[Tuple[str, asyncio.Future]] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._tasks = set()
+        self.llm_calls = 0
+
+    async def label(self, message: str) -> str:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((message, future))
+
+        if len(self._pending) >= self.max_batch_size:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.max_wait, self._flush)
+
+        return await future
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, []
+        if not batch:
+            return
+        task = asyncio.create_task(self._run(batch))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, batch: List[Tuple[str, asyncio.Future]]):
+        if len(batch) == 1:
+            await self._label_one(*batch[0])
+            return
+
+        labels = {}
+        try:
+            self.llm_calls += 1
+            numbered = "\n".join(f"{i}: {json.dumps(message)}" for i, (message, _) in enumerate(batch))
+            labels = await self.batch_chain.ainvoke({"messages": numbered})
+        except Exception as e:
+            print(f"Error labeling batch of {len(batch)} conversations, retrying individually: {e}")
+
+        retries = []
+        for i, (message, future) in enumerate(batch):
+            label = labels.get(i)
+            if isinstance(label, str) and label.strip():
+                if not future.done():
+                    future.set_result(label.strip())
+            else:
+                retries.append(self._label_one(message, future))
+        if retries:
+            await asyncio.gather(*retries)
+
+    async def _label_one(self, message: str, future: asyncio.Future):
+        try:
+            self.llm_calls += 1
+            label = await self.single_chain.ainvoke(message)
+        except Exception as e:
+            if not future.done():
+                future.set_exception(e)
+            return
+        if not future.done():
+            future.set_result(label)
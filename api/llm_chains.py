@@ -24,4 +24,29 @@ def assign_chat_topic(llm):
 
     assign_chat_topic_chain = prompt_template | structured_output_llm | (lambda x: x["label"])
 
-    return assign_chat_topic_chain
\ No newline at end of file
+    return assign_chat_topic_chain
+
+class TopicLabel(TypedDict):
+  index: int
+  label: str
+
+class LabelConvoBatch(TypedDict):
+  labels: List[TopicLabel]
+
+def assign_chat_topics(llm):
+
+    template = """
+        You are an expert in assigning concise topics to conversations.
+        Below are the initial input messages of several unrelated conversations, one per line, each prefixed with its index.
+        Assign each conversation a relevant topic in 5 words or less, and return exactly one label per index.
+
+        {messages}
+    """
+
+    structured_output_llm = llm.with_structured_output(LabelConvoBatch)
+
+    prompt_template = ChatPromptTemplate.from_template(template=template)
+
+    assign_chat_topics_chain = prompt_template | structured_output_llm | (lambda x: {item["index"]: item["label"] for item in x["labels"]})
+
+    return assign_chat_topics_chain
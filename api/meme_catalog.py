@@ -0,0 +1,191 @@
+import os
+import json
+import time
+import asyncio
+
+# typing_extensions
+from typing_extensions import NamedTuple, Optional, Tuple
+
+# redis ops
+from . import redis_ops
+
+# http client
+from .http_client import imgflip_client
+
+
+IMGFLIP_API_URL = os.getenv("IMGFLIP_API_URL", "https://api.imgflip.com")
+MEME_CATALOG_TTL = int(os.getenv("MEME_CATALOG_TTL", 6 * 60 * 60))
+
+MEME_CATALOG_REDIS_KEY = "meme:templates"
+MEME_CATALOG_LOCK_KEY = "meme:templates:refresh_lock"
+
+
+class TemplateRecord(NamedTuple):
+    """Compact in-memory form of an Imgflip template."""
+    id: str
+    name: str
+    box_count: int
+
+
+class MemeTemplateCatalog:
+    """
+    Process-wide cache of the Imgflip `get_memes` catalog.
+
+    Templates are served from memory. Once older than `ttl` they are still
+    served while a single background refresh runs (stale-while-revalidate).
+    The catalog is mirrored into Redis so every worker shares one copy: a
+    refresh adopts a fresh Redis copy written by another worker before going
+    to Imgflip, and a cold worker starts from it.
+    """
+
+    def __init__(self, base_url: str = IMGFLIP_API_URL, ttl: int = MEME_CATALOG_TTL):
+        self.base_url = base_url.rstrip("/")
+        self.ttl = ttl
+        self._records: Tuple[TemplateRecord, ...] = ()
+        self._fetched_at = 0.0
+        self._refresh_task: Optional[asyncio.Task] = None
+        self._refresh_loop_task: Optional[asyncio.Task] = None
+
+    @property
+    def is_stale(self) -> bool:
+        return time.time() - self._fetched_at > self.ttl
+
+    async def start(self):
+        """Load the catalog (from Redis if possible) and start the periodic refresh."""
+        if not await self._load_from_redis():
+            await self.refresh()
+        elif self.is_stale:
+            self._schedule_refresh()
+        self._refresh_loop_task = asyncio.create_task(self._refresh_loop())
+        print(f"Meme template catalog loaded with {len(self._records)} templates.")
+
+    async def close(self):
+        for task in (self._refresh_loop_task, self._refresh_task):
+            if task and not task.done():
+                task.cancel()
+                try:
+                    await task
+                except asyncio.CancelledError:
+                    pass
+        self._refresh_loop_task = None
+        self._refresh_task = None
+
+    async def get_templates(self) -> Tuple[TemplateRecord, ...]:
+        """Return the current templates, revalidating in the background when stale."""
+        if not self._records:
+            await self._refresh_once()
+        elif self.is_stale:
+            self._schedule_refresh()
+        return self._records
+
+    def _schedule_refresh(self) -> asyncio.Task:
+        if self._refresh_task is None or self._refresh_task.done():
+            self._refresh_task = asyncio.create_task(self.refresh())
+        return self._refresh_task
+
+    async def _refresh_once(self):
+        # concurrent callers share the refresh already in flight
+        await asyncio.shield(self._schedule_refresh())
+
+    async def _refresh_loop(self):
+        while True:
+            await asyncio.sleep(self.ttl)
+            try:
+                await self._refresh_once()
+            except Exception as e:
+                print(f"Error refreshing meme templates: {str(e)}")
+
+    async def refresh(self):
+        """Refresh from Redis if another worker already did, otherwise from Imgflip."""
+        if await self._load_from_redis() and not self.is_stale:
+            return
+
+        lock_token = await self._acquire_refresh_lock()
+        if lock_token is None:
+            # another worker is fetching; keep serving what we have
+            if not self._records:
+                await self._wait_for_peer_refresh()
+            return
+
+        try:
+            records = await self._fetch_from_imgflip()
+            if not records:
+                return
+
+            self._records = records
+            self._fetched_at = time.time()
+            await self._store_in_redis()
+        finally:
+            if lock_token:
+                await self._release_refresh_lock(lock_token)
+
+    async def _wait_for_peer_refresh(self, attempts: int = 20, interval: float = 0.5):
+        for _ in range(attempts):
+            await asyncio.sleep(interval)
+            if await self._load_from_redis():
+                return
+
+    async def _fetch_from_imgflip(self) -> Tuple[TemplateRecord, ...]:
+        try:
+            data = await imgflip_client.request_json("GET", f"{self.base_url}/get_memes")
+            return tuple(
+                TemplateRecord(
+                    id=str(template["id"]),
+                    name=template["name"],
+                    box_count=int(template["box_count"]),
+                ) for template in data.get("data", {}).get("memes", [])
+            )
+        except Exception as e:
+            print(f"Error fetching templates: {str(e)}")
+            return ()
+
+    async def _load_from_redis(self) -> bool:
+        """Adopt the Redis copy if it is newer than ours."""
+        try:
+            payload = await redis_ops.fetch_meme_templates_cache(MEME_CATALOG_REDIS_KEY)
+        except Exception as e:
+            print(f"Error reading meme templates from Redis: {str(e)}")
+            return False
+        if not payload:
+            return False
+
+        try:
+            cached = json.loads(payload)
+            fetched_at = float(cached["fetched_at"])
+            if fetched_at <= self._fetched_at:
+                return bool(self._records)
+            self._records = tuple(TemplateRecord(*record) for record in cached["templates"])
+            self._fetched_at = fetched_at
+            return bool(self._records)
+        except (ValueError, KeyError, TypeError) as e:
+            print(f"Error decoding meme templates from Redis: {str(e)}")
+            return False
+
+    async def _store_in_redis(self):
+        payload = json.dumps({
+            "fetched_at": self._fetched_at,
+            "templates": [list(record) for record in self._records],
+        }, separators=(",", ":"))
+        try:
+            # keep the mirror around for a few refresh periods so cold workers start warm
+            await redis_ops.store_meme_templates_cache(MEME_CATALOG_REDIS_KEY, payload, ttl=self.ttl * 4)
+        except Exception as e:
+            print(f"Error writing meme templates to Redis: {str(e)}")
+
+    async def _acquire_refresh_lock(self) -> Optional[str]:
+        # the lock token, "" to refresh without a lock, or None if another worker holds it
+        try:
+            return await redis_ops.acquire_lock(MEME_CATALOG_LOCK_KEY, ttl=30)
+        except Exception as e:
+            # without Redis every worker refreshes on its own
+            print(f"Error acquiring meme templates refresh lock: {str(e)}")
+            return ""
+
+    async def _release_refresh_lock(self, token: str):
+        try:
+            await redis_ops.release_lock(MEME_CATALOG_LOCK_KEY, token)
+        except Exception as e:
+            print(f"Error releasing meme templates refresh lock: {str(e)}")
+
+
+meme_catalog = MemeTemplateCatalog()
@@ -0,0 +1,294 @@
+import os
+import uuid
+import asyncio
+from collections import OrderedDict, Counter
+
+import numpy as np
+
+# typing_extensions
+from typing_extensions import Dict, List, NamedTuple, Optional, Tuple
+
+# langgraph
+from langgraph.store.base import BaseStore, GetOp, SearchOp
+
+# redis ops
+from api import redis_ops
+
+from api.embeddings import get_embedder, as_matrix
+from api.token_counter import str_token_counter
+
+
+PROMPT_CONTEXT_CACHE_SIZE = int(os.environ.get("PROMPT_CONTEXT_CACHE_SIZE", 1024))
+MEMORY_VERSION_TTL = int(os.environ.get("MEMORY_VERSION_TTL", 30 * 24 * 60 * 60))
+# memories fetched in the batched prompt-context read; larger sets are paged in afterwards
+MEMORY_SEARCH_PAGE = int(os.environ.get("MEMORY_SEARCH_PAGE", 500))
+# memories injected into the prompt: the most relevant to the latest user message, within a token budget
+MEMORY_TOP_K = int(os.environ.get("MEMORY_TOP_K", 8))
+MEMORY_BLOCK_MAX_TOKENS = int(os.environ.get("MEMORY_BLOCK_MAX_TOKENS", 400))
+QUERY_EMBEDDING_CACHE_SIZE = int(os.environ.get("QUERY_EMBEDDING_CACHE_SIZE", 256))
+
+PROFILE_KEY = "profile"
+NO_MEMORIES = "No memories yet."
+
+
+def profile_namespace(user_id: str) -> Tuple[str, ...]:
+    return ("user", user_id, "profile")
+
+
+def memories_namespace(user_id: str, conversation_id: str) -> Tuple[str, ...]:
+    return ("user", user_id, "conversation", conversation_id, "memories")
+
+
+def new_memory_id() -> str:
+    # unique without reading what is already stored
+    return f"memory_{uuid.uuid4().hex}"
+
+
+def build_profile(first_name: str, last_name: str, age: int, email: str) -> Dict:
+    return {"full_name": f"{first_name} {last_name}", "age": age, "email": email}
+
+
+async def save_profile(store: BaseStore, user_id: str, profile: Dict):
+    """Write the per-user profile record read into every prompt."""
+    await store.aput(profile_namespace(user_id), PROFILE_KEY, profile)
+
+
+def render_memories(memories: List[str]) -> str:
+    return ', '.join(memories) if memories else NO_MEMORIES
+
+
+def memory_value(memory: str, embedding: List[float], embedder_name: str) -> Dict:
+    # the embedder name tells whether a stored vector is comparable with today's queries
+    return {"data": memory, "embedding": [round(x, 6) for x in embedding], "embedder": embedder_name}
+
+
+async def embed_memories(memories: List[str]) -> List[List[float]]:
+    # local models can take a while; keep them off the event loop
+    return await asyncio.to_thread(get_embedder().embed_documents, memories) if memories else []
+
+
+class PromptContext(NamedTuple):
+    """Everything the system prompt needs besides the messages."""
+    version: Optional[str]
+    profile: Optional[Dict]
+    memories: Tuple[str, ...]
+    # one normalized embedding per memory, in the same order
+    vectors: np.ndarray
+    token_counts: Tuple[int, ...]
+
+    @property
+    def memory_block(self) -> str:
+        return render_memories(list(self.memories))
+
+    def add_memory(self, memory: str, embedding: List[float], version: Optional[str]) -> "PromptContext":
+        return self._replace(
+            version=version,
+            memories=self.memories + (memory,),
+            vectors=np.vstack([self.vectors, as_matrix([embedding])]) if self.memories else as_matrix([embedding]),
+            token_counts=self.token_counts + (str_token_counter(memory),),
+        )
+
+    def relevant_memory_block(
+        self, query: Optional[np.ndarray], top_k: int = MEMORY_TOP_K, max_tokens: int = MEMORY_BLOCK_MAX_TOKENS
+    ) -> str:
+        """
+        The memories most similar to `query`, at most `top_k` of them and `max_tokens`
+        in total, rendered oldest first. Without a query the latest memories are used.
+        """
+        if not self.memories:
+            return NO_MEMORIES
+        if query is None:
+            ranked = range(len(self.memories) - 1, -1, -1)
+        else:
+            ranked = np.argsort(-(self.vectors @ query), kind="stable").tolist()
+
+        chosen, used = [], 0
+        for index in ranked:
+            if len(chosen) >= top_k:
+                break
+            tokens = self.token_counts[index] + 1  # the ", " separator
+            if used + tokens > max_tokens:
+                continue  # a shorter, less similar memory may still fit
+            chosen.append(index)
+            used += tokens
+        return render_memories([self.memories[index] for index in sorted(chosen)])
+
+
+async def load_prompt_context(store: BaseStore, user_id: str, conversation_id: str, version: Optional[str]) -> PromptContext:
+    """
+    Read the profile and the memories of a conversation in one batched store
+    operation. Memories stored without a vector of the current embedder are
+    embedded here.
+    """
+    namespace = memories_namespace(user_id, conversation_id)
+    profile_item, items = await store.abatch([
+        GetOp(profile_namespace(user_id), PROFILE_KEY),
+        SearchOp(namespace, limit=MEMORY_SEARCH_PAGE),
+    ])
+    items = list(items)
+    while len(items) % MEMORY_SEARCH_PAGE == 0 and items:
+        page = await store.asearch(namespace, limit=MEMORY_SEARCH_PAGE, offset=len(items))
+        if not page:
+            break
+        items.extend(page)
+    items.sort(key=lambda item: item.created_at)
+
+    embedder_name = get_embedder().name
+    memories = [item.value["data"] for item in items]
+    embeddings = [item.value.get("embedding") if item.value.get("embedder") == embedder_name else None for item in items]
+    missing = [i for i, embedding in enumerate(embeddings) if embedding is None]
+    for i, embedding in zip(missing, await embed_memories([memories[i] for i in missing])):
+        embeddings[i] = embedding
+
+    return PromptContext(
+        version=version,
+        profile=profile_item.value if profile_item else None,
+        memories=tuple(memories),
+        vectors=as_matrix(embeddings),
+        token_counts=tuple(str_token_counter(memory) for memory in memories),
+    )
+
+
+class PromptContextCache:
+    """
+    Profile and memories of each conversation, cached for the prompt.
+
+    A context is loaded with one batched store read, then reused for every
+    model call of the conversation. Its version stamp lives in Redis and only
+    changes when `save_memory` writes, so every worker notices new memories
+    with one Redis GET and no store read.
+
+    A WebSocket session pins the context of its conversation for as long as
+    it is open; unpinned contexts are evicted least recently used first.
+
+    Each memory is stored with its embedding, and the cached context keeps
+    them as one matrix, so picking the memories relevant to a message is a
+    single exact similarity search in process.
+    """
+
+    def __init__(self, max_size: int = PROMPT_CONTEXT_CACHE_SIZE, query_cache_size: int = QUERY_EMBEDDING_CACHE_SIZE):
+        self.max_size = max_size
+        self.query_cache_size = query_cache_size
+        self._contexts: "OrderedDict[str, PromptContext]" = OrderedDict()
+        self._sessions: Counter = Counter()
+        # every model call of a turn ranks against the same user message
+        self._queries: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def open_session(self, conversation_id: str):
+        self._sessions[conversation_id] += 1
+
+    def close_session(self, conversation_id: str):
+        self._sessions[conversation_id] -= 1
+        if self._sessions[conversation_id] <= 0:
+            del self._sessions[conversation_id]
+            self._evict()
+
+    def _put(self, conversation_id: str, context: PromptContext):
+        self._contexts[conversation_id] = context
+        self._contexts.move_to_end(conversation_id)
+        self._evict()
+
+    def _evict(self):
+        excess = len(self._contexts) - self.max_size
+        if excess <= 0:
+            return
+        for conversation_id in list(self._contexts):
+            if excess <= 0:
+                break
+            if conversation_id not in self._sessions:
+                del self._contexts[conversation_id]
+                excess -= 1
+
+    async def _version(self, conversation_id: str) -> Optional[str]:
+        try:
+            return await redis_ops.fetch_memory_version(conversation_id)
+        except Exception as e:
+            print(f"Error reading memory version: {str(e)}")
+            return None  # unknown: never trust the cache
+
+    async def get(self, store: BaseStore, user_id: str, conversation_id: str) -> PromptContext:
+        version = await self._version(conversation_id)
+        context = self._contexts.get(conversation_id)
+        if context is not None and version is not None and context.version == version:
+            self._contexts.move_to_end(conversation_id)
+            self.hits += 1
+            return context
+
+        self.misses += 1
+        context = await load_prompt_context(store, user_id, conversation_id, version)
+        if context.profile is None:
+            context = context._replace(profile=await self._backfill_profile(store, user_id))
+        if version is not None:
+            self._put(conversation_id, context)
+        return context
+
+    async def _backfill_profile(self, store: BaseStore, user_id: str) -> Optional[Dict]:
+        # users who signed up before profiles were written get one on first use
+        from api.sql_ops import get_user_by_id
+
+        user = await get_user_by_id(user_id)
+        if user is None:
+            return None
+        profile = build_profile(user.firstName, user.lastName, user.age, user.email)
+        await save_profile(store, user_id, profile)
+        return profile
+
+    async def embed_query(self, text: str) -> Optional[np.ndarray]:
+        if not text.strip():
+            return None
+        vector = self._queries.get(text)
+        if vector is None:
+            embedding = await asyncio.to_thread(get_embedder().embed_query, text)
+            vector = as_matrix([embedding])[0]
+            self._queries[text] = vector
+            while len(self._queries) > self.query_cache_size:
+                self._queries.popitem(last=False)
+        self._queries.move_to_end(text)
+        return vector
+
+    async def memory_block(self, context: PromptContext, query: str) -> str:
+        """The memories of `context` most relevant to `query`, rendered for the system prompt."""
+        if not context.memories:
+            return NO_MEMORIES
+        return context.relevant_memory_block(await self.embed_query(query))
+
+    async def save_memory(self, store: BaseStore, user_id: str, conversation_id: str, memory: str):
+        """Store a memory with its embedding, and bump the version so every other worker reloads the context."""
+        embedder = get_embedder()
+        (embedding,) = await embed_memories([memory])
+        await store.aput(
+            memories_namespace(user_id, conversation_id), new_memory_id(), memory_value(memory, embedding, embedder.name)
+        )
+        try:
+            previous, version = await redis_ops.stamp_memory_version(conversation_id, ttl=MEMORY_VERSION_TTL)
+        except Exception as e:
+            # the memory is stored; other workers pick it up once their version read fails or changes
+            print(f"Error stamping memory version: {str(e)}")
+            self._contexts.pop(conversation_id, None)
+            return
+
+        # if nothing else was saved since the cached version, this worker already
+        # knows every memory, so the next turn needs no reload
+        context = self._contexts.get(conversation_id)
+        if context is not None and context.version == previous:
+            self._put(conversation_id, context.add_memory(memory, embedding, version))
+        else:
+            self._contexts.pop(conversation_id, None)
+
+    def metrics(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._contexts),
+            "sessions": len(self._sessions),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+            "embedder": get_embedder().name,
+            "top_k": MEMORY_TOP_K,
+            "max_tokens": MEMORY_BLOCK_MAX_TOKENS,
+        }
+
+
+prompt_contexts = PromptContextCache()
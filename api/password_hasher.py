@@ -0,0 +1,120 @@
+import os
+import asyncio
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+# typing_extensions
+from typing_extensions import Optional, Tuple
+
+from passlib.context import CryptContext
+
+
+BCRYPT_ROUNDS = int(os.environ.get("BCRYPT_ROUNDS", 12))
+PASSWORD_HASH_WORKERS = int(os.environ.get("PASSWORD_HASH_WORKERS", os.cpu_count() or 1))
+PASSWORD_HASH_MAX_PENDING = int(os.environ.get("PASSWORD_HASH_MAX_PENDING", 256))
+
+
+# one CryptContext per worker process, built on first use
+_worker_contexts = {}
+
+
+def build_crypt_context(rounds: int) -> CryptContext:
+    # pinning min/max rounds to the configured cost makes needs_update() flag any
+    # hash made with a different cost, so it is rehashed on the next login
+    return CryptContext(
+        schemes=["bcrypt"],
+        deprecated="auto",
+        bcrypt__default_rounds=rounds,
+        bcrypt__min_rounds=rounds,
+        bcrypt__max_rounds=rounds,
+    )
+
+
+def _crypt_context(rounds: int) -> CryptContext:
+    if rounds not in _worker_contexts:
+        _worker_contexts[rounds] = build_crypt_context(rounds)
+    return _worker_contexts[rounds]
+
+
+def _hash_password(password: str, rounds: int) -> str:
+    return _crypt_context(rounds).hash(password)
+
+
+def _verify_and_update(password: str, hashed_password: str, rounds: int) -> Tuple[bool, Optional[str]]:
+    return _crypt_context(rounds).verify_and_update(password, hashed_password)
+
+
+class PasswordHasher:
+    """
+    Runs bcrypt in a bounded process pool so hashing never blocks the event loop.
+
+    At most `max_pending` operations are queued or running; further callers
+    wait for a slot. `queue_depth` counts operations submitted but not finished;
+    `succeeded` and `failed` count the finished ones.
+    """
+
+    def __init__(
+        self,
+        max_workers: int = PASSWORD_HASH_WORKERS,
+        max_pending: int = PASSWORD_HASH_MAX_PENDING,
+        rounds: int = BCRYPT_ROUNDS,
+    ):
+        self.max_workers = max_workers
+        self.rounds = rounds
+        self._slots = asyncio.Semaphore(max_pending)
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self.queue_depth = 0
+        self.succeeded = 0
+        self.failed = 0
+
+    def start(self):
+        if self._executor is None:
+            # spawn, not fork: the app process holds event loops, sockets and model weights
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.max_workers,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+
+    async def close(self):
+        if self._executor is not None:
+            executor, self._executor = self._executor, None
+            # joining the worker processes blocks, so it runs off the event loop
+            await asyncio.to_thread(executor.shutdown, wait=True, cancel_futures=True)
+
+    async def _run(self, func, *args):
+        self.start()
+        self.queue_depth += 1
+        try:
+            async with self._slots:
+                loop = asyncio.get_running_loop()
+                result = await loop.run_in_executor(self._executor, func, *args)
+            self.succeeded += 1
+            return result
+        except Exception:
+            self.failed += 1
+            raise
+        finally:
+            self.queue_depth -= 1
+
+    async def hash(self, password: str) -> str:
+        return await self._run(_hash_password, password, self.rounds)
+
+    async def verify(self, password: str, hashed_password: str) -> bool:
+        valid, _ = await self.verify_and_update(password, hashed_password)
+        return valid
+
+    async def verify_and_update(self, password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+        """Verify a password; also return a new hash if the stored one uses another cost."""
+        return await self._run(_verify_and_update, password, hashed_password, self.rounds)
+
+    def metrics(self) -> dict:
+        return {
+            "workers": self.max_workers,
+            "bcrypt_rounds": self.rounds,
+            "queue_depth": self.queue_depth,
+            "succeeded": self.succeeded,
+            "failed": self.failed,
+        }
+
+
+password_hasher = PasswordHasher()
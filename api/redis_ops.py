@@ -1,31 +1,147 @@
+import os
 import uuid
+import math
+import time
 from datetime import datetime
 import redis.asyncio as redis
-import json
-from typing import Optional, Dict
+from typing import Optional, Dict, List, Tuple
+
+from api.conversation_codec import encode_conversation, decode_conversation
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+REDIS_URL = os.environ.get("REDIS_URL", "redis://localhost:6379")
+# per pool; callers wait up to REDIS_POOL_TIMEOUT seconds for a free connection
+REDIS_MAX_CONNECTIONS = int(os.environ.get("REDIS_MAX_CONNECTIONS", 50))
+REDIS_POOL_TIMEOUT = float(os.environ.get("REDIS_POOL_TIMEOUT", 5))
+REDIS_SOCKET_TIMEOUT = float(os.environ.get("REDIS_SOCKET_TIMEOUT", 5))
+REDIS_HEALTH_CHECK_INTERVAL = int(os.environ.get("REDIS_HEALTH_CHECK_INTERVAL", 30))
+
+redis_client = None  # Global Redis client for shared use (str replies)
+redis_binary_client = None  # same server, bytes replies, for msgpack-encoded values
+_store_history_page = None
+_advance_history_pointer = None
+_start_history_turn = None
+_release_lock = None
+
+PENDING_CONVERSATION_TOPIC = "New conversation"  # topic until the conversation is labeled
+CONVERSATION_PAGE_SIZE = 50
+CONVERSATION_PAGE_MAX = 200
+CONVERSATION_INDEX_MIGRATION_KEY = "migrations:conversation_index:v1"
+# deleted conversations whose checkpoints and memories still have to be purged,
+# as "user_id:conversation_id" scored by the time the purge is due
+CLEANUP_QUEUE_KEY = "cleanup:conversations"
+CLEANUP_ATTEMPTS_KEY = "cleanup:conversations:attempts"
+# rendered history pages: one hash of payloads, their last use, and their total size
+HISTORY_PAGES_KEY = "history:pages"
+HISTORY_PAGES_LRU_KEY = "history:pages:lru"
+HISTORY_PAGES_BYTES_KEY = "history:pages:bytes"
+
+# store a page, then drop least recently used pages until the total size fits
+STORE_HISTORY_PAGE_LUA = """
+local previous = redis.call('HSTRLEN', KEYS[1], ARGV[1])
+redis.call('HSET', KEYS[1], ARGV[1], ARGV[2])
+redis.call('ZADD', KEYS[2], ARGV[3], ARGV[1])
+local total = redis.call('INCRBY', KEYS[3], string.len(ARGV[2]) - previous)
+local evicted = 0
+while total > tonumber(ARGV[4]) do
+    local oldest = redis.call('ZPOPMIN', KEYS[2])
+    if #oldest == 0 then break end
+    total = redis.call('INCRBY', KEYS[3], -redis.call('HSTRLEN', KEYS[1], oldest[1]))
+    redis.call('HDEL', KEYS[1], oldest[1])
+    evicted = evicted + 1
+end
+return evicted
+"""
+
+# a turn clears the pointer and bumps the thread's turn number, so a turn that ended
+# after a newer one started cannot point the thread at its checkpoint again
+START_HISTORY_TURN_LUA = """
+local turn = redis.call('INCR', KEYS[2])
+redis.call('EXPIRE', KEYS[2], ARGV[1])
+redis.call('DEL', KEYS[1])
+return turn
+"""
+
+# checkpoint ids are time-ordered, so the pointer only ever moves forward,
+# and only the latest turn of the thread (ARGV[3], if known) may move it
+ADVANCE_HISTORY_POINTER_LUA = """
+if ARGV[3] ~= '' and redis.call('GET', KEYS[2]) ~= ARGV[3] then return 0 end
+local current = redis.call('GET', KEYS[1])
+if current and current >= ARGV[1] then return 0 end
+redis.call('SET', KEYS[1], ARGV[1], 'EX', ARGV[2])
+return 1
+"""
+
+# delete the lock only if it still holds our token, so an expired lock retaken by another worker is left alone
+RELEASE_LOCK_LUA = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+
+def conversation_index_key(user_id: str) -> str:
+    # conversation ids of a user, scored by last activity (creation time until the first turn)
+    return f"user:{user_id}:conversations:by_activity"
+
+
+def conversation_score(conversation_data: Dict) -> float:
+    return datetime.fromisoformat(conversation_data["timestamp"]).timestamp()
+
+
+def format_conversation(conversation_id: str, raw: bytes) -> Dict:
+    conversation = decode_conversation(raw)
+    conversation["id"] = conversation_id
+    # Format the timestamp
+    if 'timestamp' in conversation:
+        timestamp = datetime.fromisoformat(conversation['timestamp'])
+        conversation['created_at'] = timestamp.strftime('%Y-%m-%d %H:%M')
+        del conversation['timestamp']
+    return conversation
+
+
+def create_redis_pool(decode_responses: bool) -> redis.BlockingConnectionPool:
+    return redis.BlockingConnectionPool.from_url(
+        REDIS_URL,
+        max_connections=REDIS_MAX_CONNECTIONS,
+        timeout=REDIS_POOL_TIMEOUT,
+        socket_timeout=REDIS_SOCKET_TIMEOUT,
+        socket_connect_timeout=REDIS_SOCKET_TIMEOUT,
+        health_check_interval=REDIS_HEALTH_CHECK_INTERVAL,
+        decode_responses=decode_responses,
+    )
 
-redis_client = None  # Global Redis client for shared use
 
 async def initialize_redis():
     """
-    Initialize the Redis connection.
+    Initialize the Redis connection pools.
     """
-    global redis_client
+    global redis_client, redis_binary_client, _store_history_page, _advance_history_pointer, _start_history_turn, _release_lock
     if not redis_client:
-        redis_client = redis.Redis.from_url(
-            "redis://localhost:6379", decode_responses=True,
-        )
+        redis_client = redis.Redis.from_pool(create_redis_pool(decode_responses=True))
+        redis_binary_client = redis.Redis.from_pool(create_redis_pool(decode_responses=False))
+        _store_history_page = redis_client.register_script(STORE_HISTORY_PAGE_LUA)
+        _advance_history_pointer = redis_client.register_script(ADVANCE_HISTORY_POINTER_LUA)
+        _start_history_turn = redis_client.register_script(START_HISTORY_TURN_LUA)
+        _release_lock = redis_client.register_script(RELEASE_LOCK_LUA)
+        await redis_client.ping()
         print("Redis connection initialized.")
 
 
 async def close_redis_connection():
     """
-    Gracefully close the Redis connection.
+    Gracefully close the Redis connection pools.
     """
-    global redis_client
+    global redis_client, redis_binary_client
     if redis_client:
         await redis_client.aclose()
+        await redis_binary_client.aclose()
         redis_client = None
+        redis_binary_client = None
         print("Redis connection closed.")
 
 
@@ -37,8 +153,6 @@ async def add_conversation(user_id: str, email: str, name: str, description: str
     conversation_id = str(uuid.uuid4())  # Unique conversation ID
     timestamp = datetime.now().isoformat()
 
-    # Ensure the user exists with their email
-    await redis_client.hset(user_key, mapping={"user_email": email})
 
     # Structure for the conversation
     conversation_data = {
@@ -48,9 +162,14 @@ async def add_conversation(user_id: str, email: str, name: str, description: str
         "topic": topic,
     }
 
-    # Add the conversation under 'user:{user_id}:conversations'
+    # Ensure the user exists with their email, and add the conversation under
+    # 'user:{user_id}:conversations' and to the index, in one round trip
     conversations_key = f"{user_key}:conversations"
-    await redis_client.hset(conversations_key, conversation_id, json.dumps(conversation_data))
+    async with redis_binary_client.pipeline(transaction=True) as pipe:
+        pipe.hset(user_key, mapping={"user_email": email})
+        pipe.hset(conversations_key, conversation_id, encode_conversation(conversation_data))
+        pipe.zadd(conversation_index_key(user_id), {conversation_id: conversation_score(conversation_data)})
+        await pipe.execute()
 
     return {
         "user_id": user_id,
@@ -59,31 +178,108 @@ async def add_conversation(user_id: str, email: str, name: str, description: str
     }
 
 
-async def fetch_user_conversations(user_id: str) -> list:
+async def fetch_user_conversations(
+    user_id: str, cursor: Optional[str] = None, limit: int = CONVERSATION_PAGE_SIZE
+) -> Tuple[List[Dict], Optional[str]]:
     """
-    Fetch all conversations for a user.
+    Fetch one page of a user's conversations, most recently active first.
+
+    `cursor` is the `next_cursor` returned with the previous page; the returned
+    `next_cursor` is None on the last page. A cursor is "<score>:<n>": the score
+    of the last conversation served and how many served conversations share it.
     """
-    user_conversations_key = f"user:{user_id}:conversations"
-    conversations_data = await redis_client.hgetall(user_conversations_key)
+    index_key = conversation_index_key(user_id)
+    conversations_key = f"user:{user_id}:conversations"
+    limit = max(1, min(limit, CONVERSATION_PAGE_MAX))
 
-    if not conversations_data:
-        return []
+    if cursor is None and not await redis_client.exists(index_key):
+        # conversations written before the index existed
+        await backfill_user_conversation_index(user_id)
 
+    # ties are ordered by member, so skipping the `n` already served at the cursor score is stable
+    max_score, offset, cursor_score = "+inf", 0, None
+    if cursor is not None:
+        score_part, _, offset_part = cursor.partition(":")
+        cursor_score, offset = float(score_part), int(offset_part or 0)
+        if not math.isfinite(cursor_score) or offset < 0:
+            raise ValueError(f"Invalid cursor: {cursor}")
+        max_score = repr(cursor_score)
+    entries = await redis_client.zrevrangebyscore(
+        index_key, max_score, "-inf", start=offset, num=limit + 1, withscores=True
+    )
+    page, has_more = entries[:limit], len(entries) > limit
+    if not page:
+        return [], None
+
+    conversation_ids = [conversation_id for conversation_id, _ in page]
     conversations = []
-    for conversation_id, conversation_json in conversations_data.items():
+    for conversation_id, raw in zip(
+        conversation_ids, await redis_binary_client.hmget(conversations_key, conversation_ids)
+    ):
+        if raw is None:
+            continue  # removed between the two reads
         try:
-            conversation = json.loads(conversation_json)
-            conversation["id"] = conversation_id
-            # Format the timestamp
-            if 'timestamp' in conversation:
-                timestamp = datetime.fromisoformat(conversation['timestamp'])
-                conversation['created_at'] = timestamp.strftime('%Y-%m-%d %H:%M')
-                del conversation['timestamp']
-            conversations.append(conversation)
-        except json.JSONDecodeError:
-            continue  # Skip invalid JSON
+            conversations.append(format_conversation(conversation_id, raw))
+        except ValueError:
+            continue  # Skip unreadable records
+
+    next_cursor = None
+    if has_more:
+        last_score = page[-1][1]
+        ties = sum(1 for _, score in page if score == last_score)
+        if last_score == cursor_score:
+            ties += offset  # the whole page sits on the cursor score
+        next_cursor = f"{last_score!r}:{ties}"
+    return conversations, next_cursor
+
 
-    return conversations
+async def touch_conversation(user_id: str, conversation_id: str):
+    """
+    Move a conversation to the top of the index after a chat turn.
+    """
+    # xx: never re-add a conversation deleted while the turn was running
+    await redis_client.zadd(conversation_index_key(user_id), {conversation_id: time.time()}, xx=True, gt=True)
+
+
+async def backfill_user_conversation_index(user_id: str) -> int:
+    """
+    Index the conversations of one user from the `user:{id}:conversations` hash.
+    Existing index entries keep their score. Returns the number of conversations seen.
+    """
+    conversations_key = f"user:{user_id}:conversations"
+    scores = {}
+    async for conversation_id, raw in redis_binary_client.hscan_iter(conversations_key):
+        try:
+            scores[conversation_id.decode()] = conversation_score(decode_conversation(raw))
+        except (KeyError, ValueError):
+            scores[conversation_id.decode()] = 0.0  # unreadable entries sort last
+    if scores:
+        await redis_client.zadd(conversation_index_key(user_id), scores, nx=True)
+    return len(scores)
+
+
+async def backfill_conversation_index() -> int:
+    """
+    One-shot migration: build the conversation index of every user from the existing hashes.
+    Runs once per Redis database; returns the number of conversations indexed by this call.
+    """
+    if await redis_client.exists(CONVERSATION_INDEX_MIGRATION_KEY):
+        return 0
+    lock_key = f"{CONVERSATION_INDEX_MIGRATION_KEY}:lock"
+    lock_token = await acquire_lock(lock_key, ttl=300)
+    if not lock_token:
+        return 0  # another worker is migrating
+
+    try:
+        indexed = 0
+        async for conversations_key in redis_client.scan_iter(match="user:*:conversations", count=500):
+            user_id = conversations_key[len("user:"):-len(":conversations")]
+            if await redis_client.type(conversations_key) == "hash":
+                indexed += await backfill_user_conversation_index(user_id)
+        await redis_client.set(CONVERSATION_INDEX_MIGRATION_KEY, datetime.now().isoformat())
+        return indexed
+    finally:
+        await release_lock(lock_key, lock_token)
 
 
 async def fetch_conversation(user_id: str, conversation_id: str) -> dict:
@@ -91,35 +287,114 @@ async def fetch_conversation(user_id: str, conversation_id: str) -> dict:
     Fetch a specific conversation by ID.
     """
     user_conversations_key = f"user:{user_id}:conversations"
-    conversation_json = await redis_client.hget(user_conversations_key, conversation_id)
+    raw = await redis_binary_client.hget(user_conversations_key, conversation_id)
     
-    if conversation_json is None:
+    if raw is None:
         raise ValueError(f"Conversation with ID {conversation_id} not found for user {user_id}.")
 
     try:
-        conversation = json.loads(conversation_json)
-        conversation["id"] = conversation_id
-
-        if 'timestamp' in conversation:
-            timestamp = datetime.fromisoformat(conversation['timestamp'])
-            conversation['created_at'] = timestamp.strftime('%Y-%m-%d %H:%M')
-            del conversation['timestamp']
-        
-        return conversation
-
-    except json.JSONDecodeError as e:
+        return format_conversation(conversation_id, raw)
+    except ValueError as e:
         raise ValueError(f"Error decoding conversation data: {str(e)}")
 
 
-async def delete_conversation(user_id: str, conversation_id: str):
+async def delete_conversation(user_id: str, conversation_id: str, purge_delay: float = 0):
     """
-    Delete a conversation from Redis.
+    Delete a conversation from Redis and queue the purge of its Postgres data.
     """
     user_conversations_key = f"user:{user_id}:conversations"
-    await redis_client.hdel(user_conversations_key, conversation_id)
+    async with redis_client.pipeline(transaction=True) as pipe:
+        pipe.hdel(user_conversations_key, conversation_id)
+        pipe.zrem(conversation_index_key(user_id), conversation_id)
+        pipe.zadd(CLEANUP_QUEUE_KEY, {cleanup_member(user_id, conversation_id): time.time() + purge_delay}, nx=True)
+        pipe.delete(history_pointer_key(conversation_id), history_turn_key(conversation_id))
+        await pipe.execute()
     return {"message": f"Conversation {conversation_id} deleted successfully."}
 
 
+async def conversation_exists(user_id: str, conversation_id: str) -> bool:
+    """
+    Check whether a conversation belongs to a user and has not been deleted.
+    """
+    return bool(await redis_client.hexists(f"user:{user_id}:conversations", conversation_id))
+
+
+async def find_missing_conversations(conversations: List[Tuple[str, str]]) -> List[Tuple[str, str]]:
+    """
+    Return the (user_id, conversation_id) pairs that have no Redis entry.
+    """
+    async with redis_client.pipeline(transaction=False) as pipe:
+        for user_id, conversation_id in conversations:
+            pipe.hexists(f"user:{user_id}:conversations", conversation_id)
+        exists = await pipe.execute()
+    return [pair for pair, found in zip(conversations, exists) if not found]
+
+
+async def has_indexed_conversations() -> bool:
+    """
+    Check whether any user has a conversation index, i.e. whether Redis still holds conversations at all.
+    """
+    async for _ in redis_client.scan_iter(match=conversation_index_key("*"), count=1000):
+        return True
+    return False
+
+
+def cleanup_member(user_id: str, conversation_id: str) -> str:
+    return f"{user_id}:{conversation_id}"
+
+
+def parse_cleanup_member(member: str) -> Tuple[str, str]:
+    user_id, _, conversation_id = member.partition(":")
+    return user_id, conversation_id
+
+
+async def queue_cleanups(conversations: List[Tuple[str, str]], purge_delay: float = 0):
+    """
+    Queue the purge of conversations that are already gone from Redis.
+    """
+    if conversations:
+        due = time.time() + purge_delay
+        await redis_client.zadd(
+            CLEANUP_QUEUE_KEY, {cleanup_member(*pair): due for pair in conversations}, nx=True
+        )
+
+
+async def fetch_due_cleanups(limit: int) -> List[str]:
+    """
+    Fetch queued purges whose time has come, oldest first.
+    """
+    return await redis_client.zrangebyscore(CLEANUP_QUEUE_KEY, "-inf", time.time(), start=0, num=limit)
+
+
+async def retry_cleanup(member: str, delay: float) -> int:
+    """
+    Push a failed purge back by `delay` seconds. Returns the number of attempts so far.
+    """
+    async with redis_client.pipeline(transaction=True) as pipe:
+        pipe.zadd(CLEANUP_QUEUE_KEY, {member: time.time() + delay}, xx=True)
+        pipe.hincrby(CLEANUP_ATTEMPTS_KEY, member, 1)
+        _, attempts = await pipe.execute()
+    return attempts
+
+
+async def cleanup_attempts(member: str) -> int:
+    return int(await redis_client.hget(CLEANUP_ATTEMPTS_KEY, member) or 0)
+
+
+async def finish_cleanup(member: str):
+    """
+    Drop a purge from the queue once everything is gone.
+    """
+    async with redis_client.pipeline(transaction=True) as pipe:
+        pipe.zrem(CLEANUP_QUEUE_KEY, member)
+        pipe.hdel(CLEANUP_ATTEMPTS_KEY, member)
+        await pipe.execute()
+
+
+async def cleanup_queue_size() -> int:
+    return await redis_client.zcard(CLEANUP_QUEUE_KEY)
+
+
 async def label_conversation(user_id: str, llm_response_label:str) -> Dict:
     """
     Label a new conversation based on the first message and store it in Redis.
@@ -139,10 +414,227 @@ async def label_conversation(user_id: str, llm_response_label:str) -> Dict:
 
     user_key = f"user:{user_id}"
     conversations_key = f"{user_key}:conversations"
-    await redis_client.hset(conversations_key, conversation_id, json.dumps(conversation_data))
+    async with redis_binary_client.pipeline(transaction=True) as pipe:
+        pipe.hset(conversations_key, conversation_id, encode_conversation(conversation_data))
+        pipe.zadd(conversation_index_key(user_id), {conversation_id: conversation_score(conversation_data)})
+        await pipe.execute()
 
     return {
         "conversation_id": conversation_id,
         "label": label,
         "conversation_data": conversation_data,
-    }
\ No newline at end of file
+    }
+
+
+async def update_conversation_topic(user_id: str, conversation_id: str, topic: str) -> bool:
+    """
+    Set the topic of an existing conversation. Returns False if it no longer exists.
+    """
+    conversations_key = f"user:{user_id}:conversations"
+    async with redis_binary_client.pipeline(transaction=True) as pipe:
+        while True:
+            try:
+                # a delete or another update between the read and the write aborts the write, and we read again
+                await pipe.watch(conversations_key)
+                raw = await pipe.hget(conversations_key, conversation_id)
+                if raw is None:
+                    return False
+
+                # legacy JSON records are rewritten in the current encoding
+                conversation_data = decode_conversation(raw)
+                conversation_data["topic"] = topic
+                pipe.multi()
+                pipe.hset(conversations_key, conversation_id, encode_conversation(conversation_data))
+                await pipe.execute()
+                return True
+            except redis.WatchError:
+                continue
+
+
+# the non-secret columns of a `users` row; the password hash is never cached
+CACHED_USER_FIELDS = ("user_id", "firstName", "lastName", "age", "email")
+
+
+async def fetch_cached_user(user_id: str) -> Optional[Dict]:
+    """
+    Fetch the cached profile fields of a `users` row.
+    """
+    user = await redis_client.hgetall(f"cache:user:{user_id}")
+    if not user or any(field not in user for field in CACHED_USER_FIELDS):
+        return None
+    user = {field: user[field] for field in CACHED_USER_FIELDS}
+    user["age"] = int(user["age"])
+    return user
+
+
+async def fetch_cached_user_id(email: str) -> Optional[str]:
+    """
+    Fetch the user id cached for an email; "" means the email is known to be unregistered.
+    """
+    return await redis_client.get(f"cache:user_email:{email}")
+
+
+async def cache_user(user: Dict, ttl: int):
+    """
+    Cache the profile fields of a `users` row and its email lookup.
+    """
+    user_key = f"cache:user:{user['user_id']}"
+    async with redis_client.pipeline(transaction=True) as pipe:
+        # replace the whole hash, so fields cached by older versions do not linger
+        pipe.delete(user_key)
+        pipe.hset(user_key, mapping={field: str(user[field]) for field in CACHED_USER_FIELDS})
+        pipe.expire(user_key, ttl)
+        pipe.set(f"cache:user_email:{user['email']}", user["user_id"], ex=ttl)
+        await pipe.execute()
+
+
+async def cache_unknown_email(email: str, ttl: int):
+    """
+    Remember that no user is registered with this email.
+    """
+    await redis_client.set(f"cache:user_email:{email}", "", ex=ttl, nx=True)
+
+
+async def invalidate_cached_user(user_id: Optional[str] = None, email: Optional[str] = None):
+    """
+    Drop cached entries of a user.
+    """
+    keys = []
+    if user_id:
+        keys.append(f"cache:user:{user_id}")
+    if email:
+        keys.append(f"cache:user_email:{email}")
+    if keys:
+        await redis_client.delete(*keys)
+
+
+async def revoke_token(token_digest: str, ttl: Optional[int]):
+    """
+    Add a token digest to the revocation list, until the token expires.
+    """
+    await redis_client.set(f"auth:revoked:{token_digest}", "1", ex=ttl)
+
+
+async def is_token_revoked(token_digest: str) -> bool:
+    """
+    Check whether a token digest is on the revocation list.
+    """
+    return bool(await redis_client.exists(f"auth:revoked:{token_digest}"))
+
+
+async def fetch_meme_templates_cache(key: str) -> Optional[str]:
+    """
+    Fetch the serialized meme template catalog shared by all workers.
+    """
+    return await redis_client.get(key)
+
+
+async def store_meme_templates_cache(key: str, payload: str, ttl: int):
+    """
+    Store the serialized meme template catalog for all workers.
+    """
+    await redis_client.set(key, payload, ex=ttl)
+
+
+async def acquire_lock(key: str, ttl: int) -> Optional[str]:
+    """
+    Try to take a short-lived cross-worker lock.
+    Returns the owner token needed to release it, or None if another worker holds it.
+    """
+    token = uuid.uuid4().hex
+    if await redis_client.set(key, token, nx=True, ex=ttl):
+        return token
+    return None
+
+
+async def release_lock(key: str, token: str) -> bool:
+    """
+    Release a lock taken with `acquire_lock`, if it is still ours.
+    Returns False if it expired and another worker took it meanwhile.
+    """
+    return bool(await _release_lock(keys=[key], args=[token]))
+
+
+def history_pointer_key(thread_id: str) -> str:
+    return f"history:{thread_id}:checkpoint"
+
+
+def history_turn_key(thread_id: str) -> str:
+    return f"history:{thread_id}:turn"
+
+
+async def fetch_history_pointer(thread_id: str) -> Optional[str]:
+    """
+    Fetch the id of the latest checkpoint whose history was written through.
+    """
+    return await redis_client.get(history_pointer_key(thread_id))
+
+
+async def advance_history_pointer(thread_id: str, checkpoint_id: str, ttl: int, turn: Optional[int] = None) -> bool:
+    """
+    Point the thread at a newer checkpoint, on behalf of `turn` as returned by `start_history_turn`.
+    Returns False if it already points at one as new, or a newer turn has started.
+    """
+    keys = [history_pointer_key(thread_id), history_turn_key(thread_id)]
+    return bool(await _advance_history_pointer(keys=keys, args=[checkpoint_id, ttl, "" if turn is None else turn]))
+
+
+async def start_history_turn(thread_id: str, ttl: int) -> int:
+    """
+    Forget the latest checkpoint of a thread while a turn writes new ones. Returns the turn's number.
+    """
+    keys = [history_pointer_key(thread_id), history_turn_key(thread_id)]
+    return int(await _start_history_turn(keys=keys, args=[ttl]))
+
+
+async def fetch_history_page(page_key: str) -> Optional[str]:
+    """
+    Fetch a rendered history page and mark it as recently used.
+    """
+    async with redis_client.pipeline(transaction=False) as pipe:
+        pipe.hget(HISTORY_PAGES_KEY, page_key)
+        pipe.zadd(HISTORY_PAGES_LRU_KEY, {page_key: time.time()}, xx=True)
+        payload, _ = await pipe.execute()
+    return payload
+
+
+async def store_history_page(page_key: str, payload: str, max_bytes: int) -> int:
+    """
+    Store a rendered history page within a total size budget. Returns the number of pages evicted.
+    """
+    return await _store_history_page(
+        keys=[HISTORY_PAGES_KEY, HISTORY_PAGES_LRU_KEY, HISTORY_PAGES_BYTES_KEY],
+        args=[page_key, payload, time.time(), max_bytes],
+    )
+
+
+async def history_pages_size() -> Tuple[int, int]:
+    """
+    Number of cached history pages and their total size in bytes.
+    """
+    async with redis_client.pipeline(transaction=False) as pipe:
+        pipe.hlen(HISTORY_PAGES_KEY)
+        pipe.get(HISTORY_PAGES_BYTES_KEY)
+        pages, size = await pipe.execute()
+    return pages, int(size or 0)
+
+
+def memory_version_key(thread_id: str) -> str:
+    return f"memories:{thread_id}:version"
+
+
+async def fetch_memory_version(thread_id: str) -> str:
+    """
+    Fetch the version stamp of a conversation's memories; "" if none was ever stamped.
+    """
+    return await redis_client.get(memory_version_key(thread_id)) or ""
+
+
+async def stamp_memory_version(thread_id: str, ttl: int) -> Tuple[str, str]:
+    """
+    Give a conversation's memories a new version stamp after they changed.
+    Returns the previous stamp ("" if none) and the new one.
+    """
+    version = uuid.uuid4().hex
+    previous = await redis_client.set(memory_version_key(thread_id), version, ex=ttl, get=True)
+    return previous or "", version
@@ -0,0 +1,502 @@
+import os
+import time
+import asyncio
+import threading
+import itertools
+import multiprocessing
+from collections import deque
+from contextlib import asynccontextmanager
+from concurrent.futures import ThreadPoolExecutor
+
+# typing_extensions
+from typing_extensions import Awaitable, Callable, Deque, Dict, List, Optional, Set, Tuple
+
+
+# voice input; when off no worker is started and voice turns are declined
+STT_ENABLED = os.environ.get("STT_ENABLED", "1") not in ("0", "false", "False", "")
+STT_WORKERS = int(os.environ.get("STT_WORKERS", 2))
+STT_MODEL = os.environ.get("STT_MODEL", "tiny")
+STT_REALTIME_MODEL = os.environ.get("STT_REALTIME_MODEL", "tiny")
+STT_LANGUAGE = os.environ.get("STT_LANGUAGE", "")
+# sample rate of the 16-bit mono PCM frames clients send, unless they say otherwise
+STT_DEFAULT_SAMPLE_RATE = int(os.environ.get("STT_DEFAULT_SAMPLE_RATE", 16000))
+# loading the models can take a while on a cold machine
+STT_WORKER_START_TIMEOUT = float(os.environ.get("STT_WORKER_START_TIMEOUT", 120))
+STT_TRANSCRIBE_TIMEOUT = float(os.environ.get("STT_TRANSCRIBE_TIMEOUT", 60))
+# longest utterance a client can hold a worker for
+STT_MAX_UTTERANCE_SECONDS = float(os.environ.get("STT_MAX_UTTERANCE_SECONDS", 120))
+# voice turns allowed to wait for a busy pool, and for how long
+STT_MAX_WAITING = int(os.environ.get("STT_MAX_WAITING", 16))
+STT_QUEUE_TIMEOUT = float(os.environ.get("STT_QUEUE_TIMEOUT", 30))
+# idle workers are pinged this often and recycled when they do not answer in time
+STT_HEALTH_INTERVAL = float(os.environ.get("STT_HEALTH_INTERVAL", 30))
+STT_PING_TIMEOUT = float(os.environ.get("STT_PING_TIMEOUT", 5))
+
+
+class TranscriptionError(Exception):
+    """Raised when a worker fails or times out on a transcription."""
+
+
+class SpeechPoolBusy(TranscriptionError):
+    """Raised when the wait queue is full, or a turn waited too long for a worker."""
+
+
+# worker process side
+
+def _worker_main(conn, recorder_kwargs: dict):
+    """
+    Serve transcription sessions over `conn` with one recorder, loaded once.
+
+    Commands are (name, session_id, payload) tuples; replies are (kind, session_id, payload).
+    """
+    from RealtimeSTT import AudioToTextRecorder
+
+    send_lock = threading.Lock()
+    session = {"id": None, "sample_rate": STT_DEFAULT_SAMPLE_RATE}
+
+    def send(kind: str, session_id, payload=None):
+        # partial transcripts are sent from the recorder's own thread
+        with send_lock:
+            conn.send((kind, session_id, payload))
+
+    def on_partial(text: str):
+        if session["id"] is not None and text:
+            send("partial", session["id"], text)
+
+    recorder = AudioToTextRecorder(
+        use_microphone=False,
+        spinner=False,
+        enable_realtime_transcription=True,
+        on_realtime_transcription_update=on_partial,
+        **recorder_kwargs,
+    )
+    send("ready", None)
+
+    while True:
+        try:
+            command, session_id, payload = conn.recv()
+        except EOFError:
+            break  # the app process is gone
+        if command == "start":
+            recorder.clear_audio_queue()
+            session.update(id=session_id, sample_rate=payload or STT_DEFAULT_SAMPLE_RATE)
+            recorder.start()
+        elif command == "audio" and session_id == session["id"]:
+            recorder.feed_audio(payload, original_sample_rate=session["sample_rate"])
+        elif command in ("stop", "cancel") and session_id == session["id"]:
+            # let the recorder take in the audio fed so far before it stops
+            while command == "stop" and not recorder.audio_queue.empty():
+                time.sleep(0.01)
+            recorder.stop()
+            try:
+                # without any recorded frames text() would wait for someone to start talking
+                text = recorder.text() if command == "stop" and recorder.frames else ""
+            except Exception as e:
+                send("error", session_id, str(e))
+            else:
+                if command == "stop":
+                    send("final", session_id, text)
+            session["id"] = None
+        elif command == "ping":
+            send("pong", None)
+        elif command == "shutdown":
+            break
+    recorder.shutdown()
+
+
+# app process side
+
+class SpeechWorker:
+    """
+    One transcription process with its models loaded, serving one session at a time.
+
+    Replies are read on the event loop as soon as the pipe is readable; commands
+    go through a single sender thread, so a worker that is slow to drain its
+    pipe never blocks the loop and audio stays in order.
+    """
+
+    def __init__(self, name: str, recorder_kwargs: dict):
+        self.name = name
+        self.recorder_kwargs = recorder_kwargs
+        self.process: Optional[multiprocessing.Process] = None
+        self._conn = None
+        self._sender: Optional[ThreadPoolExecutor] = None
+        self._ready: Optional[asyncio.Future] = None
+        self._pong: Optional[asyncio.Future] = None
+        self._sessions: Dict[int, "TranscriptionSession"] = {}
+
+    async def start(self, timeout: float = STT_WORKER_START_TIMEOUT):
+        loop = asyncio.get_running_loop()
+        # spawn, not fork: the app process holds event loops, sockets and pools
+        context = multiprocessing.get_context("spawn")
+        self._conn, child_conn = context.Pipe()
+        self.process = context.Process(
+            target=_worker_main, args=(child_conn, self.recorder_kwargs), name=self.name, daemon=True
+        )
+        self.process.start()
+        child_conn.close()
+        self._sender = ThreadPoolExecutor(max_workers=1, thread_name_prefix=self.name)
+        self._ready = loop.create_future()
+        loop.add_reader(self._conn.fileno(), self._on_readable)
+        try:
+            await asyncio.wait_for(asyncio.shield(self._ready), timeout)
+        except Exception:
+            await self.close()
+            raise
+
+    @property
+    def alive(self) -> bool:
+        return self.process is not None and self.process.is_alive()
+
+    def _on_readable(self):
+        try:
+            kind, session_id, payload = self._conn.recv()
+        except (EOFError, OSError):
+            self._on_exit()
+            return
+        if kind == "ready":
+            if not self._ready.done():
+                self._ready.set_result(None)
+            return
+        if kind == "pong":
+            if self._pong is not None and not self._pong.done():
+                self._pong.set_result(None)
+            return
+        session = self._sessions.get(session_id)
+        if session is not None:
+            session._on_reply(kind, payload)
+
+    def _on_exit(self):
+        asyncio.get_running_loop().remove_reader(self._conn.fileno())
+        if self._ready is not None and not self._ready.done():
+            self._ready.set_exception(TranscriptionError(f"{self.name} exited while loading"))
+        for session in list(self._sessions.values()):
+            session._on_reply("error", f"{self.name} exited")
+
+    async def send(self, command: str, session_id: Optional[int], payload=None):
+        if not self.alive:
+            raise TranscriptionError(f"{self.name} is not running")
+        loop = asyncio.get_running_loop()
+        try:
+            await loop.run_in_executor(self._sender, self._conn.send, (command, session_id, payload))
+        except (BrokenPipeError, OSError) as e:
+            raise TranscriptionError(f"{self.name} is not reachable: {e}") from e
+
+    async def ping(self, timeout: float = STT_PING_TIMEOUT) -> bool:
+        """Whether the worker answers between sessions; a worker stuck in a transcription does not."""
+        if not self.alive:
+            return False
+        self._pong = asyncio.get_running_loop().create_future()
+        try:
+            await self.send("ping", None)
+            await asyncio.wait_for(self._pong, timeout)
+            return True
+        except (TranscriptionError, asyncio.TimeoutError):
+            return False
+
+    async def close(self):
+        if self._conn is not None:
+            try:
+                asyncio.get_running_loop().remove_reader(self._conn.fileno())
+            except (ValueError, OSError):
+                pass
+            if self.alive:
+                try:
+                    await self.send("shutdown", None)
+                except TranscriptionError:
+                    pass
+        if self.process is not None:
+            await asyncio.to_thread(self.process.join, 10)
+            if self.process.is_alive():
+                self.process.kill()
+        if self._sender is not None:
+            self._sender.shutdown(wait=False)
+        if self._conn is not None:
+            self._conn.close()
+        self.process, self._conn, self._sender = None, None, None
+
+
+class TranscriptionSession:
+    """
+    One utterance on a checked-out worker.
+
+    `feed` forwards PCM frames as they arrive, partial transcripts are handed
+    to `on_partial` in order, and `finish` returns the final transcript.
+    """
+
+    _ids = itertools.count(1)
+
+    def __init__(self, worker: SpeechWorker, sample_rate: int, on_partial: Callable[[str], Awaitable]):
+        self.worker = worker
+        self.sample_rate = sample_rate
+        self.id = next(self._ids)
+        self._on_partial = on_partial
+        self._partials: asyncio.Queue = asyncio.Queue()
+        self._final: asyncio.Future = asyncio.get_running_loop().create_future()
+        self._forwarder: Optional[asyncio.Task] = None
+        self.finished = False
+
+    async def open(self):
+        self.worker._sessions[self.id] = self
+        self._forwarder = asyncio.create_task(self._forward_partials())
+        await self.worker.send("start", self.id, self.sample_rate)
+
+    def _on_reply(self, kind: str, payload):
+        if kind == "partial":
+            self._partials.put_nowait(payload)
+        elif kind == "final" and not self._final.done():
+            self._final.set_result(payload)
+        elif kind == "error" and not self._final.done():
+            self._final.set_exception(TranscriptionError(payload))
+
+    async def _forward_partials(self):
+        while True:
+            text = await self._partials.get()
+            try:
+                await self._on_partial(text)
+            except Exception as e:
+                print(f"Error forwarding partial transcript: {str(e)}")
+
+    async def feed(self, chunk: bytes):
+        await self.worker.send("audio", self.id, chunk)
+
+    async def finish(self, timeout: float = STT_TRANSCRIBE_TIMEOUT) -> str:
+        await self.worker.send("stop", self.id)
+        try:
+            return await asyncio.wait_for(self._final, timeout)
+        except asyncio.TimeoutError as e:
+            raise TranscriptionError(f"{self.worker.name} did not finish in {timeout}s") from e
+        finally:
+            self.finished = True
+
+    async def close(self):
+        if not self.finished and self.worker.alive:
+            try:
+                await self.worker.send("cancel", self.id)
+            except TranscriptionError:
+                pass
+        self.worker._sessions.pop(self.id, None)
+        if self._forwarder is not None:
+            self._forwarder.cancel()
+
+
+class SpeechPool:
+    """
+    A fixed set of transcription worker processes, started in `lifespan` with their models loaded.
+
+    Each voice turn checks out one worker for the length of the utterance and
+    checks it back in afterwards, so memory is capped by the pool size however
+    many users talk at once. When every worker is busy, turns wait in a FIFO
+    queue of at most `max_waiting`, and are told their position as it changes.
+
+    Workers that die, time out on a transcription or stop answering health
+    pings are recycled: killed and replaced by a fresh one.
+    """
+
+    def __init__(
+        self,
+        size: int = STT_WORKERS,
+        max_waiting: int = STT_MAX_WAITING,
+        queue_timeout: float = STT_QUEUE_TIMEOUT,
+        health_interval: float = STT_HEALTH_INTERVAL,
+    ):
+        self.size = size
+        self.max_waiting = max_waiting
+        self.queue_timeout = queue_timeout
+        self.health_interval = health_interval
+        self.recorder_kwargs = {"model": STT_MODEL, "realtime_model_type": STT_REALTIME_MODEL, "language": STT_LANGUAGE}
+        self._names = itertools.count()
+        self._started = False
+        # every worker of the pool, including ones still loading
+        self._workers: List[SpeechWorker] = []
+        self._idle: Deque[SpeechWorker] = deque()
+        self._waiters: Deque[Tuple[asyncio.Future, Optional[Callable[[int], Awaitable]]]] = deque()
+        self._tasks: Set[asyncio.Task] = set()
+        self._health_task: Optional[asyncio.Task] = None
+        self.busy = 0
+        self.sessions = 0
+        self.failures = 0
+        self.rejected = 0
+        self.recycled = 0
+
+    async def start(self, wait: bool = True):
+        """
+        Start the workers. With `wait=False` they load their models in the
+        background, and voice turns arriving meanwhile queue for the first one.
+        """
+        if self._started:
+            return
+        self._started = True
+        warm_up = self._warm_up()
+        if wait:
+            await warm_up
+        else:
+            self._spawn(warm_up)
+        if self.health_interval:
+            self._health_task = asyncio.create_task(self._run_health_checks())
+
+    async def close(self):
+        self._started = False
+        tasks = [task for task in (self._health_task, *self._tasks) if task is not None]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        while self._waiters:
+            future, _ = self._waiters.popleft()
+            if not future.done():
+                future.set_exception(TranscriptionError("Speech pool is shutting down"))
+        await asyncio.gather(*(worker.close() for worker in self._workers))
+        self._workers, self._idle, self._tasks, self._health_task = [], deque(), set(), None
+
+    async def _warm_up(self):
+        await asyncio.gather(*(self._add_worker() for _ in range(self.size)))
+
+    def _spawn(self, coro):
+        task = asyncio.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _add_worker(self):
+        worker = SpeechWorker(f"stt-worker-{next(self._names)}", self.recorder_kwargs)
+        self._workers.append(worker)
+        try:
+            await worker.start()
+        except Exception as e:
+            # the health check starts another one on its next pass
+            print(f"Error starting {worker.name}: {str(e)}")
+            self._workers.remove(worker)
+            return
+        self.busy += 1
+        self._release(worker)
+
+    async def _replace(self, worker: SpeechWorker):
+        self.recycled += 1
+        print(f"Recycling {worker.name}")
+        await worker.close()
+        if worker in self._workers:
+            self._workers.remove(worker)
+        if self._started:
+            await self._add_worker()
+
+    def _release(self, worker: SpeechWorker):
+        # hand a checked-out worker straight to the longest waiting turn, or back to the idle set
+        while self._waiters:
+            future, _ = self._waiters.popleft()
+            if not future.done():
+                future.set_result(worker)
+                self._notify_positions()
+                return
+        self.busy -= 1
+        self._idle.append(worker)
+
+    def _notify_positions(self):
+        for position, (future, on_queued) in enumerate(self._waiters, start=1):
+            if on_queued is not None and not future.done():
+                self._spawn(self._notify(on_queued, position))
+
+    async def _notify(self, on_queued: Callable[[int], Awaitable], position: int):
+        try:
+            await on_queued(position)
+        except Exception as e:
+            print(f"Error reporting speech queue position: {str(e)}")
+
+    async def checkout(self, on_queued: Optional[Callable[[int], Awaitable]] = None) -> SpeechWorker:
+        """
+        Take a worker, waiting in line if all are busy; `on_queued` is awaited
+        with the 1-based queue position whenever it changes.
+        """
+        if not self._started or not self._workers:
+            raise TranscriptionError("No transcription workers are running")
+        if self._idle and not self._waiters:
+            self.busy += 1
+            return self._idle.popleft()
+        if len(self._waiters) >= self.max_waiting:
+            self.rejected += 1
+            raise SpeechPoolBusy(f"{len(self._waiters)} voice turns are already waiting")
+
+        future = asyncio.get_running_loop().create_future()
+        waiter = (future, on_queued)
+        self._waiters.append(waiter)
+        if on_queued is not None:
+            self._spawn(self._notify(on_queued, len(self._waiters)))
+        try:
+            return await asyncio.wait_for(future, self.queue_timeout)
+        except BaseException as e:
+            if future.done() and not future.cancelled() and future.exception() is None:
+                self._release(future.result())  # handed over just as the turn gave up
+            elif waiter in self._waiters:
+                self._waiters.remove(waiter)
+                self._notify_positions()
+            if isinstance(e, asyncio.TimeoutError):
+                self.rejected += 1
+                raise SpeechPoolBusy(f"No transcription worker freed up in {self.queue_timeout}s") from e
+            raise
+
+    def checkin(self, worker: SpeechWorker, healthy: bool = True):
+        """Return a checked-out worker; an unhealthy or dead one is replaced instead."""
+        if healthy and worker.alive and self._started:
+            self._release(worker)
+            return
+        self.busy -= 1
+        self._spawn(self._replace(worker))
+
+    async def _run_health_checks(self):
+        while True:
+            await asyncio.sleep(self.health_interval)
+            try:
+                await self.check_health()
+            except Exception as e:
+                print(f"Error checking speech workers: {str(e)}")
+
+    async def check_health(self):
+        """Ping every idle worker, recycle the ones that do not answer, and top the pool back up."""
+        for worker in list(self._idle):
+            if worker not in self._idle:
+                continue  # checked out meanwhile
+            # take it out while pinging so no turn gets a worker under test
+            self._idle.remove(worker)
+            self.busy += 1
+            self.checkin(worker, healthy=await worker.ping())
+        for _ in range(self.size - len(self._workers)):
+            self._spawn(self._add_worker())
+
+    @asynccontextmanager
+    async def session(
+        self,
+        on_partial: Callable[[str], Awaitable],
+        sample_rate: int = STT_DEFAULT_SAMPLE_RATE,
+        on_queued: Optional[Callable[[int], Awaitable]] = None,
+    ):
+        """Check out a worker for one utterance and check it back in afterwards."""
+        worker = await self.checkout(on_queued)
+        session = TranscriptionSession(worker, sample_rate, on_partial)
+        self.sessions += 1
+        healthy = True
+        try:
+            await session.open()
+            yield session
+        except TranscriptionError:
+            # a worker that failed or timed out may be wedged mid-transcription
+            self.failures += 1
+            healthy = False
+            raise
+        finally:
+            await session.close()
+            self.checkin(worker, healthy)
+
+    def metrics(self) -> dict:
+        return {
+            "workers": self.size,
+            "alive": sum(worker.alive for worker in self._workers),
+            "idle": len(self._idle),
+            "busy": self.busy,
+            "waiting": len(self._waiters),
+            "max_waiting": self.max_waiting,
+            "sessions": self.sessions,
+            "failures": self.failures,
+            "rejected": self.rejected,
+            "recycled": self.recycled,
+        }
+
+
+speech_pool = SpeechPool()
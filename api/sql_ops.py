@@ -1,23 +1,24 @@
-from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy import Column, String, Integer
 from sqlalchemy.orm import sessionmaker
-from passlib.context import CryptContext
 import os
 import uuid
+from typing import Optional
 from datetime import datetime, timedelta, date
 from sqlalchemy.future import select
+from sqlalchemy import update
 import re
 import jwt
 from dotenv import load_dotenv
 from api.pydm import *
+from api.password_hasher import password_hasher
+from api.user_cache import user_cache, MISS
 
 load_dotenv()
 
 Base = declarative_base()
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
-
 JWT_SECRET_KEY = os.environ.get('JWT_SECRET_KEY')
 ALGORITHM = os.environ.get('ALGORITHM')
 
@@ -33,16 +34,33 @@ class User(Base):
     password = Column(String, nullable=False)
 
 DATABASE_URL = os.environ.get('SQL_DB_URL')
-engine = create_async_engine(DATABASE_URL, echo=False)
-async_session = sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+
+# created by the app lifespan (see api/db_pools.py) and handed over with configure_engine
+engine = None
+async_session = None
+
+def configure_engine(new_engine):
+    global engine, async_session
+    engine = new_engine
+    async_session = sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
 
 async def init_db():
     async with engine.begin() as conn:
         await conn.run_sync(Base.metadata.create_all)
 
+def user_to_dict(user: User) -> dict:
+    # profile fields only: the password hash stays in Postgres
+    return {
+        "user_id": user.user_id,
+        "firstName": user.firstName,
+        "lastName": user.lastName,
+        "age": user.age,
+        "email": user.email,
+    }
+
 async def create_user(firstName: str, lastName: str, age: int, email: str, raw_password: str):
+    hashed_password = await password_hasher.hash(raw_password)
     async with async_session() as session:
-        hashed_password = pwd_context.hash(raw_password)
         new_user = User(
             firstName=firstName,
             lastName=lastName,
@@ -52,22 +70,72 @@ async def create_user(firstName: str, lastName: str, age: int, email: str, raw_p
         )
         session.add(new_user)
         await session.commit()
-        return new_user
+
+    # drop the negative entry left by the signup duplicate check
+    await user_cache.invalidate(email=email)
+    await user_cache.put(user_to_dict(new_user))
+    return new_user
 
 async def get_user_by_email(email: str):
+    """The user's profile fields, from the cache when possible; `password` is not loaded."""
+    cached = await user_cache.get_by_email(email)
+    if cached is not MISS:
+        return User(**cached) if cached else None
+
     async with async_session() as session:
         stmt = select(User).where(User.email == email)
         result = await session.execute(stmt)
-        return result.scalar_one_or_none()
+        user = result.scalar_one_or_none()
+
+    if user is None:
+        await user_cache.put_unknown_email(email)
+    else:
+        await user_cache.put(user_to_dict(user))
+    return user
+
+async def get_user_credentials(email: str):
+    """
+    The user row with its password hash, used by login only. The hash is always
+    read from Postgres; an email cached as unregistered skips the query.
+    """
+    if await user_cache.get_by_email(email) is None:
+        return None
+
+    async with async_session() as session:
+        result = await session.execute(select(User).where(User.email == email))
+        user = result.scalar_one_or_none()
+
+    if user is None:
+        await user_cache.put_unknown_email(email)
+    else:
+        await user_cache.put(user_to_dict(user))
+    return user
 
 async def get_user_by_id(user_id):
+    cached = await user_cache.get_by_id(user_id)
+    if cached is not MISS:
+        return User(**cached)
+
     async with async_session() as session:
         result = await session.execute(select(User).where(User.user_id == user_id))
         user = result.scalar_one_or_none()
-        return user
 
-def verify_password(plain_password: str, hashed_password: str) -> bool:
-    return pwd_context.verify(plain_password, hashed_password)
+    if user is not None:
+        await user_cache.put(user_to_dict(user))
+    return user
+
+async def update_password_hash(user_id: str, hashed_password: str):
+    async with async_session() as session:
+        await session.execute(update(User).where(User.user_id == user_id).values(password=hashed_password))
+        await session.commit()
+    await user_cache.invalidate(user_id=user_id)
+
+async def verify_password(plain_password: str, hashed_password: str, user_id: Optional[str] = None) -> bool:
+    valid, new_hash = await password_hasher.verify_and_update(plain_password, hashed_password)
+    if valid and new_hash and user_id:
+        # the stored hash uses a different bcrypt cost than configured; upgrade it
+        await update_password_hash(user_id, new_hash)
+    return valid
 
 def validate_password_strength(password: str) -> bool:
     pattern = r"^(?=.*[A-Z])(?=.*\d)(?=.*[!@#$%^&*])[A-Za-z\d!@#$%^&*]{8,}$"
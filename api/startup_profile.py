@@ -0,0 +1,188 @@
+"""
+Startup profile of the API process, and a cold-start benchmark.
+
+    python -m api.startup_profile                      # 5 cold imports of api.index
+    python -m api.startup_profile --runs 10 --top 25
+    python -m api.startup_profile --lifespan           # also run lifespan (needs Postgres and Redis)
+    python -m api.startup_profile --output startup.jsonl
+
+Each run is a fresh interpreter started with `-X importtime`, so the report
+shows the wall time to import the app, the import time of every module and
+top-level package, and with --lifespan the time of each lifespan phase. With
+--output one JSON line per benchmark is appended, to track cold starts over time.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import statistics
+import subprocess
+from datetime import datetime, timezone
+
+# typing_extensions
+from typing_extensions import Dict, List, Optional
+
+
+class StartupProfiler:
+    """
+    Wall-clock time of each startup phase of this process.
+
+    `mark(phase)` records the time since the previous mark, so phases are
+    marked as they finish and sum up to the whole startup.
+    """
+
+    def __init__(self):
+        self._last = time.perf_counter()
+        self.phases: Dict[str, float] = {}
+
+    def mark(self, phase: str):
+        now = time.perf_counter()
+        self.phases[phase] = round(now - self._last, 4)
+        self._last = now
+
+    def skip(self):
+        # time spent outside startup, e.g. between import and lifespan, is not attributed to a phase
+        self._last = time.perf_counter()
+
+    def report(self) -> dict:
+        return {"phases": dict(self.phases), "total_seconds": round(sum(self.phases.values()), 4)}
+
+
+startup_profiler = StartupProfiler()
+
+
+# benchmark
+
+IMPORT_ONLY = "import api.index"
+
+WITH_LIFESPAN = """
+import json, asyncio
+import api.index
+from api.startup_profile import startup_profiler
+
+async def main():
+    async with api.index.lifespan(api.index.app):
+        print(json.dumps(startup_profiler.report()))
+
+asyncio.run(main())
+"""
+
+
+def parse_importtime(stderr: str) -> List[dict]:
+    """Rows of `-X importtime` output: self and cumulative microseconds per module."""
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        fields = line[len("import time:"):].split("|")
+        if len(fields) != 3:
+            continue
+        rows.append({
+            "module": fields[2].strip(),
+            "self_us": int(fields[0]),
+            "cumulative_us": int(fields[1]),
+        })
+    return rows
+
+
+def cold_start(lifespan: bool) -> dict:
+    started = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", WITH_LIFESPAN if lifespan else IMPORT_ONLY],
+        capture_output=True,
+        text=True,
+        # speech workers are processes of their own and would add their imports to the report
+        env={**os.environ, "STT_ENABLED": "0"},
+    )
+    seconds = time.perf_counter() - started
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1] if result.stderr.strip() else "startup failed")
+
+    modules = parse_importtime(result.stderr)
+    app = next((row for row in modules if row["module"] == "api.index"), None)
+    run = {
+        "wall_seconds": seconds,
+        "app_import_seconds": app["cumulative_us"] / 1e6 if app else None,
+        "modules": modules,
+    }
+    if lifespan:
+        report = next((line for line in reversed(result.stdout.splitlines()) if line.startswith("{")), None)
+        run["lifespan"] = json.loads(report) if report else None
+    return run
+
+
+def package_times(modules: List[dict]) -> Dict[str, float]:
+    # self times add up without double counting, unlike cumulative ones
+    packages: Dict[str, float] = {}
+    for row in modules:
+        package = row["module"].split(".")[0]
+        packages[package] = packages.get(package, 0) + row["self_us"] / 1e6
+    return packages
+
+
+def median_by_key(dicts: List[Dict[str, float]]) -> Dict[str, float]:
+    keys = dict.fromkeys(key for d in dicts for key in d)  # keeps the phase order
+    return {key: statistics.median(d.get(key, 0.0) for d in dicts) for key in keys}
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def summarize(runs: List[dict], top: int) -> dict:
+    modules = median_by_key([{row["module"]: row["cumulative_us"] / 1e6 for row in run["modules"]} for run in runs])
+    packages = median_by_key([package_times(run["modules"]) for run in runs])
+    summary = {
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "commit": git_commit(),
+        "python": sys.version.split()[0],
+        "runs": len(runs),
+        "wall_seconds": round(statistics.median(run["wall_seconds"] for run in runs), 4),
+        "app_import_seconds": round(statistics.median(run["app_import_seconds"] or 0 for run in runs), 4),
+        "top_packages": {name: round(seconds, 4) for name, seconds in sorted(packages.items(), key=lambda item: -item[1])[:top]},
+        "top_modules": {name: round(seconds, 4) for name, seconds in sorted(modules.items(), key=lambda item: -item[1])[:top]},
+    }
+    lifespans = [run["lifespan"]["phases"] for run in runs if run.get("lifespan")]
+    if lifespans:
+        summary["lifespan_phases"] = {name: round(seconds, 4) for name, seconds in median_by_key(lifespans).items()}
+    return summary
+
+
+def print_summary(summary: dict):
+    print(f"cold start, median of {summary['runs']} runs (commit {summary['commit'] or 'unknown'})")
+    print(f"  interpreter + imports   {summary['wall_seconds']:.3f}s")
+    print(f"  import api.index        {summary['app_import_seconds']:.3f}s")
+    print("  self import time by package")
+    for name, seconds in summary["top_packages"].items():
+        print(f"    {name:<40} {seconds:.3f}s")
+    print("  cumulative import time by module")
+    for name, seconds in summary["top_modules"].items():
+        print(f"    {name:<40} {seconds:.3f}s")
+    if "lifespan_phases" in summary:
+        print("  lifespan phases")
+        for name, seconds in summary["lifespan_phases"].items():
+            print(f"    {name:<40} {seconds:.3f}s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=15)
+    parser.add_argument("--lifespan", action="store_true", help="also run the app lifespan in each process")
+    parser.add_argument("--output", help="append the summary as one JSON line to this file")
+    args = parser.parse_args()
+
+    runs = [cold_start(args.lifespan) for _ in range(args.runs)]
+    summary = summarize(runs, args.top)
+    print_summary(summary)
+    if args.output:
+        with open(args.output, "a") as f:
+            f.write(json.dumps(summary) + "\n")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,202 @@
+import os
+import re
+import asyncio
+
+# typing_extensions
+from typing_extensions import Awaitable, Callable, Optional
+
+# langchain
+from langchain_core.messages import BaseMessage, AIMessage, AIMessageChunk, ToolMessage
+
+
+STREAM_FLUSH_CHARS = int(os.getenv("STREAM_FLUSH_CHARS", 48))
+STREAM_FLUSH_INTERVAL_MS = int(os.getenv("STREAM_FLUSH_INTERVAL_MS", 40))
+
+
+class DeltaCoalescer:
+    """
+    Server-side buffer for LLM token deltas.
+
+    Tokens are appended as they arrive and sent as one `ai_delta` frame once
+    the buffer holds `max_chars` characters or the oldest buffered token is
+    `max_delay` seconds old, whichever comes first. Frames carry a sequence
+    number that increases by one per frame within a turn.
+    """
+
+    def __init__(
+        self,
+        send: Callable[[dict], Awaitable[None]],
+        max_chars: int = STREAM_FLUSH_CHARS,
+        max_delay: float = STREAM_FLUSH_INTERVAL_MS / 1000,
+    ):
+        self.send = send
+        self.max_chars = max_chars
+        self.max_delay = max_delay
+        self.seq = 0
+        self._buffer = []
+        self._buffered_chars = 0
+        self._message_id: Optional[str] = None
+        self._timer: Optional[asyncio.Task] = None
+        self._lock = asyncio.Lock()
+
+    async def push(self, message_id: Optional[str], text: str):
+        if not text:
+            return
+        if self._message_id is not None and message_id != self._message_id:
+            # never mix tokens of two messages in one frame
+            await self.flush()
+
+        self._message_id = message_id
+        self._buffer.append(text)
+        self._buffered_chars += len(text)
+
+        if self._buffered_chars >= self.max_chars:
+            await self.flush()
+        elif self._timer is None:
+            self._timer = asyncio.create_task(self._flush_later())
+
+    async def _flush_later(self):
+        await asyncio.sleep(self.max_delay)
+        self._timer = None
+        await self.flush()
+
+    async def flush(self):
+        """Send whatever is buffered as a single frame."""
+        timer, self._timer = self._timer, None
+        if timer is not None and timer is not asyncio.current_task():
+            timer.cancel()
+
+        async with self._lock:
+            if not self._buffer:
+                return
+            frame = {
+                "type": "ai_delta",
+                "seq": self.seq,
+                "message_id": self._message_id,
+                "content": "".join(self._buffer),
+            }
+            self.seq += 1
+            self._buffer = []
+            self._buffered_chars = 0
+            await self.send(frame)
+
+    async def close(self):
+        await self.flush()
+        self._message_id = None
+
+
+MEME_TOOL_NAME = "generate_contextual_meme"
+AGENT_NODE = "agent"
+
+# the meme tool output is serialized either as JSON or as a repr; stop URLs at quotes and brackets
+MEME_URL_PATTERN = re.compile(r"https?://[^\s'\",)\]]+")
+
+
+def extract_meme_urls(content) -> list:
+    """Return the meme URLs in the content of a `generate_contextual_meme` ToolMessage."""
+    if not isinstance(content, str):
+        content = str(content)
+    return MEME_URL_PATTERN.findall(content)
+
+
+class TurnEventRouter:
+    """
+    Consumes the graph stream of one chat turn exactly once and maps its events
+    to WebSocket frames.
+
+    - "messages" events: token deltas of the agent node -> `ai_delta`
+    - "custom" events: memes pushed by the meme tool -> `tool_message`
+    - "updates" events: messages produced by a node -> `ai_message` / `tool_message`
+
+    Tools only ever run inside the graph; the router never invokes them.
+    """
+
+    def __init__(self, websocket, stream_tokens: bool = True):
+        self.websocket = websocket
+        self.stream_tokens = stream_tokens
+        self.coalescer = DeltaCoalescer(websocket.send_json)
+        self.streamed_message_ids = set()
+        self.streamed_meme_urls = set()
+        self._handlers = {
+            "messages": self.on_token,
+            "custom": self.on_custom,
+            "updates": self.on_update,
+        }
+
+    @property
+    def stream_modes(self):
+        return ["updates", "custom", "messages"] if self.stream_tokens else ["updates", "custom"]
+
+    async def run(self, graph, query: dict, config: dict):
+        try:
+            async for mode, event in graph.astream(query, stream_mode=self.stream_modes, config=config):
+                await self._handlers[mode](event)
+        finally:
+            await self.coalescer.close()
+
+    async def on_token(self, event):
+        # LLM calls made inside tools are streamed too; only the agent's reply is forwarded
+        chunk, metadata = event
+        if metadata.get("langgraph_node") != AGENT_NODE:
+            return
+        if isinstance(chunk, AIMessageChunk) and isinstance(chunk.content, str) and chunk.content:
+            self.streamed_message_ids.add(chunk.id)
+            await self.coalescer.push(chunk.id, chunk.content)
+
+    async def on_custom(self, event):
+        # memes are pushed one by one while generate_contextual_meme is still running
+        if isinstance(event, dict) and event.get("type") == "meme":
+            self.streamed_meme_urls.add(event["url"])
+            await self.websocket.send_json({
+                "type": "tool_message",
+                "content": event["url"],
+                "urls": [event["url"]]
+            })
+
+    async def on_update(self, event):
+        for node, output in event.items():
+            if not isinstance(output, dict):
+                continue
+            for message in output.get("messages", []):
+                await self.on_message(node, message)
+
+    async def on_message(self, node: str, message: BaseMessage):
+        if isinstance(message, AIMessage):
+            await self.on_ai_message(message)
+        elif isinstance(message, ToolMessage):
+            await self.on_tool_message(message)
+
+    async def on_ai_message(self, message: AIMessage):
+        await self.coalescer.flush()
+        if message.tool_calls:
+            if message.id in self.streamed_message_ids:
+                # deltas of a tool-calling message are not part of the reply
+                await self.websocket.send_json({"type": "ai_delta_discard", "message_id": message.id})
+            return
+        if not message.content:
+            return
+
+        # streaming clients replace the deltas of `message_id` with this final content
+        await self.websocket.send_json({
+            "type": "ai_message",
+            "message_id": message.id,
+            "content": message.content
+        })
+
+    async def on_tool_message(self, message: ToolMessage):
+        if message.name != MEME_TOOL_NAME:
+            return
+        try:
+            meme_urls = extract_meme_urls(message.content)
+            cleaned_meme_urls = [url for url in meme_urls if url not in self.streamed_meme_urls]
+            if not cleaned_meme_urls:
+                return
+
+            await self.websocket.send_json({
+                "type": "tool_message",
+                "content": " ".join(cleaned_meme_urls),
+                "urls": cleaned_meme_urls
+            })
+        except (ValueError, TypeError) as e:
+            print(f"Error parsing ToolMessage content: {e}")
+            await self.websocket.send_json({"type": "error", "message": "Failed to parse ToolMessage content."})
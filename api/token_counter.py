@@ -1,39 +1,163 @@
-from typing_extensions import List
+import os
+import hashlib
+from collections import OrderedDict
+
+from typing_extensions import List, Optional
 
-import tiktoken
 from langchain_core.messages import BaseMessage, ToolMessage, HumanMessage, AIMessage, SystemMessage
 
 
+ENCODING_NAME = "o200k_base"
+TOKEN_COUNT_CACHE_SIZE = int(os.environ.get("TOKEN_COUNT_CACHE_SIZE", 50_000))
+
+# key under message.response_metadata where the per-message count is persisted with the digest
+# it was computed for, so it is serialized together with the message by the checkpointer
+TOKEN_COUNT_METADATA_KEY = "token_count"
+
+TOKENS_PER_CONVERSATION = 3
+TOKENS_PER_MESSAGE = 3
+TOKENS_PER_NAME = 1
+
+_encoding = None
+
+# digest of everything a message's count depends on -> token count, least recently used first
+_message_token_cache: "OrderedDict[str, int]" = OrderedDict()
+_role_token_counts = {}
+
+
+def get_encoding():
+    """Return the process-wide tiktoken encoding, loading it on first use."""
+    global _encoding
+    if _encoding is None:
+        # imported here: tiktoken is only needed once the first prompt is counted
+        import tiktoken
+
+        _encoding = tiktoken.get_encoding(ENCODING_NAME)
+    return _encoding
+
 
 def str_token_counter(text: str) -> int:
-    enc = tiktoken.get_encoding("o200k_base")
-    return len(enc.encode(text))
+    return len(get_encoding().encode_ordinary(text))
+
+
+def _message_role(msg: BaseMessage) -> str:
+    if isinstance(msg, HumanMessage):
+        return "user"
+    elif isinstance(msg, AIMessage):
+        return "assistant"
+    elif isinstance(msg, ToolMessage):
+        return "tool"
+    elif isinstance(msg, SystemMessage):
+        return "system"
+    raise ValueError(f"Unsupported messages type {msg.__class__}")
+
+
+def _role_tokens(role: str) -> int:
+    if role not in _role_token_counts:
+        _role_token_counts[role] = str_token_counter(role)
+    return _role_token_counts[role]
+
+
+def _message_text(msg: BaseMessage) -> str:
+    """Text content of a message; non-text content blocks are ignored."""
+    content = msg.content
+    if not isinstance(content, str):
+        content = "".join(
+            block if isinstance(block, str) else block.get("text", "")
+            for block in content
+            if isinstance(block, str) or block.get("type") == "text"
+        )
+    return content
+
+
+def _cache_key(msg: BaseMessage, role: str, text: str) -> str:
+    # keyed by content rather than message id: a message edited in place under the same id is recounted
+    digest = hashlib.blake2b(digest_size=16)
+    for part in (ENCODING_NAME, role, msg.name or "", text):
+        digest.update(part.encode("utf-8", "surrogatepass"))
+        digest.update(b"\x00")
+    return digest.hexdigest()
+
+
+def _cache_get(key: str) -> Optional[int]:
+    count = _message_token_cache.get(key)
+    if count is not None:
+        _message_token_cache.move_to_end(key)
+    return count
+
+
+def _cache_put(key: str, count: int):
+    _message_token_cache[key] = count
+    _message_token_cache.move_to_end(key)
+    while len(_message_token_cache) > TOKEN_COUNT_CACHE_SIZE:
+        _message_token_cache.popitem(last=False)
+
+
+def _stored_count(msg: BaseMessage, key: str) -> Optional[int]:
+    # only trusted for the content it was computed from
+    stored = msg.response_metadata.get(TOKEN_COUNT_METADATA_KEY)
+    if isinstance(stored, dict) and stored.get("digest") == key:
+        return stored.get("tokens")
+    return None
+
+
+def _store_count(msg: BaseMessage, key: str, count: int):
+    msg.response_metadata[TOKEN_COUNT_METADATA_KEY] = {"digest": key, "tokens": count}
+
+
+def message_token_counts(messages: List[BaseMessage]) -> List[int]:
+    """
+    Token count of each message, excluding the per-conversation overhead.
+
+    Each message is identified by a digest of its content. Counts are looked
+    up in the message metadata first, where they survive checkpoint round
+    trips, then in the in-process LRU cache; only the remaining messages are
+    tokenized, in a single batch. Every count found in the cache or computed
+    is written back to the message metadata with its digest.
+    """
+    counts = [0] * len(messages)
+    misses = []
+    for i, msg in enumerate(messages):
+        role = _message_role(msg)
+        text = _message_text(msg)
+        key = _cache_key(msg, role, text)
+        count = _stored_count(msg, key)
+        if count is None:
+            count = _cache_get(key)
+            if count is None:
+                misses.append((i, key, role, text))
+                continue
+            _store_count(msg, key, count)
+        counts[i] = count
+
+    if misses:
+        texts = [text for (_, _, _, text) in misses]
+        names = [messages[i].name for (i, _, _, _) in misses]
+        enc = get_encoding()
+        if len(misses) == 1:
+            encoded = [enc.encode_ordinary(texts[0])]
+        else:
+            encoded = enc.encode_ordinary_batch(texts)
+
+        for (i, key, role, _), tokens, name in zip(misses, encoded, names):
+            count = TOKENS_PER_MESSAGE + _role_tokens(role) + len(tokens)
+            if name:
+                count += TOKENS_PER_NAME + str_token_counter(name)
+            _cache_put(key, count)
+            _store_count(messages[i], key, count)
+            counts[i] = count
+
+    return counts
+
+
+def message_token_count(msg: BaseMessage) -> int:
+    return message_token_counts([msg])[0]
 
 
 def tiktoken_counter(messages: List[BaseMessage]) -> int:
     """Approximately reproduce https://github.com/openai/openai-cookbook/blob/main/examples/How_to_count_tokens_with_tiktoken.ipynb
 
-    For simplicity only supports str Message.contents.
+    Per-message counts are cached (see `message_token_counts`), so repeated calls
+    over the same history, as `trim_messages` makes, only tokenize new messages.
     """
-    num_tokens = 3
-    tokens_per_message = 3
-    tokens_per_name = 1
-    for msg in messages:
-        if isinstance(msg, HumanMessage):
-            role = "user"
-        elif isinstance(msg, AIMessage):
-            role = "assistant"
-        elif isinstance(msg, ToolMessage):
-            role = "tool"
-        elif isinstance(msg, SystemMessage):
-            role = "system"
-        else:
-            raise ValueError(f"Unsupported messages type {msg.__class__}")
-        num_tokens += (
-            tokens_per_message
-            + str_token_counter(role)
-            + str_token_counter(msg.content)
-        )
-        if msg.name:
-            num_tokens += tokens_per_name + str_token_counter(msg.name)
-    return num_tokens
\ No newline at end of file
+    return TOKENS_PER_CONVERSATION + sum(message_token_counts(messages))
@@ -0,0 +1,148 @@
+import os
+import time
+from collections import OrderedDict
+
+# typing_extensions
+from typing_extensions import Optional, Tuple
+
+# redis ops
+from api import redis_ops
+
+
+USER_CACHE_LOCAL_SIZE = int(os.environ.get("USER_CACHE_LOCAL_SIZE", 2048))
+USER_CACHE_LOCAL_TTL = int(os.environ.get("USER_CACHE_LOCAL_TTL", 30))
+USER_CACHE_REDIS_TTL = int(os.environ.get("USER_CACHE_REDIS_TTL", 3600))
+USER_CACHE_NEGATIVE_TTL = int(os.environ.get("USER_CACHE_NEGATIVE_TTL", 10))
+
+# returned by lookups when the cache knows nothing about the key
+MISS = object()
+
+
+class UserCache:
+    """
+    Read-through cache of the profile fields of `users` rows (never the password
+    hash): a small in-process LRU in front of Redis hashes.
+
+    Lookups return the cached row as a dict, None for an email known not to be
+    registered (negative entry), or MISS when the database must be queried.
+    Negative entries live only in Redis, for `USER_CACHE_NEGATIVE_TTL` seconds,
+    so the invalidation done by `create_user` reaches every worker at once.
+    """
+
+    def __init__(self, local_size: int = USER_CACHE_LOCAL_SIZE, local_ttl: int = USER_CACHE_LOCAL_TTL):
+        self.local_size = local_size
+        self.local_ttl = local_ttl
+        self._local: "OrderedDict[str, Tuple[Optional[dict], float]]" = OrderedDict()
+        self.local_hits = 0
+        self.redis_hits = 0
+        self.negative_hits = 0
+        self.misses = 0
+
+    # in-process LRU
+    def _local_get(self, key: str):
+        entry = self._local.get(key)
+        if entry is None:
+            return MISS
+        value, expires_at = entry
+        if expires_at <= time.time():
+            del self._local[key]
+            return MISS
+        self._local.move_to_end(key)
+        return value
+
+    def _local_put(self, key: str, value: Optional[dict], ttl: int):
+        self._local[key] = (value, time.time() + min(ttl, self.local_ttl))
+        self._local.move_to_end(key)
+        while len(self._local) > self.local_size:
+            self._local.popitem(last=False)
+
+    def _count_hit(self, value, local: bool):
+        if value is None:
+            self.negative_hits += 1
+        elif local:
+            self.local_hits += 1
+        else:
+            self.redis_hits += 1
+
+    async def get_by_id(self, user_id: str):
+        key = f"id:{user_id}"
+        value = self._local_get(key)
+        if value is not MISS:
+            self._count_hit(value, local=True)
+            return value
+
+        try:
+            value = await redis_ops.fetch_cached_user(user_id)
+        except Exception as e:
+            print(f"Error reading user cache: {str(e)}")
+            value = None
+        if not value:
+            self.misses += 1
+            return MISS
+
+        self._count_hit(value, local=False)
+        self._local_put(key, value, self.local_ttl)
+        return value
+
+    async def get_by_email(self, email: str):
+        key = f"email:{email}"
+        value = self._local_get(key)
+        if value is not MISS:
+            self._count_hit(value, local=True)
+            return value
+
+        try:
+            user_id = await redis_ops.fetch_cached_user_id(email)
+        except Exception as e:
+            print(f"Error reading user cache: {str(e)}")
+            user_id = None
+        if user_id is None:
+            self.misses += 1
+            return MISS
+        if user_id == "":
+            self._count_hit(None, local=False)
+            return None
+
+        value = await self.get_by_id(user_id)
+        if value is not MISS:
+            self._local_put(key, value, self.local_ttl)
+        return value
+
+    async def put(self, user: dict):
+        self._local_put(f"id:{user['user_id']}", user, self.local_ttl)
+        self._local_put(f"email:{user['email']}", user, self.local_ttl)
+        try:
+            await redis_ops.cache_user(user, ttl=USER_CACHE_REDIS_TTL)
+        except Exception as e:
+            print(f"Error writing user cache: {str(e)}")
+
+    async def put_unknown_email(self, email: str):
+        try:
+            await redis_ops.cache_unknown_email(email, ttl=USER_CACHE_NEGATIVE_TTL)
+        except Exception as e:
+            print(f"Error writing user cache: {str(e)}")
+
+    async def invalidate(self, user_id: Optional[str] = None, email: Optional[str] = None):
+        if user_id:
+            entry = self._local.pop(f"id:{user_id}", None)
+            if entry and entry[0] and not email:
+                email = entry[0]["email"]
+        if email:
+            self._local.pop(f"email:{email}", None)
+        try:
+            await redis_ops.invalidate_cached_user(user_id=user_id, email=email)
+        except Exception as e:
+            print(f"Error invalidating user cache: {str(e)}")
+
+    def metrics(self) -> dict:
+        hits = self.local_hits + self.redis_hits + self.negative_hits
+        return {
+            "local_hits": self.local_hits,
+            "redis_hits": self.redis_hits,
+            "negative_hits": self.negative_hits,
+            "misses": self.misses,
+            "hit_ratio": hits / (hits + self.misses) if hits + self.misses else 0.0,
+        }
+
+
+user_cache = UserCache()
@@ -9,10 +9,13 @@ export default function ChatPage({ params }) {
   const { conversationId: initialConvId } = unwrappedParams;
   const [currentConvId, setCurrentConvId] = useState(initialConvId);
   const [messages, setMessages] = useState([]);
+  const [olderCursor, setOlderCursor] = useState(null);
   const [inputValue, setInputValue] = useState('');
   const [isConnected, setIsConnected] = useState(false);
   const [isRecording, setIsRecording] = useState(false);
+  const [partialTranscript, setPartialTranscript] = useState('');
   const ws = useRef(null);
+  const audioCapture = useRef(null);
 
   useEffect(() => {
     const savedMessages = localStorage.getItem(`chatMessages_${currentConvId}`);
@@ -43,14 +46,39 @@ export default function ChatPage({ params }) {
           if (message.type === "new_conversation") {
             window.history.replaceState(null, '', `/chat/${message.conversation_id}`);
             setCurrentConvId(message.conversation_id);
+            window.dispatchEvent(new CustomEvent('conversation-created', {
+              detail: { conversationId: message.conversation_id }
+            }));
+          } else if (message.type === "conversation_labeled") {
+            // the topic is generated in the background; the sidebar shows a placeholder until then
+            window.dispatchEvent(new CustomEvent('conversation-labeled', {
+              detail: { conversationId: message.conversation_id, label: message.label }
+            }));
           }
 
-          if (message.type === "ai_message") {
-            setMessages(prev => [...prev, {
-              type: "AIMessage",
-              content: message.content
-            }]);
+          if (message.type === "ai_delta") {
+            // streamed tokens: append to the message being generated
+            setMessages(prev => {
+              const last = prev[prev.length - 1];
+              if (last && last.streaming && last.id === message.message_id) {
+                return [...prev.slice(0, -1), { ...last, content: last.content + message.content }];
+              }
+              return [...prev, { id: message.message_id, type: "AIMessage", content: message.content, streaming: true }];
+            });
+          } else if (message.type === "ai_delta_discard") {
+            setMessages(prev => prev.filter(msg => !(msg.streaming && msg.id === message.message_id)));
+          } else if (message.type === "ai_message") {
+            // final content replaces the streamed deltas of the same message
+            setMessages(prev => [
+              ...prev.filter(msg => !(msg.streaming && msg.id === message.message_id)),
+              { id: message.message_id, type: "AIMessage", content: message.content }
+            ]);
+          } else if (message.type === "audio_queued") {
+            setPartialTranscript(`(waiting for a voice slot, #${message.position} in line)`);
+          } else if (message.type === "audio_partial") {
+            setPartialTranscript(message.content);
           } else if (message.type === "audio_transcription") {
+            setPartialTranscript('');
             setMessages(prev => [...prev, {
               type: "AudioTranscription",
               content: message.content
@@ -62,6 +90,7 @@ export default function ChatPage({ params }) {
               urls: message.urls  // Array of meme URLs
             }]);
           } else if (message.type === "error") {
+            setPartialTranscript('');
             setMessages(prev => [...prev, {
               type: "Error",
               content: message.message
@@ -92,16 +121,22 @@ export default function ChatPage({ params }) {
     };
   }, [initialConvId]);
 
-  const fetchMessages = async () => {
+  const fetchMessages = async (before = null) => {
     try {
-      const res = await fetch(`http://localhost:8000/chat/${currentConvId}`, { credentials: 'include' });
+      const url = before
+        ? `http://localhost:8000/chat/${currentConvId}?before=${encodeURIComponent(before)}`
+        : `http://localhost:8000/chat/${currentConvId}`;
+      // the browser revalidates with If-None-Match; an unchanged conversation comes back as 304
+      const res = await fetch(url, { credentials: 'include' });
 
       if (!res.ok) throw new Error('Failed to fetch messages');
       const data = await res.json();
-      setMessages(data.messages || []);
+      // older pages go above the messages already shown
+      setMessages(prev => before ? [...(data.messages || []), ...prev] : (data.messages || []));
+      setOlderCursor(data.next_before || null);
     } catch (error) {
       console.error('Error fetching messages:', error);
-      setMessages([]);
+      if (!before) setMessages([]);
     }
   };
 
@@ -112,18 +147,47 @@ export default function ChatPage({ params }) {
     }
   };
 
-  const startRecording = () => {
-    if (ws.current?.readyState === WebSocket.OPEN) {
-      ws.current.send(JSON.stringify({ type: "audio" }));
+  const startRecording = async () => {
+    if (ws.current?.readyState !== WebSocket.OPEN) return;
+    try {
+      const stream = await navigator.mediaDevices.getUserMedia({ audio: { channelCount: 1 } });
+      // the server transcribes 16-bit mono PCM; 16 kHz needs no resampling there
+      const context = new AudioContext({ sampleRate: 16000 });
+      const source = context.createMediaStreamSource(stream);
+      const processor = context.createScriptProcessor(4096, 1, 1);
+      processor.onaudioprocess = (event) => {
+        if (ws.current?.readyState !== WebSocket.OPEN) return;
+        const samples = event.inputBuffer.getChannelData(0);
+        const pcm = new Int16Array(samples.length);
+        for (let i = 0; i < samples.length; i++) {
+          const sample = Math.max(-1, Math.min(1, samples[i]));
+          pcm[i] = sample < 0 ? sample * 0x8000 : sample * 0x7fff;
+        }
+        ws.current.send(pcm.buffer);
+      };
+      source.connect(processor);
+      processor.connect(context.destination);
+      audioCapture.current = { stream, context, processor };
+
+      ws.current.send(JSON.stringify({ type: "audio", sample_rate: context.sampleRate }));
       setIsRecording(true);
+    } catch (error) {
+      console.error("Error starting microphone:", error);
     }
   };
 
   const stopRecording = () => {
+    const capture = audioCapture.current;
+    if (capture) {
+      capture.processor.disconnect();
+      capture.stream.getTracks().forEach(track => track.stop());
+      capture.context.close();
+      audioCapture.current = null;
+    }
     if (ws.current?.readyState === WebSocket.OPEN) {
       ws.current.send(JSON.stringify({ type: "stop_audio" }));
-      setIsRecording(false);
     }
+    setIsRecording(false);
   };
 
   if (!isConnected) return <div>Connecting...</div>;
@@ -132,6 +196,9 @@ export default function ChatPage({ params }) {
     <div>
       <h1>Chat: {currentConvId === 'new' ? 'New Chat' : currentConvId}</h1>
       <div>
+        {olderCursor && (
+          <button onClick={() => fetchMessages(olderCursor)}>Load earlier messages</button>
+        )}
         {messages.map((msg, i) => (
           <div key={i}>
             {msg.type === "AudioTranscription" ? (
@@ -156,6 +223,9 @@ export default function ChatPage({ params }) {
             )}
           </div>
         ))}
+        {partialTranscript && (
+          <div><em>You: {partialTranscript}…</em></div>
+        )}
       </div>
       <input value={inputValue} onChange={(e) => setInputValue(e.target.value)} placeholder="Type a message..." onKeyPress={(e) => e.key === 'Enter' && sendMessage()} />
       <button onClick={sendMessage}>Send</button>
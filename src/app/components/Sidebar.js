@@ -1,15 +1,25 @@
 'use client'
 
-import { useEffect, useState } from 'react'
+import { useEffect, useRef, useState } from 'react'
 import Link from 'next/link'
 
 export default function Sidebar() {
   const [conversations, setConversations] = useState([])
+  const [nextCursor, setNextCursor] = useState(null)
+  // topics pushed by the server after the conversation list was fetched
+  const labels = useRef({})
 
-  useEffect(() => {
-    async function fetchConversations() {
+  function withLabel(convo) {
+    const label = labels.current[convo.id]
+    return label ? { ...convo, topic: label } : convo
+  }
+
+  async function fetchConversations(cursor = null) {
       try {
-        const response = await fetch('http://localhost:8000/fetch_conversations', {
+        const url = cursor
+          ? `http://localhost:8000/fetch_conversations?cursor=${encodeURIComponent(cursor)}`
+          : 'http://localhost:8000/fetch_conversations'
+        const response = await fetch(url, {
           credentials: 'include'
         })
         
@@ -24,17 +34,39 @@ export default function Sidebar() {
         }
     
         const data = await response.json()
-        setConversations(data.conversations || [])
+        // later pages are appended below the ones already shown
+        const fetched = (data.conversations || []).map(withLabel)
+        setConversations(prev => cursor ? [...prev, ...fetched] : fetched)
+        setNextCursor(data.next_cursor || null)
         
       } catch (error) {
         console.error('Fetch error:', error)
-        setConversations([]) // Reset to empty array on error
+        if (!cursor) setConversations([]) // Reset to empty array on error
       }
-    }
+  }
 
+  useEffect(() => {
     fetchConversations()
   }, [])
 
+  // the chat page relays the websocket events of the conversation it is showing
+  useEffect(() => {
+    function onCreated() {
+      fetchConversations()
+    }
+    function onLabeled(event) {
+      const { conversationId, label } = event.detail
+      labels.current[conversationId] = label
+      setConversations(prev => prev.map(withLabel))
+    }
+    window.addEventListener('conversation-created', onCreated)
+    window.addEventListener('conversation-labeled', onLabeled)
+    return () => {
+      window.removeEventListener('conversation-created', onCreated)
+      window.removeEventListener('conversation-labeled', onLabeled)
+    }
+  }, [])
+
   return (
     <div className="w-64 bg-gray-100 p-4 border-r border-gray-200">
       <h2 className="text-lg font-semibold mb-4">Your Conversations</h2>
@@ -57,6 +89,14 @@ export default function Sidebar() {
           <p className="text-gray-500">No conversations yet.</p>
         )}
       </ul>
+      {nextCursor && (
+        <button
+          onClick={() => fetchConversations(nextCursor)}
+          className="mt-2 w-full p-2 text-sm text-gray-600 hover:bg-gray-200 rounded-lg"
+        >
+          Load more
+        </button>
+      )}
     </div>
   )
 }
\ No newline at end of file
@@ -0,0 +1,41 @@
+from collections import OrderedDict
+
+import pytest
+
+from api import token_counter
+
+
+def encoding_available() -> bool:
+    try:
+        token_counter.get_encoding()
+        return True
+    except Exception:
+        return False
+
+
+# tiktoken downloads its encoding on first use
+needs_encoding = pytest.mark.skipif(not encoding_available(), reason="tiktoken encoding is not available offline")
+
+
+class WhitespaceEncoding:
+    """Offline stand-in for the tiktoken encoding: one token per whitespace-separated word."""
+
+    def __init__(self):
+        self.encoded = []
+
+    def encode_ordinary(self, text: str):
+        self.encoded.append(text)
+        return text.split()
+
+    def encode_ordinary_batch(self, texts):
+        return [self.encode_ordinary(text) for text in texts]
+
+
+@pytest.fixture
+def stub_encoding(monkeypatch) -> WhitespaceEncoding:
+    """Count tokens with `WhitespaceEncoding`, starting from empty caches."""
+    encoding = WhitespaceEncoding()
+    monkeypatch.setattr(token_counter, "_encoding", encoding)
+    monkeypatch.setattr(token_counter, "_message_token_cache", OrderedDict())
+    monkeypatch.setattr(token_counter, "_role_token_counts", {})
+    return encoding
@@ -0,0 +1,109 @@
+import random
+
+import pytest
+from langchain_core.language_models.fake_chat_models import FakeMessagesListChatModel
+from langchain_core.messages import AIMessage, HumanMessage, SystemMessage, trim_messages
+from langgraph.checkpoint.memory import MemorySaver
+from langgraph.graph import StateGraph, START, END
+from langgraph.prebuilt import create_react_agent
+
+from api.chat_handle import State, generate_contextual_meme, save_memory, prepare_model_inputs
+from api.context_window import (
+    CONTEXT_WINDOW_METADATA_KEY, add_messages_with_window, merge_messages_with_window, select_context_window
+)
+from api.token_counter import tiktoken_counter
+
+
+class ToolCallingFakeModel(FakeMessagesListChatModel):
+    def bind_tools(self, tools, **kwargs):
+        return self
+
+
+def conversation(turns: int, system: bool = False):
+    messages = [SystemMessage(content="You are MoodMender.", id="system")] if system else []
+    for i in range(turns):
+        messages.append(HumanMessage(content=f"question {i} " + "blah " * 40, id=f"human-{i}"))
+        messages.append(AIMessage(content=f"answer {i} " + "meh " * 40, id=f"ai-{i}"))
+    return messages
+
+
+def test_state_builds_the_app_graph():
+    graph = create_react_agent(
+        ToolCallingFakeModel(responses=[AIMessage(content="hi")]),
+        [generate_contextual_meme, save_memory],
+        prompt=prepare_model_inputs,
+        checkpointer=MemorySaver(),
+        state_schema=State,
+    )
+    assert "agent" in graph.nodes
+
+
+def test_reducer_runs_in_a_graph(stub_encoding):
+    builder = StateGraph(State)
+    builder.add_node("reply", lambda state: {"messages": [AIMessage(content="hey", id="reply")]})
+    builder.add_edge(START, "reply")
+    builder.add_edge("reply", END)
+    result = builder.compile().invoke({"messages": [HumanMessage(content="hello", id="hello")]})
+
+    assert [msg.id for msg in result["messages"]] == ["hello", "reply"]
+    assert all(CONTEXT_WINDOW_METADATA_KEY in msg.response_metadata for msg in result["messages"])
+
+
+def test_reducer_takes_two_arguments(stub_encoding):
+    merged = add_messages_with_window([], [HumanMessage(content="hello", id="hello")])
+    assert [msg.id for msg in merged] == ["hello"]
+
+
+def test_window_matches_trim_messages(stub_encoding):
+    messages = []
+    for msg in conversation(30, system=True):
+        messages = merge_messages_with_window(messages, [msg], 600)
+    expected = trim_messages(
+        messages, max_tokens=600, strategy="last", token_counter=tiktoken_counter, include_system=True, allow_partial=False
+    )
+    assert [msg.id for msg in select_context_window(messages, max_tokens=600)] == [msg.id for msg in expected]
+
+
+def test_max_messages_window_with_system_message_matches_trim_messages(stub_encoding):
+    messages = []
+    for msg in conversation(30, system=True):
+        messages = merge_messages_with_window(messages, [msg], 120)
+    expected = trim_messages(
+        messages[-9:], max_tokens=120, strategy="last", token_counter=tiktoken_counter, include_system=True, allow_partial=False
+    )
+    selected = select_context_window(messages, max_tokens=120, max_messages=9)
+    assert expected
+    assert [msg.id for msg in selected] == [msg.id for msg in expected]
+
+
+def trimmed(messages, max_tokens):
+    return trim_messages(
+        messages, max_tokens=max_tokens, strategy="last", token_counter=tiktoken_counter, include_system=True, allow_partial=False
+    )
+
+
+@pytest.mark.parametrize("system", [False, True])
+def test_window_matches_trim_messages_after_every_append(stub_encoding, system):
+    rng = random.Random(7)
+    for budget in (30, 74, 150):
+        messages = [SystemMessage(content="word " * rng.randint(1, 20), id="system")] if system else []
+        messages = merge_messages_with_window([], messages, budget) if messages else []
+        for i in range(100):
+            cls = HumanMessage if i % 2 == 0 else AIMessage
+            msg = cls(content="word " * rng.randint(0, 40), id=f"msg-{i}")
+            messages = merge_messages_with_window(messages, [msg], budget)
+            expected = [msg.id for msg in trimmed(messages, budget)]
+            assert [msg.id for msg in select_context_window(messages, max_tokens=budget)] == expected, (budget, i)
+
+
+def test_window_with_system_message_pays_the_overhead_twice(stub_encoding):
+    # with a whitespace encoding: system 12 tokens, last message 42, the one before it 17;
+    # trim_messages counts 3 + 12 for the system message and 3 + 17 + 42 for the rest, 77 > 74
+    messages = [
+        SystemMessage(content="word " * 8, id="system"),
+        HumanMessage(content="word " * 13, id="before"),
+        AIMessage(content="word " * 38, id="last"),
+    ]
+    merged = merge_messages_with_window([], messages, 74)
+    assert [msg.id for msg in trimmed(merged, 74)] == ["system", "last"]
+    assert [msg.id for msg in select_context_window(merged, max_tokens=74)] == ["system", "last"]
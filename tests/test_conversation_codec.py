@@ -0,0 +1,29 @@
+import json
+
+import pytest
+
+from api.conversation_codec import CODEC_V1, decode_conversation, encode_conversation
+
+
+def test_v1_and_legacy_records_decode_to_the_same_conversation():
+    conversation = {"name": "Conversation 1", "topic": "Exam Stress", "timestamp": "2024-05-01T10:30:00"}
+    assert decode_conversation(encode_conversation(conversation)) == conversation
+    assert decode_conversation(json.dumps(conversation)) == conversation
+
+
+@pytest.mark.parametrize("raw", [
+    b"",
+    bytes([CODEC_V1, 0x05]),                    # a bare int
+    bytes([CODEC_V1]) + b"\xa3abc",             # a bare string
+    bytes([CODEC_V1, 0x80]),                    # a map
+    bytes([CODEC_V1, 0x91, 0x01]),              # too few fields
+    bytes([CODEC_V1, 0x95, 0, 0, 0, 0, 0]),     # too many fields
+    bytes([CODEC_V1]) + b"\x93\xc0\xc0\xa1x",   # timestamp is a string
+    bytes([CODEC_V1]) + b"\x93\x01\xc0\x01",    # name is an int
+    bytes([CODEC_V1]) + b"\x93\xc0\xc0\xcf\x7f\xf0\x00\x00\x00\x00\x00\x00",  # timestamp out of range
+    bytes([CODEC_V1, 0x93, 0xc1]),              # not msgpack
+    b"[1, 2]",                                  # legacy JSON that is not an object
+])
+def test_corrupted_records_raise_value_error(raw):
+    with pytest.raises(ValueError):
+        decode_conversation(raw)
@@ -0,0 +1,89 @@
+import time
+import asyncio
+
+import pytest
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+from api.http_client import CircuitBreaker, CircuitOpenError, ResilientHttpClient
+
+
+def half_open_breaker() -> CircuitBreaker:
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=30)
+    breaker.record_failure()
+    breaker.opened_at = time.monotonic() - 31
+    assert breaker.state == "half_open"
+    return breaker
+
+
+async def serve(handler):
+    app = web.Application()
+    app.router.add_route("*", "/", handler)
+    server = TestServer(app)
+    await server.start_server()
+    return server
+
+
+def test_cancelled_trial_frees_the_half_open_slot():
+    async def slow(request):
+        await asyncio.sleep(5)
+        return web.json_response({})
+
+    async def main():
+        server = await serve(slow)
+        client = ResilientHttpClient(breaker=half_open_breaker())
+        try:
+            with pytest.raises(asyncio.TimeoutError):
+                await asyncio.wait_for(client.request_json("GET", str(server.make_url("/"))), 0.2)
+            assert client.breaker.state == "half_open"
+            assert not client.breaker.is_open
+        finally:
+            await client.close()
+            await server.close()
+
+    asyncio.run(main())
+
+
+def test_undecodable_body_counts_as_failure_and_frees_the_trial():
+    calls = []
+
+    async def garbage(request):
+        calls.append(request.method)
+        return web.Response(text="<html>not json</html>")
+
+    async def main():
+        server = await serve(garbage)
+        client = ResilientHttpClient(breaker=half_open_breaker())
+        try:
+            with pytest.raises(ValueError):
+                await client.request_json("GET", str(server.make_url("/")))
+            assert calls == ["GET"]  # not retried
+            assert client.breaker.state == "open"
+            with pytest.raises(CircuitOpenError):
+                await client.request_json("GET", str(server.make_url("/")))
+        finally:
+            await client.close()
+            await server.close()
+
+    asyncio.run(main())
+
+
+def test_post_without_retries_is_sent_once():
+    calls = []
+
+    async def unavailable(request):
+        calls.append(request.method)
+        return web.Response(status=503)
+
+    async def main():
+        server = await serve(unavailable)
+        client = ResilientHttpClient(retries=2, backoff_base=0)
+        try:
+            with pytest.raises(Exception):
+                await client.request_json("POST", str(server.make_url("/")), data={"a": "b"}, retries=0)
+            assert calls == ["POST"]
+        finally:
+            await client.close()
+            await server.close()
+
+    asyncio.run(main())
@@ -0,0 +1,204 @@
+import time
+import asyncio
+
+import pytest
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+from api import redis_ops
+from api import meme_catalog as catalog_module
+from api.http_client import ResilientHttpClient
+from api.meme_catalog import MEME_CATALOG_LOCK_KEY, MEME_CATALOG_REDIS_KEY, MemeTemplateCatalog, TemplateRecord
+
+
+def memes(*names):
+    return {"success": True, "data": {"memes": [
+        {"id": str(i), "name": name, "box_count": 2, "url": f"https://i.imgflip.com/{i}.jpg"}
+        for i, name in enumerate(names)
+    ]}}
+
+
+class ImgflipStub:
+    """Local `get_memes` endpoint whose answer the test can change between calls."""
+
+    def __init__(self, payload: dict):
+        self.payload = payload
+        self.status = 200
+        self.delay = 0.0
+        self.calls = 0
+        self.server = None
+
+    async def get_memes(self, request):
+        self.calls += 1
+        await asyncio.sleep(self.delay)
+        if self.status != 200:
+            return web.Response(status=self.status)
+        return web.json_response(self.payload)
+
+    async def start(self) -> str:
+        app = web.Application()
+        app.router.add_get("/get_memes", self.get_memes)
+        self.server = TestServer(app)
+        await self.server.start_server()
+        return str(self.server.make_url("")).rstrip("/")
+
+    async def close(self):
+        await self.server.close()
+
+
+@pytest.fixture(autouse=True)
+def isolated_clients(monkeypatch):
+    # each test runs in its own event loop, so it gets its own HTTP session and Redis connection
+    monkeypatch.setattr(catalog_module, "imgflip_client", ResilientHttpClient(retries=1, backoff_base=0))
+    monkeypatch.setattr(redis_ops, "redis_client", None)
+    monkeypatch.setattr(redis_ops, "redis_binary_client", None)
+
+
+async def close_clients():
+    await catalog_module.imgflip_client.close()
+    if redis_ops.redis_client is not None:
+        await redis_ops.redis_client.delete(MEME_CATALOG_REDIS_KEY, MEME_CATALOG_LOCK_KEY)
+        await redis_ops.redis_client.aclose()
+        await redis_ops.redis_binary_client.aclose()
+
+
+def make_stale(catalog: MemeTemplateCatalog):
+    catalog._fetched_at = time.time() - catalog.ttl - 1
+
+
+def test_fresh_catalog_is_fetched_once_and_served_from_memory():
+    stub = ImgflipStub(memes("Drake", "Distracted Boyfriend"))
+
+    async def main():
+        catalog = MemeTemplateCatalog(base_url=await stub.start(), ttl=60)
+        try:
+            first, second = await asyncio.gather(catalog.get_templates(), catalog.get_templates())
+            assert first == second == (
+                TemplateRecord("0", "Drake", 2),
+                TemplateRecord("1", "Distracted Boyfriend", 2),
+            )
+            assert await catalog.get_templates() is first
+            assert stub.calls == 1  # concurrent cold reads share one fetch
+        finally:
+            await catalog.close()
+            await close_clients()
+            await stub.close()
+
+    asyncio.run(main())
+
+
+def test_stale_catalog_is_served_while_it_revalidates():
+    stub = ImgflipStub(memes("Drake"))
+
+    async def main():
+        catalog = MemeTemplateCatalog(base_url=await stub.start(), ttl=60)
+        try:
+            old = await catalog.get_templates()
+            make_stale(catalog)
+            stub.payload = memes("Drake", "Two Buttons")
+            stub.delay = 0.2
+
+            started = time.perf_counter()
+            served = await asyncio.gather(*(catalog.get_templates() for _ in range(5)))
+            assert time.perf_counter() - started < stub.delay  # nobody waited for the upstream
+            assert all(templates is old for templates in served)
+
+            await catalog._refresh_task
+            assert [record.name for record in await catalog.get_templates()] == ["Drake", "Two Buttons"]
+            assert not catalog.is_stale
+            assert stub.calls == 2  # one background refresh for all five stale reads
+        finally:
+            await catalog.close()
+            await close_clients()
+            await stub.close()
+
+    asyncio.run(main())
+
+
+def test_stale_catalog_is_served_while_imgflip_is_down():
+    stub = ImgflipStub(memes("Drake"))
+
+    async def main():
+        catalog = MemeTemplateCatalog(base_url=await stub.start(), ttl=60)
+        try:
+            old = await catalog.get_templates()
+            make_stale(catalog)
+            stub.status = 503
+
+            assert await catalog.get_templates() is old
+            await catalog._refresh_task
+            assert await catalog.get_templates() is old
+            assert catalog.is_stale  # the next read tries again
+            await catalog._refresh_task
+
+            stub.status = 200
+            stub.payload = memes("Drake", "Two Buttons")
+            await catalog.get_templates()
+            await catalog._refresh_task
+            assert len(await catalog.get_templates()) == 2
+        finally:
+            await catalog.close()
+            await close_clients()
+            await stub.close()
+
+    asyncio.run(main())
+
+
+async def connect_redis():
+    try:
+        await redis_ops.initialize_redis()
+    except Exception as e:
+        await redis_ops.redis_client.aclose()
+        await redis_ops.redis_binary_client.aclose()
+        redis_ops.redis_client = redis_ops.redis_binary_client = None
+        pytest.skip(f"Redis is not reachable at {redis_ops.REDIS_URL}: {str(e)}")
+    await redis_ops.redis_client.delete(MEME_CATALOG_REDIS_KEY, MEME_CATALOG_LOCK_KEY)
+
+
+def test_workers_share_the_catalog_through_redis():
+    stub = ImgflipStub(memes("Drake", "Two Buttons"))
+
+    async def main():
+        base_url = await stub.start()
+        first = MemeTemplateCatalog(base_url=base_url, ttl=60)
+        second = MemeTemplateCatalog(base_url=base_url, ttl=60)
+        try:
+            await connect_redis()
+            await first.start()
+            await second.start()  # a cold worker starts from the mirror
+            assert await second.get_templates() == await first.get_templates()
+            assert stub.calls == 1
+            assert not await redis_ops.redis_client.exists(MEME_CATALOG_LOCK_KEY)
+
+            # a worker whose copy went stale adopts a fresher one written by a peer
+            stub.payload = memes("Drake", "Two Buttons", "Change My Mind")
+            make_stale(first)
+            make_stale(second)
+            await first._store_in_redis()  # the mirror went stale with them
+            await first.refresh()
+            await second.refresh()
+            assert len(await second.get_templates()) == 3
+            assert stub.calls == 2
+        finally:
+            await first.close()
+            await second.close()
+            await close_clients()
+            await stub.close()
+
+    asyncio.run(main())
+
+
+def test_refresh_lock_is_only_released_by_its_owner():
+    async def main():
+        try:
+            await connect_redis()
+            token = await redis_ops.acquire_lock(MEME_CATALOG_LOCK_KEY, ttl=30)
+            assert token
+            assert await redis_ops.acquire_lock(MEME_CATALOG_LOCK_KEY, ttl=30) is None
+            assert not await redis_ops.release_lock(MEME_CATALOG_LOCK_KEY, "someone-else")
+            assert await redis_ops.release_lock(MEME_CATALOG_LOCK_KEY, token)
+            assert await redis_ops.acquire_lock(MEME_CATALOG_LOCK_KEY, ttl=30)
+        finally:
+            await close_clients()
+
+    asyncio.run(main())
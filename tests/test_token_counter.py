@@ -0,0 +1,63 @@
+from langchain_core.messages import AIMessage, HumanMessage, SystemMessage
+from langgraph.checkpoint.serde.jsonplus import JsonPlusSerializer
+
+from api import token_counter
+from api.token_counter import TOKEN_COUNT_METADATA_KEY, message_token_counts, str_token_counter, tiktoken_counter
+
+from tests.conftest import needs_encoding
+
+
+def test_counts_survive_a_checkpoint_round_trip(stub_encoding, monkeypatch):
+    messages = [HumanMessage(content="hello there", id="human-0"), AIMessage(content="hi, how are you", id="ai-0")]
+    counts = message_token_counts(messages)
+
+    serde = JsonPlusSerializer()
+    restored = serde.loads_typed(serde.dumps_typed(messages))
+    # a fresh worker: nothing in the in-process cache
+    monkeypatch.setattr(token_counter, "_message_token_cache", type(token_counter._message_token_cache)())
+    stub_encoding.encoded.clear()
+
+    assert message_token_counts(restored) == counts
+    assert stub_encoding.encoded == []
+    assert all(TOKEN_COUNT_METADATA_KEY in msg.response_metadata for msg in restored)
+
+
+def test_message_edited_under_the_same_id_is_recounted(stub_encoding):
+    msg = HumanMessage(content="one two three", id="human-0")
+    assert message_token_counts([msg]) == [3 + 1 + 3]
+
+    # same id, same length, different text, and the count of the old text still in its metadata
+    msg.content = "one" + " " * 10
+    assert message_token_counts([msg]) == [3 + 1 + 1]
+
+
+def test_only_new_messages_are_tokenized_in_one_batch(stub_encoding):
+    messages = [SystemMessage(content="be kind", id="system"), AIMessage(content="hello", id="ai-0")]
+    tiktoken_counter(messages)
+    stub_encoding.encoded.clear()
+
+    messages += [AIMessage(content="hi there", id="ai-1"), HumanMessage(content="how are you", id="human-0")]
+    assert tiktoken_counter(messages) == 3 + (3 + 1 + 2) + (3 + 1 + 1) + (3 + 1 + 2) + (3 + 1 + 3)
+    # the new messages, then the first "user" role, which is tokenized once per process
+    assert stub_encoding.encoded == ["hi there", "how are you", "user"]
+
+
+def test_cache_keeps_the_most_recently_used_counts(stub_encoding, monkeypatch):
+    monkeypatch.setattr(token_counter, "TOKEN_COUNT_CACHE_SIZE", 2)
+    # no ids and fresh objects every time, so only the cache can serve a count
+    for text in ("one", "two", "three", "one"):
+        message_token_counts([HumanMessage(content=text)])
+    assert len(token_counter._message_token_cache) == 2
+
+    stub_encoding.encoded.clear()
+    message_token_counts([HumanMessage(content="one"), HumanMessage(content="three")])
+    message_token_counts([HumanMessage(content="two")])
+    assert stub_encoding.encoded == ["two"]
+
+
+@needs_encoding
+def test_tiktoken_counts_match_the_cookbook_formula():
+    messages = [HumanMessage(content="Hello, how are you today?"), AIMessage(content="Great, thanks!")]
+    expected = 3 + sum(3 + str_token_counter(role) + str_token_counter(msg.content)
+                       for role, msg in zip(("user", "assistant"), messages))
+    assert tiktoken_counter(messages) == expected